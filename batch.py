@@ -0,0 +1,125 @@
+"""
+Batch mode: updates the recommendation playlists of several Spotify accounts in one process.
+
+    python batch.py users.json [--parallel=4] [--full-sync] [--sequential] [--no-stream] [--providers=openai] [--metrics-port=9108]
+
+users.json lists the accounts, each with its own OAuth token cache (log in once per account with
+`python spotify_playlist.py --token-cache=PATH`) and optionally its own liked songs store:
+
+    [{"name": "alice", "token_cache": ".spotify_cache_alice"}, {"name": "bob", "token_cache": ".spotify_cache_bob"}]
+
+All accounts share one HTTP connection pool, the model clients and router, one Spotify search pool and
+the search-resolution cache (a song suggested to several users is searched once), and the global
+Spotify / per-provider rate limits and retries of scheduler.py (API_LIMITS).
+"""
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from helper_functions import (
+    OPENAI_API_KEY, OPENROUTER_API_KEY, SPOTIFY_API_PREFIX, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_REDIRECT_URI,
+    get_spotify_client
+)
+from clients import get_requests_session, print_connection_stats
+from library_cache import LibraryStore
+from resolution_cache import ResolutionCache
+from metrics import metrics, start_metrics_server
+from scheduler import print_scheduler_stats
+from settings import BATCH_MAX_CONCURRENT_REQUESTS, CACHE_DB_PATH, METRICS_LOG_PATH
+from spotify_playlist import check_provider_args, get_provider_router_from_args, update_recommendation_playlists
+
+DEFAULT_PARALLEL_USERS = 4
+
+
+def load_users(path):
+    with open(path, encoding="utf-8") as f:
+        users = json.load(f)
+    for user in users:
+        if not user.get('name') or not user.get('token_cache'):
+            raise ValueError(f"Every user in {path} needs a 'name' and a 'token_cache': {user}")
+        user.setdefault('cache_db', f".spotifai_cache_{user['name']}.db")
+    return users
+
+
+def run_batch(users, provider_router, parallel_users=DEFAULT_PARALLEL_USERS, full_sync=False, pipelined=True):
+    """
+    Runs update_recommendation_playlists for every user, `parallel_users` at a time, on shared resources.
+    Returns {user name: number of songs collected, or None if the run failed}.
+    """
+    http_session = get_requests_session(BATCH_MAX_CONCURRENT_REQUESTS)
+    search_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENT_REQUESTS)
+    resolution_cache = ResolutionCache(CACHE_DB_PATH)
+    purged = resolution_cache.purge_expired()
+    if purged:
+        print(f"Dropped {purged} expired search results from the cache.")
+
+    def run_user(user):
+        sp_client = get_spotify_client(user['token_cache'], requests_session=http_session, interactive=False)
+        if not sp_client:
+            return None
+        library_store = LibraryStore(user['cache_db'])
+        try:
+            with metrics.span("user_run", user=user['name']):
+                collector = update_recommendation_playlists(
+                    sp_client, provider_router, library_store, resolution_cache,
+                    full_sync=full_sync, pipelined=pipelined, search_executor=search_executor
+                )
+        finally:
+            library_store.close()
+        return len(collector) if collector else 0
+
+    def run_user_safely(user):
+        try:
+            return run_user(user)
+        except Exception as e:
+            print(f"Run for user '{user['name']}' failed: {e.__class__.__name__}: {e}")
+            return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, parallel_users)) as user_executor:
+            results = dict(zip((user['name'] for user in users), user_executor.map(run_user_safely, users)))
+    finally:
+        search_executor.shutdown(wait=False, cancel_futures=True)
+        print(f"\nSearch cache: {resolution_cache.hits} hits, {resolution_cache.misses} misses, "
+              f"{resolution_cache.joined_searches} searches shared between users.")
+        resolution_cache.close()
+    return results
+
+
+def main(argv):
+    """Batch run; `argv` are the command line arguments (sys.argv[1:]), see the usage above."""
+    args = [arg for arg in argv if not arg.startswith("--")]
+    if len(args) != 1:
+        print(__doc__.strip().splitlines()[2].strip()); return 1
+    if not ((SPOTIFY_API_PREFIX or (SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET and SPOTIFY_REDIRECT_URI))
+            and (OPENROUTER_API_KEY or OPENAI_API_KEY)):
+        print("Error: Missing environment variables. Please check .env file."); return 1
+    if not check_provider_args(argv): return 1
+
+    users = load_users(args[0])
+    parallel_users = next((int(arg.split("=", 1)[1]) for arg in argv if arg.startswith("--parallel=")),
+                          DEFAULT_PARALLEL_USERS)
+    provider_router = get_provider_router_from_args(argv)
+    metrics_port = next((int(arg.split("=", 1)[1]) for arg in argv if arg.startswith("--metrics-port=")), None)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    metrics.begin_run(mode="batch", users=len(users), parallel_users=parallel_users)
+
+    start_time = time.monotonic()
+    results = run_batch(users, provider_router, parallel_users,
+                        full_sync="--full-sync" in argv, pipelined="--sequential" not in argv)
+    provider_router.print_stats()
+    print_connection_stats()
+    print_scheduler_stats()
+    run_record = metrics.end_run(METRICS_LOG_PATH, results=results)
+    metrics.print_stage_timings(run_record)
+
+    print(f"\nBatch finished in {time.monotonic() - start_time:.1f}s:")
+    for name, collected in results.items():
+        print(f"  {name}: " + (f"{collected} new songs" if collected is not None else "failed"))
+    return 0 if all(collected is not None for collected in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
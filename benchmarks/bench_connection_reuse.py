@@ -0,0 +1,121 @@
+"""
+Benchmark of connection reuse for the model APIs against a local mock chat-completions server.
+Sends the same requests with a new httpx client per request (what building an OpenAI client or
+calling requests.post on every turn amounts to) and with the long-lived client from clients.py,
+and prints the connect / first-byte timings recorded by clients.ConnectionStats.
+The mock server speaks TLS with a throwaway self-signed certificate (made with the openssl command),
+and --handshake-ms delays every TLS handshake to stand in for the round trips of connecting to a
+remote API: the delay is counted as connect time, like the real setup.
+
+    python benchmarks/bench_connection_reuse.py [--requests 50] [--handshake-ms 50] [--response-ms 20]
+"""
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clients import get_connection_stats, get_http_client
+
+COMPLETION = json.dumps({
+    "choices": [{"message": {"role": "assistant", "content": json.dumps(
+        {"recommendations": [{"track": "Imagine", "artist": "John Lennon"}]}
+    )}}]
+}).encode()
+
+
+def make_certificate(directory):
+    """Self-signed certificate for 127.0.0.1. Returns (cert_path, key_path)."""
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                    "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key_path, "-out", cert_path], check=True, capture_output=True)
+    return cert_path, key_path
+
+
+def start_mock_server(handshake_seconds, response_seconds, cert_path, key_path):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+
+    class Server(ThreadingHTTPServer):
+        def get_request(self):
+            sock, address = super().get_request()
+            # The handshake runs in the connection's own thread (Handler.setup), so a slow one doesn't hold up accept
+            return context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False), address
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive
+        disable_nagle_algorithm = True # Headers and body go out as separate writes
+
+        def setup(self):
+            # The client is waiting for the server's handshake reply: counted as its connect time, once per connection
+            time.sleep(handshake_seconds)
+            self.request.do_handshake()
+            super().setup()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(response_seconds)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(COMPLETION)))
+            self.end_headers()
+            self.wfile.write(COMPLETION)
+
+        def log_message(self, *args):
+            pass
+
+    server = Server(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def post_completion(client, url):
+    response = client.post(url, json={"model": "mock", "messages": [{"role": "user", "content": "hi"}]})
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--handshake-ms", type=float, default=50.0)
+    parser.add_argument("--response-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    cert_dir = tempfile.TemporaryDirectory()
+    cert_path, key_path = make_certificate(cert_dir.name)
+    os.environ["SSL_CERT_FILE"] = cert_path # Trusted by the httpx clients made from here on
+    server = start_mock_server(args.handshake_ms / 1000, args.response_ms / 1000, cert_path, key_path)
+    url = f"https://127.0.0.1:{server.server_address[1]}/chat/completions"
+
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        client = get_http_client.__wrapped__("new client per request") # Bypasses the registry
+        post_completion(client, url)
+        client.close()
+    fresh_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client = get_http_client("shared client")
+    for _ in range(args.requests):
+        post_completion(client, url)
+    shared_time = time.perf_counter() - start
+
+    print(f"{args.requests} requests, {args.handshake_ms:.0f}ms per new connection, {args.response_ms:.0f}ms per response:")
+    for name, total in (("new client per request", fresh_time), ("shared client", shared_time)):
+        print(f"  {get_connection_stats(name).summary()}; total {total:.2f}s")
+    server.shutdown()
+    cert_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Import-time budget of the command line: every case runs in a fresh interpreter under `python -X importtime`,
+and its import cost is what it imports on top of a bare interpreter (`python -c pass`). Each case can have a
+budget in milliseconds and modules it must not load; the script exits with 1 when one is exceeded.
+
+    python benchmarks/bench_import_time.py [--repeat 5]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(REPO_ROOT, "cli.py")
+HEAVY_MODULES = ("openai", "spotipy", "httpx", "requests", "numpy", "dotenv")
+_IMPORT_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def cases(scratch_dir):
+    """(name, interpreter arguments, budget in ms or None, modules it must not import)"""
+    stats_args = ["--db", os.path.join(scratch_dir, "none.db"), "--runs", os.path.join(scratch_dir, "none.jsonl")]
+    return [
+        ("cli.py --help", [CLI, "--help"], 50, HEAVY_MODULES),
+        ("cli.py stats", [CLI, "stats", *stats_args], 50, HEAVY_MODULES),
+        # What `service.py --trigger` loads before sending its request (most of it is the stdlib HTTP client)
+        ("service.py --trigger", ["-c", "import service"], 100, (*HEAVY_MODULES, "sqlite3")),
+        ("sync-cache backend", ["-c", "import helper_functions, library_cache, playlist_sync"], None, ("openai", "httpx", "numpy")),
+        ("run backend (before providers)", ["-c", "import spotify_playlist"], None, ("openai", "httpx")),
+    ]
+
+
+def measure(arguments, cwd):
+    """(top-level modules with their cumulative microseconds, packages imported, wall-clock seconds) of one fresh process."""
+    start = time.perf_counter()
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    completed = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=cwd, env=env,
+                               capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{arguments} failed:\n{completed.stderr[-2000:]}")
+    top_level, imported = {}, set()
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            cumulative, indent, module = match.groups()
+            imported.add(module.split(".")[0])
+            if not indent:
+                top_level[module] = int(cumulative)
+    return top_level, imported, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case; the median is reported")
+    args = parser.parse_args()
+
+    over_budget = False
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        baseline, _, _ = measure(["-c", "pass"], scratch_dir)
+        print(f"{'case':<32} {'imports':>9} {'process':>9}  budget")
+        for name, arguments, budget_ms, forbidden in cases(scratch_dir):
+            import_ms, wall_ms, imported = [], [], set()
+            for _ in range(max(1, args.repeat)):
+                top_level, imported, wall = measure(arguments, scratch_dir)
+                import_ms.append(sum(us for module, us in top_level.items() if module not in baseline) / 1000)
+                wall_ms.append(wall * 1000)
+            median_ms = statistics.median(import_ms)
+            loaded = sorted(set(forbidden) & imported)
+            failed = (budget_ms is not None and median_ms > budget_ms) or bool(loaded)
+            over_budget = over_budget or failed
+            verdict = f"{budget_ms}ms" if budget_ms is not None else "-"
+            if loaded:
+                verdict += f", loaded {', '.join(loaded)}"
+            print(f"{name:<32} {median_ms:7.1f}ms {statistics.median(wall_ms):7.1f}ms  {verdict}"
+                  + ("  OVER BUDGET" if failed else ""))
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Micro-benchmark of response_parser.parse_recommendations over a corpus of model responses.
+Compares it with the parsing the OpenRouter path did before, which the OpenAI path only
+covered for its own `{"recommendations": [...]}` shape.
+
+The corpus is made of:
+- benchmarks/data/model_responses.jsonl (one {"provider", "shape", "content"} per line): 15 hand-written
+  responses, one or more per shape the parser handles;
+- the model replies of replay.py recordings (spotify_playlist.py --record=PATH), as "recorded" entries.
+  The bundled one, benchmarks/data/recorded_replies.jsonl, holds the 6 model exchanges (streamed and not)
+  of two runs recorded against benchmarks/synthetic_backend.py: they went through the production
+  clients, but their content is generated, not model output. Pass --fixture to use real recordings.
+
+    python benchmarks/bench_response_parser.py [--repeat 2000] [--corpus path.jsonl] [--fixture run.jsonl ...]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay import is_model_request, load_fixture
+from response_parser import parse_recommendations
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_CORPUS = os.path.join(DATA_DIR, "model_responses.jsonl")
+DEFAULT_FIXTURE = os.path.join(DATA_DIR, "recorded_replies.jsonl")
+
+
+def legacy_parse(raw_content):
+    # Previous get_recommendations_openrouter parsing, kept here as the baseline.
+    def extract(parsed_content):
+        if isinstance(parsed_content, list):
+            return parsed_content
+        if isinstance(parsed_content, dict) and len(parsed_content.keys()) == 1:
+            key = list(parsed_content.keys())[0]
+            if isinstance(parsed_content[key], list):
+                return parsed_content[key]
+        return []
+
+    try:
+        recommendations = extract(json.loads(raw_content))
+    except json.JSONDecodeError:
+        content_to_parse = raw_content
+        if content_to_parse.startswith("```json"): content_to_parse = content_to_parse[7:]
+        if content_to_parse.endswith("```"): content_to_parse = content_to_parse[:-3]
+        try:
+            recommendations = extract(json.loads(content_to_parse.strip()))
+        except json.JSONDecodeError:
+            return []
+    return [{"track": str(rec["track"]), "artist": str(rec["artist"])}
+            for rec in recommendations if isinstance(rec, dict) and "track" in rec and "artist" in rec]
+
+
+def recorded_responses(fixture_path):
+    """Corpus entries for the model replies (streamed or not) of a replay.py recording."""
+    entries = []
+    for exchange in load_fixture(fixture_path):
+        if not is_model_request(exchange['path']) or exchange['status'] != 200:
+            continue
+        if exchange.get('stream'):
+            chunks = [json.loads(line[len("data: "):]) for line in exchange['body'].splitlines()
+                      if line.startswith("data: ") and line != "data: [DONE]"]
+            content = "".join(chunk['choices'][0]['delta'].get('content') or ""
+                              for chunk in chunks if chunk.get('choices'))
+        else:
+            content = json.loads(exchange['body'])['choices'][0]['message']['content']
+        if content:
+            entries.append({"provider": exchange['host'], "shape": "recorded", "content": content})
+    return entries
+
+
+def time_per_call(fn, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(content)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="hand-written corpus ('' for none)")
+    parser.add_argument("--fixture", action="append", help="replay.py recording to take model replies from "
+                                                            "(default: the bundled one)")
+    args = parser.parse_args()
+
+    corpus = []
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [json.loads(line) for line in f if line.strip()]
+    for fixture_path in args.fixture or [DEFAULT_FIXTURE]:
+        corpus.extend(recorded_responses(fixture_path))
+
+    print(f"{'shape':<22} {'provider':<16} {'path':<10} {'recs':>4} {'legacy':>6} {'new us':>8} {'legacy us':>10}")
+    total_new = total_legacy = 0.0
+    for entry in corpus:
+        content = entry["content"]
+        recommendations, parse_path, _ = parse_recommendations(content)
+        new_time = time_per_call(parse_recommendations, content, args.repeat)
+        legacy_time = time_per_call(legacy_parse, content, args.repeat)
+        total_new += new_time
+        total_legacy += legacy_time
+        print(f"{entry['shape']:<22} {entry['provider']:<16} {parse_path or '-':<10} {len(recommendations):>4} "
+              f"{len(legacy_parse(content)):>6} {new_time * 1e6:>8.1f} {legacy_time * 1e6:>10.1f}")
+    print(f"\nWhole corpus ({len(corpus)} responses): {total_new * 1e6:.1f} us per pass "
+          f"(legacy {total_legacy * 1e6:.1f} us).")
+
+
+if __name__ == "__main__":
+    main()
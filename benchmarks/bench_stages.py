@@ -0,0 +1,205 @@
+"""
+End-to-end stage benchmark, fully offline: each library size gets a synthetic Spotify account and model
+(synthetic_backend.py) behind a local replay.StandInServer, and the real code paths are timed stage by
+stage: library fetch (full, then incremental), history fetch (cold, then unchanged snapshot), prompt
+sample, model turn, verification of one reply, playlist write, and a whole run.
+
+    python benchmarks/bench_stages.py [--sizes 100,1000,10000,100000] [--history 1000] [--latency-ms 0]
+                                      [--model-latency-ms 500] [--rate-limit-rps 0] [--no-client-limit]
+                                      [--verbose] [--repeat 1] [--save-baseline PATH]
+                                      [--baseline PATH [--tolerance 0.5]]
+
+--latency-ms delays every Spotify request, --model-latency-ms every model reply, and --rate-limit-rps
+makes the server answer requests beyond that rate with 429s, as Spotify does. Spotify requests go
+through a scheduler with the production limits of scheduler.API_LIMITS (a 20 requests/s token bucket),
+so the timings are those of a real run; --no-client-limit only keeps the concurrency limit, to time
+the code itself.
+
+--repeat runs every size several times and keeps the fastest time of each stage. --save-baseline records
+the results to a JSON file; --baseline compares each stage with it and exits with 1 when a stage got
+slower (or made more requests) than the baseline by more than --tolerance, plus --slack-ms so that the
+millisecond stages don't fail on noise.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper_functions import (get_or_create_playlist_ids, get_spotify_client, iter_verified_songs, stream_recommendations_openai,
+                              sync_liked_songs)
+from clients import get_requests_session
+from library_cache import LibraryStore
+from playlist_sync import get_playlist_state, sync_playlist
+from providers import Provider, ProviderRouter
+from replay import StandInServer
+from resolution_cache import ResolutionCache
+from scheduler import API_LIMITS, RequestScheduler
+from settings import ALL_RECS_PLAYLIST_NAME, MAX_SONGS_TO_MODEL_PROMPT, NEW_PLAYLIST_NAME
+from spotify_playlist import update_recommendation_playlists
+from synthetic_backend import USER_ID, SyntheticBackend
+from taste_profile import TasteProfile
+
+SPOTIFY_BENCH_CONCURRENCY = 32
+
+
+class StageTimer:
+    def __init__(self, server):
+        self.server = server
+        self.results = [] # (stage, seconds, server requests, 429s)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.server.reset_stats()
+        start = time.perf_counter()
+        yield
+        self.results.append((name, time.perf_counter() - start, self.server.requests, self.server.rate_limited))
+
+
+def run_stages(size, args, servers):
+    backend = SyntheticBackend(size, history_size=args.history, seed=args.seed)
+    server = StandInServer(backend, latency=args.latency_ms / 1000, model_latency=args.model_latency_ms / 1000,
+                           rate_limit_rps=args.rate_limit_rps or None).start()
+    servers.append(server) # Left up until the end: abandoned speculative model requests may still reach it
+    timer = StageTimer(server)
+    db_path = os.path.join(tempfile.mkdtemp(prefix="spotifai_bench_"), "cache.db")
+    library_store = LibraryStore(db_path)
+    resolution_cache = ResolutionCache(db_path)
+    if args.no_client_limit: # The stand-in server's 429s (if any) are the only limit
+        throttle = RequestScheduler("spotify (bench)", max_concurrency=SPOTIFY_BENCH_CONCURRENCY)
+    else:
+        throttle = RequestScheduler("spotify (bench)", **API_LIMITS["spotify"])
+    model_url = server.model_base_url
+
+    def request_model(history, on_recommendation=None, cancel=None):
+        return stream_recommendations_openai("bench-key", history, on_recommendation=on_recommendation,
+                                             base_url=model_url, cancel=cancel)
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sp = get_spotify_client(requests_session=get_requests_session(), api_prefix=server.spotify_prefix)
+
+        with timer.stage("library fetch (full)"):
+            sync_liked_songs(sp, library_store, full=True, throttle=throttle)
+        with timer.stage("library fetch (incremental)"):
+            sync_liked_songs(sp, library_store, throttle=throttle)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            playlist_ids = get_or_create_playlist_ids(sp, USER_ID, [ALL_RECS_PLAYLIST_NAME, NEW_PLAYLIST_NAME], library_store)
+        with timer.stage("history fetch (cold)"):
+            get_playlist_state(sp, playlist_ids[ALL_RECS_PLAYLIST_NAME], library_store, throttle)
+        with timer.stage("history fetch (unchanged)"):
+            get_playlist_state(sp, playlist_ids[ALL_RECS_PLAYLIST_NAME], library_store, throttle)
+
+        with timer.stage("prompt sample"):
+            sample = TasteProfile(library_store.get_liked_songs_details()).sample(MAX_SONGS_TO_MODEL_PROMPT)
+        prompt = "Recommend songs like these:\n" + "\n".join(f"- \"{s['track']}\" by {s['artist']}" for s in sample)
+
+        with timer.stage("model turn"):
+            result = request_model([{"role": "user", "content": prompt}])
+        with timer.stage("verification (one reply)"):
+            verified = [found for _, found in iter_verified_songs(sp, result.recommendations, resolution_cache,
+                                                                  max_workers=SPOTIFY_BENCH_CONCURRENCY, throttle=throttle)
+                        if found]
+        with timer.stage("playlist write"):
+            sync_playlist(sp, playlist_ids[NEW_PLAYLIST_NAME], verified, library_store, throttle)
+
+        router = ProviderRouter([Provider("bench", request_model, streaming=True)])
+        with timer.stage("whole run"):
+            update_recommendation_playlists(sp, router, library_store, resolution_cache, throttle=throttle)
+    finally:
+        library_store.close()
+        resolution_cache.close()
+    return timer.results
+
+
+def compare_stage(baseline, seconds, requests, tolerance, slack):
+    """The ways a stage regressed against its `baseline` {"seconds", "requests"} entry."""
+    regressions = []
+    if seconds > baseline["seconds"] * (1 + tolerance) + slack:
+        regressions.append(f"{seconds / max(baseline['seconds'], 1e-6):.1f}x the baseline's {baseline['seconds']:.3f}s")
+    if requests > baseline["requests"] * (1 + tolerance):
+        regressions.append(f"{requests} requests, baseline {baseline['requests']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--history", type=int, default=1000, help="songs in the recommendations history playlist")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--model-latency-ms", type=float, default=500.0)
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0)
+    parser.add_argument("--no-client-limit", action="store_true", help="no client-side Spotify rate limit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the output of the code under test")
+    parser.add_argument("--save-baseline", metavar="PATH", help="record the results as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with a recorded baseline, exit 1 on a regression")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size; the fastest time of each stage is kept")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown over the baseline (0.5: 50%%)")
+    parser.add_argument("--slack-ms", type=float, default=50.0, help="allowed slowdown on top of --tolerance")
+    args = parser.parse_args()
+    logging.getLogger("spotipy").setLevel(logging.CRITICAL) # 429s are expected here; the scheduler retries them
+    report = sys.stdout
+    if not args.verbose:
+        # The code under test prints as it goes, also from threads that outlive their stage (e.g. an abandoned
+        # speculative model stream, closed once its run is over): left as it is for the rest of the process.
+        sys.stdout = open(os.devnull, "w")
+
+    options = {name: getattr(args, name)
+               for name in ("history", "latency_ms", "model_latency_ms", "rate_limit_rps", "no_client_limit", "seed",
+                            "repeat")}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            recorded = json.load(f)
+        if recorded["options"] != options:
+            print(f"Warning: the baseline was recorded with other options ({recorded['options']}), "
+                  f"results may not compare.", file=report)
+        baseline = recorded["sizes"]
+
+    import openai # Loaded up front: otherwise the first model turn of the process also times the SDK import
+
+    results = {}
+    regressed = False
+    servers = []
+    try:
+        for size in (int(size) for size in args.sizes.split(",")):
+            print(f"\n{size} liked songs, {args.history} in history:", file=report)
+            results[str(size)] = {}
+            runs = [run_stages(size, args, servers) for _ in range(max(1, args.repeat))]
+            for stage_runs in zip(*runs):
+                stage, seconds, requests, rate_limited = min(stage_runs, key=lambda result: result[1])
+                results[str(size)][stage] = {"seconds": round(seconds, 4), "requests": requests}
+                limited = f", {rate_limited} rate limited" if rate_limited else ""
+                regressions = []
+                if stage in baseline.get(str(size), {}):
+                    regressions = compare_stage(baseline[str(size)][stage], seconds, requests, args.tolerance,
+                                                args.slack_ms / 1000)
+                regressed = regressed or bool(regressions)
+                print(f"  {stage:<28} {seconds:8.3f}s  {requests:6d} requests{limited}"
+                      + (f"  REGRESSION: {'; '.join(regressions)}" if regressions else ""), file=report)
+            if args.baseline and str(size) not in baseline:
+                print(f"  (no baseline for {size} songs)", file=report)
+    finally:
+        for server in servers:
+            server.close()
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"options": options, "sizes": results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}.", file=report)
+    if args.baseline:
+        print("\nRegression against the baseline." if regressed else f"\nNo regression against {args.baseline}.",
+              file=report)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Benchmark of taste_profile.TasteProfile with clustering on (TASTE_PROFILE_CLUSTERING) on synthetic
+libraries: time to embed and cluster the library, to draw a prompt sample and to rank a reply, and how
+the clustered sample compares with a plain random one (distinct artists, clusters covered, largest
+share of one cluster).
+
+    python benchmarks/bench_taste_profile.py [--sizes 1000,10000,100000] [--sample 200] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_track_index import make_library
+from response_parser import Recommendation
+from taste_profile import NUMPY_AVAILABLE, TasteProfile
+
+
+def describe_sample(profile, sample):
+    cluster_of = {id(song): label for song, label in zip(profile.songs, profile.labels)}
+    clusters = Counter(cluster_of[id(song)] for song in sample)
+    artists = len({song['artist'] for song in sample})
+    return f"{artists} artists, {len(clusters)} clusters, largest cluster {max(clusters.values()) / len(sample):.0%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not NUMPY_AVAILABLE:
+        print("NumPy is not installed: TasteProfile falls back to random samples. pip install numpy"); return
+
+    rng = random.Random(args.seed)
+    for size in (int(size) for size in args.sizes.split(",")):
+        library = make_library(size, rng)
+        start = time.perf_counter()
+        profile = TasteProfile(library, clustering=True, seed=args.seed)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sample = profile.sample(args.sample)
+        sample_time = time.perf_counter() - start
+
+        reply = [Recommendation(song['track'], song['artist']) for song in rng.sample(library, 25)]
+        start = time.perf_counter()
+        profile.rank(reply)
+        rank_time = time.perf_counter() - start
+
+        print(f"{size} songs: profile {build_time:.2f}s, sample {sample_time * 1000:.0f}ms, "
+              f"rank 25 suggestions {rank_time * 1000:.1f}ms")
+        print(f"  clustered sample: {describe_sample(profile, sample)}")
+        # Drawn from the songs the profile clustered (a subset of libraries over TASTE_PROFILE_MAX_SONGS)
+        print(f"  random sample:    {describe_sample(profile, rng.sample(profile.songs, args.sample))}")
+
+
+if __name__ == "__main__":
+    main()
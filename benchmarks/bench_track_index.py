@@ -0,0 +1,118 @@
+"""
+Benchmark of track_index.TrackIndex on a synthetic library: lookup throughput per match tier,
+recall on variant duplicates (remaster/live suffixes, "feat." credits, accents, case, typos)
+and false duplicates (distinct songs of the same artist reported as already known).
+
+    python benchmarks/bench_track_index.py [--size 50000] [--lookups 20000] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from track_index import TrackIndex
+
+WORDS = ("love", "night", "heart", "fire", "dream", "city", "light", "summer", "rain", "road", "blue",
+         "gold", "river", "shadow", "dance", "home", "wild", "stars", "time", "ocean", "echo", "ghost",
+         "paper", "silver", "storm", "velvet", "midnight", "sugar", "thunder", "youth")
+ACCENTED = {"e": "é", "a": "à", "o": "ö", "u": "ü"}
+
+
+def make_library(size, rng):
+    artists = [f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}" for i in range(max(1, size // 10))]
+    library, seen = [], set()
+    while len(library) < size:
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+        if rng.random() < 0.1:
+            title += f" Part {rng.randint(1, 3)}"
+        artist = rng.choice(artists)
+        if (title, artist) in seen:
+            continue
+        seen.add((title, artist))
+        n = len(library)
+        library.append({"uri": f"spotify:track:{n:022d}", "track": title, "artist": artist, "isrc": f"USXX1{n:07d}"})
+    return library
+
+
+def make_variant(song, rng):
+    title = song["track"]
+    artist = song["artist"]
+    kind = rng.choice(("remaster", "live", "feat", "accent", "case", "typo"))
+    if kind == "remaster":
+        title += f" - Remastered {rng.randint(1990, 2020)}"
+    elif kind == "live":
+        title += " (Live)"
+    elif kind == "feat":
+        title += " (feat. Someone Else)"
+        artist += ", Someone Else"
+    elif kind == "accent":
+        title = "".join(ACCENTED.get(c, c) for c in title)
+    elif kind == "case":
+        title, artist = title.upper(), artist.lower()
+    else:
+        i = rng.randrange(len(title))
+        title = title[:i] + title[i + 1:] # Dropped letter, only the approximate tier can catch it
+    return kind, title, artist
+
+
+def time_lookups(index, queries):
+    start = time.perf_counter()
+    for query in queries:
+        index.match(*query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    library = make_library(args.size, rng)
+    samples = [rng.choice(library) for _ in range(args.lookups)]
+    variants = [(song, make_variant(song, rng)) for song in samples]
+
+    # Unknown songs by known artists: new random titles, kept only if the library really lacks them
+    known_titles = {(song["track"].lower(), song["artist"]) for song in library}
+    distinct = []
+    while len(distinct) < args.lookups:
+        song = rng.choice(library)
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+        if (title.lower(), song["artist"]) not in known_titles:
+            distinct.append((title, song["artist"]))
+
+    for approximate in (False, True):
+        start = time.perf_counter()
+        index = TrackIndex(approximate=approximate).add_many(library)
+        build_time = time.perf_counter() - start
+        print(f"\napproximate={approximate}: built index of {len(index)} songs in {build_time:.2f}s")
+
+        tiers = {
+            "uri": [(s["track"], s["artist"], s["uri"], None) for s in samples],
+            "isrc": [(s["track"], s["artist"], None, s["isrc"]) for s in samples],
+            "canonical": [(s["track"], s["artist"]) for s in samples],
+            "variant": [(title, artist) for _, (_, title, artist) in variants],
+            "unknown": distinct,
+        }
+        for tier, queries in tiers.items():
+            per_lookup = time_lookups(index, queries)
+            print(f"  {tier:<10} {per_lookup * 1e6:>7.2f} us/lookup ({1 / per_lookup:>9,.0f} lookups/s)")
+
+        recall = {}
+        for _, (kind, title, artist) in variants:
+            hit = index.match(title, artist) is not None
+            found, total = recall.get(kind, (0, 0))
+            recall[kind] = (found + hit, total + 1)
+        print("  recall on variant duplicates: " + ", ".join(
+            f"{kind} {found / total:.0%}" for kind, (found, total) in sorted(recall.items())))
+        false_dups = sum(index.match(title, artist) is not None for title, artist in distinct)
+        print(f"  false duplicates: {false_dups}/{len(distinct)} ({false_dups / len(distinct):.2%})")
+
+
+if __name__ == "__main__":
+    main()
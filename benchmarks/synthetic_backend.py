@@ -0,0 +1,174 @@
+"""
+Synthetic backend for replay.StandInServer: a generated Spotify account (liked songs library, playlists,
+search catalog) and a chat-completions model whose replies mix songs already liked, songs that don't
+exist on "Spotify" and new ones, in set proportions. Used by bench_stages.py to run the whole pipeline
+offline on libraries of any size.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from bench_track_index import make_library
+
+USER_ID = "bench-user"
+_PLAYLIST_PATH = re.compile(r"^/v1/playlists/([^/]+)(/tracks|/items)?$")
+_SEARCH_QUERY = re.compile(r"^track:(.*) artist:(.*)$")
+
+
+def _track_object(song):
+    return {"uri": song['uri'], "name": song['track'], "artists": [{"name": song['artist']}],
+            "external_ids": {"isrc": song['isrc']} if song.get('isrc') else {}}
+
+
+def _json(status, payload):
+    return status, {"Content-Type": "application/json"}, json.dumps(payload).encode()
+
+
+class SyntheticBackend:
+    """
+    `library_size` liked songs and a `history_size`-song "All AI Recommendations" playlist.
+    Every model reply holds `suggestions` songs: a `liked_share` of liked ones, a `missing_share` that
+    search won't find, and new songs for the rest.
+    """
+
+    def __init__(self, library_size, history_size=0, suggestions=30, liked_share=0.2, missing_share=0.1,
+                 history_playlist_name="All AI Recommendations", seed=0):
+        self.rng = random.Random(seed)
+        self.suggestions = suggestions
+        self.liked_share = liked_share
+        self.missing_share = missing_share
+        self.library = make_library(library_size + history_size, self.rng)
+        history = self.library[library_size:]
+        self.library = self.library[:library_size]
+        now = time.time()
+        self._saved_items = [ # Newest first, like the Saved Tracks endpoint
+            {"added_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - i * 60)), "track": _track_object(song)}
+            for i, song in enumerate(self.library)
+        ]
+        self.catalog = {(song['track'].lower(), song['artist'].lower()): song for song in self.library + history}
+        self._by_uri = {song['uri']: song for song in self.catalog.values()}
+        self.playlists = {} # id -> {"name", "songs": [song dict], "snapshot": int}
+        self._ids = itertools.count()
+        self._new_songs = itertools.count()
+        self._lock = threading.Lock()
+        if history_size:
+            self.create_playlist(history_playlist_name, history)
+
+    def create_playlist(self, name, songs=()):
+        with self._lock:
+            playlist_id = f"{next(self._ids):022d}"
+            self.playlists[playlist_id] = {"name": name, "songs": list(songs), "snapshot": 1}
+        return playlist_id
+
+    # --- Spotify Web API ---
+
+    def handle(self, method, path, query, body, base_url):
+        params = dict(parse_qsl(query))
+        payload = json.loads(body) if body else None
+        if path.rstrip("/").endswith("/chat/completions"):
+            return self._completion(payload or {})
+        if path == "/v1/me/" or path == "/v1/me":
+            return _json(200, {"id": USER_ID, "display_name": "Benchmark"})
+        if path == "/v1/me/tracks":
+            return _json(200, self._page(self._saved_items, params, f"{base_url}{path}"))
+        if path == "/v1/me/playlists":
+            with self._lock:
+                items = [{"id": pid, "name": p['name'], "owner": {"id": USER_ID}} for pid, p in self.playlists.items()]
+            return _json(200, self._page(items, params, f"{base_url}{path}"))
+        if path == f"/v1/users/{USER_ID}/playlists" and method == "POST":
+            playlist_id = self.create_playlist(payload['name'])
+            return _json(201, {"id": playlist_id, "name": payload['name'], "owner": {"id": USER_ID}})
+        if path == "/v1/search":
+            return _json(200, self._search(params.get('q', '')))
+        match = _PLAYLIST_PATH.match(path)
+        if match:
+            playlist_id, items_path = match.groups()
+            with self._lock:
+                playlist = self.playlists.get(playlist_id)
+                if playlist is None:
+                    return _json(404, {"error": {"status": 404, "message": "Not found"}})
+                if not items_path:
+                    return _json(200, {"snapshot_id": str(playlist['snapshot']), "name": playlist['name'],
+                                       "owner": {"id": USER_ID}})
+                if method == "GET":
+                    items = [{"track": _track_object(song)} for song in playlist['songs']]
+                    return _json(200, self._page(items, params, f"{base_url}{path}"))
+                self._edit_playlist(playlist, method, params, payload)
+                playlist['snapshot'] += 1
+                return _json(201 if method == "POST" else 200, {"snapshot_id": str(playlist['snapshot'])})
+        return _json(404, {"error": {"status": 404, "message": f"Unknown endpoint {method} {path}"}})
+
+    @staticmethod
+    def _page(items, params, url):
+        limit, offset = int(params.get('limit', 20)), int(params.get('offset', 0))
+        next_url = f"{url}?offset={offset + limit}&limit={limit}" if offset + limit < len(items) else None
+        return {"items": items[offset:offset + limit], "total": len(items), "limit": limit, "offset": offset, "next": next_url}
+
+    def _edit_playlist(self, playlist, method, params, payload):
+        if method == "POST":
+            uris = payload if isinstance(payload, list) else payload['uris']
+            songs = [self._song_by_uri(uri) for uri in uris]
+            position = int(params['position']) if 'position' in params else len(playlist['songs'])
+            playlist['songs'][position:position] = songs
+        elif method == "DELETE":
+            removed = {item['uri'] for item in payload.get('items') or payload.get('tracks') or []}
+            playlist['songs'] = [song for song in playlist['songs'] if song['uri'] not in removed]
+        elif 'range_start' in payload:
+            start, before, length = payload['range_start'], payload['insert_before'], payload.get('range_length', 1)
+            songs = playlist['songs']
+            block = songs[start:start + length]
+            del songs[start:start + length]
+            if before > start:
+                before -= length
+            songs[before:before] = block
+        else:
+            playlist['songs'] = [self._song_by_uri(uri) for uri in payload['uris']]
+
+    def _song_by_uri(self, uri):
+        return self._by_uri.get(uri) or {"uri": uri, "track": uri, "artist": "Unknown", "isrc": None}
+
+    def _search(self, q):
+        match = _SEARCH_QUERY.match(q)
+        song = self.catalog.get((match.group(1).lower(), match.group(2).lower())) if match else None
+        return {"tracks": {"items": [_track_object(song)] if song else [], "total": int(song is not None)}}
+
+    # --- Chat completions ---
+
+    def _suggestion(self):
+        roll = self.rng.random()
+        if roll < self.liked_share and self.library:
+            song = self.rng.choice(self.library)
+            return {"track": song['track'], "artist": song['artist']}
+        n = next(self._new_songs)
+        if roll < self.liked_share + self.missing_share:
+            return {"track": f"Imaginary Song {n}", "artist": "Nobody In Particular"}
+        song = {"uri": f"spotify:track:new{n:019d}", "track": f"Fresh Song {n}", "artist": f"New Artist {n % 97}",
+                "isrc": f"GBNEW{n:07d}"}
+        with self._lock:
+            self.catalog[(song['track'].lower(), song['artist'].lower())] = song
+            self._by_uri[song['uri']] = song
+        return {"track": song['track'], "artist": song['artist']}
+
+    def _completion(self, request):
+        content = json.dumps({"recommendations": [self._suggestion() for _ in range(self.suggestions)]})
+        usage = {"prompt_tokens": sum(len(m.get('content') or "") for m in request.get('messages', [])) // 4,
+                 "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": request.get('model', "bench")}
+        if not request.get('stream'):
+            return _json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ]})
+        events = [
+            {**base, "object": "chat.completion.chunk",
+             "choices": [{"index": 0, "delta": {"content": content[i:i + 40]}, "finish_reason": None}]}
+            for i in range(0, len(content), 40)
+        ]
+        events.append({**base, "object": "chat.completion.chunk", "usage": usage,
+                       "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        return 200, {"Content-Type": "text/event-stream"}, body.encode()
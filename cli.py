@@ -0,0 +1,178 @@
+"""
+Command line of SpotifAI. Every command imports only what it uses: `stats` reads the local cache and run
+log without loading the Spotify or model clients, `sync-cache` loads the Spotify client only, and the
+OpenAI SDK is only imported when an OpenAI provider is selected.
+
+    python cli.py run [--full-sync] [--sequential] [--no-stream] [--providers=openai] [--token-cache=PATH] ...
+    python cli.py batch users.json [--parallel=4] ...
+    python cli.py service [--port=8710] [--refresh-minutes=15] ...   (python cli.py service --trigger)
+    python cli.py sync-cache [--full] [--token-cache=PATH]
+    python cli.py stats [--db=PATH] [--runs=PATH] [--last=5]
+    python cli.py benchmark [NAME [benchmark options]]
+
+run, batch and service take the options of spotify_playlist.py, batch.py and service.py.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from settings import ALL_RECS_PLAYLIST_NAME, CACHE_DB_PATH, METRICS_LOG_PATH, NEW_PLAYLIST_NAME, SPOTIFY_TOKEN_CACHE
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+DEFAULT_STATS_RUNS = 5
+
+
+def _run_script(module, extra):
+    if "-h" in extra or "--help" in extra:
+        print((module.__doc__ or module.main.__doc__).strip()); return 0
+    return module.main(extra)
+
+
+def command_run(args, extra):
+    import spotify_playlist
+    return _run_script(spotify_playlist, extra)
+
+
+def command_batch(args, extra):
+    import batch
+    return _run_script(batch, extra)
+
+
+def command_service(args, extra):
+    import service
+    return _run_script(service, extra)
+
+
+def command_sync_cache(args, extra):
+    """Brings the local store up to date with Spotify (liked songs, playlist IDs, history) without a model."""
+    # The .env file is loaded by helper_functions, the first module that reads API keys
+    from helper_functions import get_or_create_playlist_ids, get_spotify_client, sync_liked_songs
+    from library_cache import LibraryStore
+    from playlist_sync import get_playlist_state
+
+    sp_client = get_spotify_client(args.token_cache)
+    if not sp_client:
+        return 1
+    library_store = LibraryStore(args.db)
+    try:
+        sync_liked_songs(sp_client, library_store, full=args.full)
+        playlist_ids = get_or_create_playlist_ids(sp_client, sp_client.me()['id'], [ALL_RECS_PLAYLIST_NAME, NEW_PLAYLIST_NAME],
+                                                  library_store, create=False)
+        for name, playlist_id in playlist_ids.items():
+            _, tracks = get_playlist_state(sp_client, playlist_id, library_store)
+            if tracks is not None:
+                print(f"'{name}': {len(tracks)} songs cached.")
+    finally:
+        library_store.close()
+    return 0
+
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "never"
+
+
+def print_cache_stats(db_path):
+    from library_cache import LibraryStore
+    from resolution_cache import ResolutionCache
+
+    if not os.path.exists(db_path):
+        print(f"No local cache at '{db_path}' yet (python cli.py sync-cache creates it)."); return
+    library_store = LibraryStore(db_path)
+    resolution_cache = ResolutionCache(db_path)
+    try:
+        print(f"Local cache '{db_path}':")
+        print(f"  {library_store.count()} liked songs, newest liked {library_store.last_added_at() or 'n/a'}, "
+              f"last full reconcile {_format_time(library_store.last_full_sync())}")
+        hit_rate = library_store.get_suggestion_hit_rate()
+        print(f"  Suggestion hit rate: " + (f"{hit_rate:.0%}" if hit_rate is not None else "no run yet"))
+        for name, playlist_id in library_store.get_playlist_ids([ALL_RECS_PLAYLIST_NAME, NEW_PLAYLIST_NAME]).items():
+            snapshot_id, tracks = library_store.get_playlist_snapshot(playlist_id)
+            print(f"  '{name}': " + (f"{len(tracks)} songs cached" if snapshot_id else "not cached"))
+        found, not_found = resolution_cache.stored_counts()
+        print(f"  Search cache: {found} songs found, {not_found} not found")
+    finally:
+        resolution_cache.close()
+        library_store.close()
+
+
+def print_run_stats(runs_path, last=DEFAULT_STATS_RUNS):
+    if not os.path.exists(runs_path):
+        print(f"No run log at '{runs_path}' yet."); return
+    with open(runs_path, encoding="utf-8") as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    print(f"\n{len(runs)} runs in '{runs_path}', last {min(last, len(runs))}:")
+    for run in runs[-last:]:
+        info = run.get('info', {})
+        stages = {key.split('stage="', 1)[1].split('"', 1)[0]: timing['sum']
+                  for key, timing in run.get('timings', {}).items() if key.startswith("stage_seconds")}
+        slowest = max(stages, key=stages.get) if stages else None
+        collected = info.get('collected')
+        if collected is None and isinstance(info.get('results'), dict):
+            collected = sum(count or 0 for count in info['results'].values())
+        print(f"  {_format_time(run['started_at'])}  {info.get('mode', '?'):<8} {run['duration']:7.1f}s  "
+              f"{collected if collected is not None else '-':>3} songs"
+              + (f"  (slowest: {slowest} {stages[slowest]:.1f}s)" if slowest else ""))
+
+
+def command_stats(args, extra):
+    print_cache_stats(args.db)
+    print_run_stats(args.runs, args.last)
+    return 0
+
+
+def list_benchmarks():
+    return sorted(name[len("bench_"):-len(".py")] for name in os.listdir(BENCHMARKS_DIR)
+                  if name.startswith("bench_") and name.endswith(".py"))
+
+
+def command_benchmark(args, extra):
+    names = list_benchmarks()
+    if args.name not in names:
+        if args.name:
+            print(f"Unknown benchmark '{args.name}'.")
+        print("Benchmarks: " + ", ".join(names) + " (python cli.py benchmark NAME --help for its options)")
+        return 0 if args.name is None else 1
+    script = os.path.join(BENCHMARKS_DIR, f"bench_{args.name}.py")
+    return subprocess.run([sys.executable, script, *extra]).returncode
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="SpotifAI: AI recommendations for your Spotify playlists.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="update the playlists of one account (options of spotify_playlist.py)",
+                        add_help=False).set_defaults(handler=command_run)
+    commands.add_parser("batch", help="update the playlists of several accounts (options of batch.py)",
+                        add_help=False).set_defaults(handler=command_batch)
+    commands.add_parser("service", help="keep the state warm and update the playlists on demand (options of service.py)",
+                        add_help=False).set_defaults(handler=command_service)
+
+    sync_cache = commands.add_parser("sync-cache", help="refresh the local cache from Spotify, without asking a model")
+    sync_cache.add_argument("--full", action="store_true", help="full reconcile of the liked songs")
+    sync_cache.add_argument("--token-cache", default=SPOTIFY_TOKEN_CACHE)
+    sync_cache.add_argument("--db", default=CACHE_DB_PATH)
+    sync_cache.set_defaults(handler=command_sync_cache)
+
+    stats = commands.add_parser("stats", help="summary of the local cache and of the last runs (offline)")
+    stats.add_argument("--db", default=CACHE_DB_PATH)
+    stats.add_argument("--runs", default=METRICS_LOG_PATH)
+    stats.add_argument("--last", type=int, default=DEFAULT_STATS_RUNS)
+    stats.set_defaults(handler=command_stats)
+
+    benchmark = commands.add_parser("benchmark", help="run one of the scripts in benchmarks/", add_help=False)
+    benchmark.add_argument("name", nargs="?")
+    benchmark.set_defaults(handler=command_benchmark)
+    return parser
+
+
+def main(argv=None):
+    args, extra = build_parser().parse_known_args(argv)
+    if extra and args.handler in (command_sync_cache, command_stats):
+        build_parser().parse_args(argv) # Reports the unknown options and exits
+    return args.handler(args, extra)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import threading
+import time
+from functools import lru_cache
+
+import requests
+
+HTTP_MAX_CONNECTIONS = 32 # Per httpx client (model APIs)
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 16 # Idle connections kept open for reuse
+HTTP_KEEPALIVE_EXPIRY = 120.0 # Seconds an idle connection stays open
+HTTP_TIMEOUT = 60.0 # Seconds; LLM responses can take a while
+HTTP_CONNECT_TIMEOUT = 10.0
+REQUESTS_POOL_MAXSIZE = 32 # Connections per host in the requests.Session used by spotipy
+
+
+class ConnectionStats:
+    """
+    Per-client request timings, fed by httpx's trace hook: how many requests had to open a new
+    connection, the time spent connecting (TCP + TLS) and the time to the first response byte.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.new_connections = 0
+        self.connect_seconds = 0.0
+        self.first_byte_seconds = []
+        self._lock = threading.Lock()
+
+    def record(self, connect_seconds, first_byte_seconds):
+        with self._lock:
+            self.requests += 1
+            if connect_seconds is not None:
+                self.new_connections += 1
+                self.connect_seconds += connect_seconds
+            if first_byte_seconds is not None:
+                self.first_byte_seconds.append(first_byte_seconds)
+
+    def summary(self):
+        with self._lock:
+            if not self.requests:
+                return f"{self.name}: no requests"
+            ttfb = sorted(self.first_byte_seconds)
+            median = f"{ttfb[len(ttfb) // 2] * 1000:.0f}ms" if ttfb else "n/a"
+            average_connect = self.connect_seconds / self.new_connections * 1000 if self.new_connections else 0.0
+            return (f"{self.name}: {self.requests} requests, {self.new_connections} new connections "
+                    f"(avg connect {average_connect:.0f}ms), median time to first byte {median}")
+
+
+class _RequestTrace:
+    # httpcore calls trace(event_name, info) around each step of a request; see httpx "trace" extension.
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.connect_started = None
+        self.connect_seconds = None
+        self.request_started = None
+
+    def __call__(self, event_name, info):
+        now = time.perf_counter()
+        if event_name == "connection.connect_tcp.started":
+            self.connect_started = now
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            if self.connect_started is not None:
+                self.connect_seconds = now - self.connect_started
+        elif event_name.endswith(".send_request_headers.started"):
+            self.request_started = now
+        elif event_name.endswith(".receive_response_headers.complete"):
+            first_byte = now - self.request_started if self.request_started is not None else None
+            self.stats.record(self.connect_seconds, first_byte)
+
+
+_stats = {} # client name -> ConnectionStats
+_stats_lock = threading.Lock()
+_response_hooks = [] # Extra httpx response hooks run by every client (e.g. replay.py recording)
+
+
+def add_response_hook(hook):
+    """Runs `hook(response)` on every response of the httpx clients from get_http_client (also existing ones)."""
+    _response_hooks.append(hook)
+
+
+def _run_response_hooks(response):
+    for hook in list(_response_hooks):
+        hook(response)
+
+
+def get_connection_stats(name):
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = ConnectionStats(name)
+        return _stats[name]
+
+
+@lru_cache(maxsize=None)
+def http2_available():
+    try:
+        import h2 # noqa: F401 (HTTP/2 support for httpx: pip install "httpx[http2]")
+        return True
+    except ImportError:
+        return False
+
+
+@lru_cache(maxsize=None)
+def get_http_client(name, max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS):
+    """
+    Long-lived httpx.Client for one API (`name` is also the key of its ConnectionStats).
+    Keeps connections alive between turns and users, speaks HTTP/2 when the h2 package is installed,
+    and records connect / first-byte latency of every request.
+    """
+    import httpx # Only the model APIs use httpx: Spotify-only commands don't pay for its import
+    stats = get_connection_stats(name)
+
+    def start_trace(request):
+        request.extensions["trace"] = _RequestTrace(stats)
+
+    return httpx.Client(
+        http2=http2_available(),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        event_hooks={"request": [start_trace], "response": [_run_response_hooks]}
+    )
+
+
+@lru_cache(maxsize=None)
+def get_openai_client(api_key, base_url=None):
+    # One client per key and endpoint, shared by every request and user; OpenAI clients are thread-safe.
+    # The SDK's own retries are off: scheduler.py retries with the rest of the OpenAI traffic in mind.
+    from openai import OpenAI # The SDK takes a while to import: only loaded when an OpenAI provider is used
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=get_http_client("openai"), max_retries=0)
+
+
+@lru_cache(maxsize=None)
+def get_requests_session(pool_maxsize=REQUESTS_POOL_MAXSIZE):
+    """
+    requests.Session for spotipy (which only speaks requests), shared by the Spotify clients of a batch run
+    so connections are kept alive and reused.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def print_connection_stats():
+    with _stats_lock:
+        stats = [client_stats for client_stats in _stats.values() if client_stats.requests]
+    if not stats:
+        return
+    print(f"\nConnection statistics (HTTP/2 {'on' if http2_available() else 'off: pip install h2'}):")
+    for client_stats in stats:
+        print(f"  {client_stats.summary()}")
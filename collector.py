@@ -0,0 +1,129 @@
+import math
+from collections import Counter
+
+from metrics import metrics
+from track_index import TrackIndex
+
+DEFAULT_HIT_RATE = 0.5 # Share of suggestions expected to end up collected, before any run was observed
+MIN_HIT_RATE = 0.15 # Floor of the estimate, so the request size stays bounded
+HIT_RATE_SMOOTHING = 0.5 # Weight of the latest run in the running estimate
+MAX_SUGGESTIONS_PER_REQUEST = 50 # Longer lists make the models repeat themselves and slow the replies down
+
+SKIP_REASON_LABELS = {
+    "collected": "already collected this session",
+    "liked": "is liked",
+    "history": "in all_recs history",
+}
+
+
+class RecommendationCollector:
+    """
+    Collects the verified songs of a run, in the order they were accepted, until `target_count` is reached.
+    A song is skipped when it was already collected this session, is liked, or is in the recommendations
+    history (`liked_index` / `history_index` are TrackIndex instances). Every check is a set/dict probe,
+    so the cost per candidate does not grow with the number of songs collected.
+    `skipped` counts the skipped songs per reason: "collected", "liked" and "history".
+    Can be passed as the `consider_song` callback of pipeline.collect_recommendations.
+    """
+
+    def __init__(self, target_count, liked_index, history_index):
+        self.target_count = target_count
+        self.liked_index = liked_index
+        self.history_index = history_index
+        self.songs = [] # Accepted {'uri', 'track', 'artist', 'isrc'} dicts, in collection order
+        self.skipped = Counter()
+        self.prefiltered = Counter() # Suggestions dropped on their raw names, before any Spotify search
+        self._session_index = TrackIndex() # URIs / canonical keys collected this session
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __call__(self, verified_song_info):
+        return self.consider(verified_song_info)
+
+    @property
+    def uris(self):
+        return [song['uri'] for song in self.songs]
+
+    def is_full(self):
+        return len(self.songs) >= self.target_count
+
+    def skip_reason(self, verified_song_info):
+        """Returns (reason, matched_tier) for a song that can't be collected, or None."""
+        # Use Spotify's URI/ISRC and canonical track/artist names for consistent checking
+        song_match_args = (verified_song_info['track'], verified_song_info['artist'],
+                           verified_song_info['uri'], verified_song_info.get('isrc'))
+        for reason, index in (("collected", self._session_index), ("liked", self.liked_index),
+                              ("history", self.history_index)):
+            tier = index.match(*song_match_args)
+            if tier:
+                return reason, tier
+        return None
+
+    def prefilter(self, recommendation):
+        """
+        Cheap check of a raw model suggestion (a Recommendation) before it is searched on Spotify:
+        returns the skip reason when its title and artist already match a collected, liked or history song
+        (canonical or approximate tier), else None.
+        """
+        for reason, index in (("collected", self._session_index), ("liked", self.liked_index),
+                              ("history", self.history_index)):
+            tier = index.match(recommendation.track, recommendation.artist)
+            if tier:
+                self.prefiltered[reason] += 1
+                metrics.incr("songs_skipped_total", reason=reason, stage="prefilter")
+                print(f"  -- Dropped before search: '{recommendation.track}' by '{recommendation.artist}' "
+                      f"(Reason: {SKIP_REASON_LABELS[reason]}, {tier} match)")
+                return reason
+        return None
+
+    def consider(self, verified_song_info): # dict {'uri', 'track', 'artist', 'isrc'}
+        if self.is_full():
+            return False
+        skip = self.skip_reason(verified_song_info)
+        if skip is None:
+            self._session_index.add(verified_song_info['track'], verified_song_info['artist'],
+                                    verified_song_info['uri'], verified_song_info.get('isrc'))
+            self.songs.append(verified_song_info)
+            metrics.incr("songs_collected_total")
+            print(f"  ++ Collected for new playlist: '{verified_song_info['track']}' by '{verified_song_info['artist']}'")
+            return True
+        reason, tier = skip
+        self.skipped[reason] += 1
+        metrics.incr("songs_skipped_total", reason=reason, stage="verified")
+        print(f"  -- Skipped '{verified_song_info['track']}' by '{verified_song_info['artist']}' "
+              f"(Reason: {SKIP_REASON_LABELS[reason]}, {tier} match)")
+        return False
+
+    def print_summary(self):
+        skipped = ", ".join(f"{count} {reason}" for reason, count in self.skipped.most_common()) or "none"
+        prefiltered = ", ".join(f"{count} {reason}" for reason, count in self.prefiltered.most_common()) or "none"
+        print(f"Collected {len(self.songs)}/{self.target_count} songs; skipped: {skipped}; "
+              f"dropped before search: {prefiltered}.")
+
+
+class SuggestionBudget:
+    """
+    How many songs to ask the model for, so that one round usually fills the playlist: the number of songs
+    still needed divided by the expected hit rate (share of suggestions that end up collected), capped at
+    MAX_SUGGESTIONS_PER_REQUEST. The hit rate is a running estimate over past runs; record() folds in the
+    outcome of a run and the caller persists `hit_rate` (see LibraryStore.set_suggestion_hit_rate).
+    """
+
+    def __init__(self, hit_rate=None):
+        self.hit_rate = max(MIN_HIT_RATE, min(1.0, hit_rate or DEFAULT_HIT_RATE))
+
+    def request_size(self, still_needed):
+        if still_needed <= 0:
+            return 0
+        return max(still_needed, min(MAX_SUGGESTIONS_PER_REQUEST, math.ceil(still_needed / self.hit_rate)))
+
+    def record(self, settled_count, collected_count):
+        """`settled_count` suggestions of a run got an outcome (dropped, not found or verified), `collected_count` were kept."""
+        if settled_count <= 0:
+            return self.hit_rate
+        observed = collected_count / settled_count
+        # A run with few outcomes says little: weigh it down
+        weight = HIT_RATE_SMOOTHING * min(1.0, settled_count / MAX_SUGGESTIONS_PER_REQUEST)
+        self.hit_rate = max(MIN_HIT_RATE, min(1.0, (1 - weight) * self.hit_rate + weight * observed))
+        return self.hit_rate
@@ -0,0 +1,124 @@
+from settings import MAX_PROMPT_TOKENS, OPENAI_MODEL
+from resolution_cache import normalize_song_key
+
+try:
+    import tiktoken
+except ImportError: # Optional: fall back to a characters-per-token estimate
+    tiktoken = None
+
+MESSAGE_OVERHEAD_TOKENS = 4 # Role and separators the chat format adds around every message
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+        except KeyError:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text))
+
+
+def format_song_list(songs):
+    """
+    Compact "avoid these" list: one line per artist with their tracks, e.g.
+    `Daft Punk: One More Time; Digital Love`. Saves the per-song `- "..." by ...` boilerplate.
+    """
+    tracks_by_artist = {}
+    for song in songs:
+        tracks_by_artist.setdefault(song.artist, []).append(song.track)
+    return "\n".join(f"{artist}: {'; '.join(tracks)}" for artist, tracks in tracks_by_artist.items())
+
+
+class ConversationContext:
+    """
+    Conversation sent to the model, kept under a token budget.
+    The initial prompt (with the liked songs sample) is always sent. Each follow-up only lists the
+    suggestions the model can't already see in the context (e.g. those made by another provider),
+    so the "avoid these" list isn't repeated every turn. When the history outgrows `token_budget`,
+    the oldest turns are dropped and the songs they mentioned are folded into a single compact
+    exclusion message placed right after the initial prompt.
+    """
+
+    def __init__(self, initial_prompt, build_follow_up_prompt, token_budget=MAX_PROMPT_TOKENS):
+        self.initial_message = self._make_message("user", initial_prompt, [])
+        self.build_follow_up_prompt = build_follow_up_prompt # songs_to_avoid_str -> follow-up prompt content
+        self.token_budget = token_budget
+        self.turns = [] # Kept history messages after the initial prompt, oldest first
+        self.folded_songs = [] # Songs mentioned by dropped turns, sent in the exclusion message
+        self.sent_token_counts = [] # Prompt tokens of every request, in order
+        self.unpruned_token_counts = [] # What each request would have been without pruning
+        self._added_tokens = 0
+        self._mentioned_keys = set() # Songs the model can currently see (kept turns + exclusion message)
+
+    def _make_message(self, role, content, songs):
+        return {
+            "message": {"role": role, "content": content},
+            "tokens": count_tokens(content) + MESSAGE_OVERHEAD_TOKENS,
+            "songs": songs
+        }
+
+    def _append_turn(self, turn):
+        self.turns.append(turn)
+        self._added_tokens += turn['tokens']
+
+    def _mention(self, songs):
+        for song in songs:
+            self._mentioned_keys.add(normalize_song_key(song.track, song.artist))
+
+    def add_reply(self, raw_assistant_response_str, suggested_songs):
+        self._append_turn(self._make_message("assistant", raw_assistant_response_str, list(suggested_songs or [])))
+        self._mention(suggested_songs or [])
+
+    def add_follow_up(self, all_suggestions):
+        unseen = [
+            song for song in all_suggestions
+            if normalize_song_key(song.track, song.artist) not in self._mentioned_keys
+        ]
+        songs_to_avoid_str = format_song_list(unseen) if unseen else "(None beyond those listed above)"
+        self._append_turn(self._make_message("user", self.build_follow_up_prompt(songs_to_avoid_str), unseen))
+        self._mention(unseen)
+
+    def _exclusion_message(self):
+        if not self.folded_songs:
+            return None
+        content = ("Songs you already suggested earlier in this conversation (do not suggest them again):\n"
+                   + format_song_list(self.folded_songs))
+        return self._make_message("user", content, [])
+
+    def messages(self):
+        """Messages for the next request, pruned to the token budget. Records the token count sent."""
+        exclusion = self._exclusion_message()
+
+        def total_tokens():
+            return (self.initial_message['tokens'] + (exclusion['tokens'] if exclusion else 0)
+                    + sum(turn['tokens'] for turn in self.turns))
+
+        dropped = 0
+        while total_tokens() > self.token_budget and len(self.turns) > 1:
+            oldest = self.turns.pop(0)
+            self.folded_songs.extend(oldest['songs'])
+            exclusion = self._exclusion_message()
+            dropped += 1
+        sent_tokens = total_tokens()
+        self.sent_token_counts.append(sent_tokens)
+        self.unpruned_token_counts.append(self.initial_message['tokens'] + self._added_tokens)
+
+        print(f"Prompt: {sent_tokens} tokens in {1 + bool(exclusion) + len(self.turns)} messages "
+              f"(budget {self.token_budget}, unpruned history {self.unpruned_token_counts[-1]})"
+              f"{f', folded {dropped} old messages into the exclusion list' if dropped else ''}.")
+        messages = [self.initial_message['message']]
+        if exclusion:
+            messages.append(exclusion['message'])
+        messages.extend(turn['message'] for turn in self.turns)
+        return messages
+
+    def print_token_report(self):
+        if not self.sent_token_counts:
+            return
+        print(f"\nPrompt tokens sent per turn: {', '.join(str(n) for n in self.sent_token_counts)} "
+              f"(total {sum(self.sent_token_counts)}, {sum(self.unpruned_token_counts)} without pruning).")
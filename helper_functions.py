@@ -1,294 +1,593 @@
 import os
 import json
 import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
-import requests
-from dotenv import load_dotenv
-from openai import OpenAI, APIError
+from clients import get_http_client, get_openai_client, get_requests_session
+from metrics import metrics
+from paging import fetch_all_pages
+from scheduler import get_scheduler
+from resolution_cache import CACHE_MISS, normalize_song_key
+from response_parser import IncrementalRecommendationParser, RecommendationResult, parse_response
+from settings import (GEMINI_MODEL, OPENAI_MODEL, SCOPES, SPOTIFY_MAX_CONCURRENT_REQUESTS, SPOTIFY_TOKEN_CACHE,
+                      load_environment)
 
-load_dotenv()
+load_environment()
 
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIPY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIPY_CLIENT_SECRET")
 SPOTIFY_REDIRECT_URI = os.getenv("SPOTIPY_REDIRECT_URI")
+SPOTIFY_API_PREFIX = os.getenv("SPOTIFY_API_PREFIX") # Another Web API root, e.g. a replay.py stand-in server (no OAuth)
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-GEMINI_MODEL = "google/gemini-2.5-flash-preview"
-# OPENAI_MODEL = "openai/gpt-4.1" # or "openai/o1", "openai/gpt-4o-2024-11-20",  "openai/o1-preview"
-# ANTHROPIC_MODEL = "anthropic/claude-3.7-sonnet"  # or "anthropic/claude-3.7-sonnet:thinking", "anthropic/claude-3.5-haiku", "anthropic/claude-3.5-sonnet" 
-
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_MODEL = "gpt-4o" # gpt-4.1, o3, o1
-
-# Ensure the model IDs are valid
-
-SCOPES = "user-library-read playlist-modify-public playlist-read-private playlist-read-collaborative"
-NEW_PLAYLIST_NAME = "New AI Recommendations"
-ALL_RECS_PLAYLIST_NAME = "All AI Recommendations"
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") # None means the official API
 
-TARGET_NEW_SONGS_COUNT = 20
-MAX_MODEL_ATTEMPTS = 10 # Increased attempts as we ask for exactly 20 each time
-MAX_SONGS_TO_MODEL_PROMPT = 200 # Max liked songs for the initial model prompt
-
-def get_spotify_client():
+def get_spotify_client(cache_path=SPOTIFY_TOKEN_CACHE, requests_session=None, interactive=True, api_prefix=SPOTIFY_API_PREFIX):
+    """
+    Spotify client authorized with the token stored in `cache_path` (one file per account).
+    Clients of several accounts can share one `requests_session` (and so its connection pool); by default
+    the pooled session of clients.py. Retries are left to scheduler.py: spotipy's own urllib3 Retry would
+    retry 429s and 5xx underneath it and turn them into header-less "Max Retries" errors.
+    Without `interactive`, returns None instead of starting the browser login when there is no valid token.
+    With `api_prefix` (e.g. a local stand-in server, see replay.py) requests go there and no login is done.
+    """
+    requests_session = requests_session or get_requests_session()
+    if api_prefix:
+        sp = spotipy.Spotify(auth="stand-in", requests_session=requests_session, retries=0, status_retries=0)
+        sp.prefix = api_prefix
+        print(f"Using the Spotify API stand-in at {api_prefix}.")
+        return sp
     auth_manager = SpotifyOAuth(
         client_id=SPOTIFY_CLIENT_ID,
         client_secret=SPOTIFY_CLIENT_SECRET,
         redirect_uri=SPOTIFY_REDIRECT_URI,
         scope=SCOPES,
-        cache_path=".spotify_cache"
+        cache_path=cache_path,
+        requests_session=requests_session
     )
-    sp = spotipy.Spotify(auth_manager=auth_manager)
+    if not interactive and not auth_manager.validate_token(auth_manager.cache_handler.get_cached_token()):
+        print(f"No valid Spotify token in '{cache_path}'. Log in once with: "
+              f"python spotify_playlist.py --token-cache={cache_path}")
+        return None
+    sp = spotipy.Spotify(auth_manager=auth_manager, requests_session=requests_session, retries=0, status_retries=0)
     print("Successfully authenticated with Spotify.")
     return sp
 
 
+def liked_item_to_record(item):
+    track = item.get('track')
+    if track and track.get('name') and track.get('artists') and track.get('uri'):
+        if track['artists']: # Ensure artist list is not empty
+            return {
+                "uri": track['uri'],
+                "track": track['name'],
+                "artist": track['artists'][0]['name'],
+                "isrc": (track.get('external_ids') or {}).get('isrc'),
+                "added_at": item.get('added_at') or ""
+            }
+    return None
+
+
+def fetch_liked_songs_records(sp, max_workers=SPOTIFY_MAX_CONCURRENT_REQUESTS, throttle=None):
+    """
+    Fetches the whole Saved Tracks library, fanning the pages out over a bounded thread pool.
+    Returns a tuple: (liked_song_records_list, complete)
+    """
+    items, complete = fetch_all_pages(
+        lambda limit, offset: sp.current_user_saved_tracks(limit=limit, offset=offset),
+        limit=50,
+        max_workers=max_workers,
+        throttle=throttle or get_scheduler("spotify"),
+        label="liked songs"
+    )
+    records = [record for record in map(liked_item_to_record, items) if record]
+    return records, complete
+
+
 def get_all_liked_songs_details(sp):
     print("Fetching all liked songs details...")
-    liked_songs_details = []
+    liked_songs_details, _ = fetch_liked_songs_records(sp)
+    print(f"Total liked songs details fetched: {len(liked_songs_details)}")
+    return liked_songs_details
+
+
+def sync_liked_songs(sp, library_store, full=False, throttle=None):
+    """
+    Brings the local library store up to date with the user's Saved Tracks.
+    Saved Tracks are returned newest first, so an incremental sync only walks pages
+    until it reaches a song already stored with an `added_at` not newer than the last one seen.
+    A full reconcile (also done when the store is empty) re-downloads everything and drops
+    songs that are no longer liked. Neither kind of sync is stored unless every page was fetched:
+    storing the newest pages alone would move `last_added_at` past the songs of the missing ones, which
+    later incremental syncs would then never fetch. The store is left as it was and the next sync retries.
+    Requests go through `throttle` (an AdaptiveThrottle), by default the shared Spotify RequestScheduler.
+    Returns the number of songs fetched from Spotify.
+    """
+    throttle = throttle or get_scheduler("spotify")
+    last_added_at = library_store.last_added_at()
+    if full or not last_added_at:
+        print("Running full reconcile of the liked songs library...")
+        liked_songs_details, complete = fetch_liked_songs_records(sp, throttle=throttle)
+        if not complete:
+            print(f"Library fetch incomplete ({len(liked_songs_details)} songs fetched). Keeping the library store as it was.")
+            return 0
+        stored, removed = library_store.replace_all(liked_songs_details)
+        print(f"Library store reconciled: {stored} liked songs stored, {removed} no longer liked removed.")
+        return len(liked_songs_details)
+
+    print(f"Syncing liked songs added since {last_added_at}...")
+    new_records = []
     offset = 0
     limit = 50
-    while True:
+    reached_known = False
+    while not reached_known:
         try:
-            results = sp.current_user_saved_tracks(limit=limit, offset=offset)
-            if not results or not results['items']:
-                break
-            for item in results['items']:
-                track = item.get('track')
-                if track and track.get('name') and track.get('artists'):
-                    if track['artists']: # Ensure artist list is not empty
-                        artist_name = track['artists'][0]['name']
-                        liked_songs_details.append({"track": track['name'], "artist": artist_name})
-            offset += limit
-            print(f"Fetched {len(liked_songs_details)} liked songs so far...")
-            if not results.get('next'):
-                break
-            time.sleep(0.05)
+            results = throttle.call(sp.current_user_saved_tracks, limit=limit, offset=offset)
         except Exception as e:
-            print(f"Error fetching liked songs page: {e}")
+            # Storing a partial walk would move last_added_at past the pages never fetched, losing them
+            # for good: store nothing, the next sync walks the same pages again.
+            print(f"Error fetching liked songs page: {e}. Keeping the library store as it was.")
+            return 0
+        if not results or not results['items']:
             break
-    print(f"Total liked songs details fetched: {len(liked_songs_details)}")
-    return liked_songs_details
+        for item in results['items']:
+            record = liked_item_to_record(item)
+            if not record:
+                continue
+            if record['added_at'] < last_added_at or (
+                record['added_at'] == last_added_at and library_store.contains(record['uri'])
+            ):
+                reached_known = True
+                break
+            new_records.append(record)
+        offset += limit
+        if not results.get('next'):
+            break
+    library_store.upsert_many(new_records)
+    print(f"Fetched {len(new_records)} newly liked songs. Library store now holds {library_store.count()} songs.")
+    return len(new_records)
 
 
-def get_playlist_by_name(sp, playlist_name, user_id):
-    playlists = sp.current_user_playlists(limit=50)
-    while playlists:
+def find_playlists_by_name(sp, playlist_names, user_id):
+    """
+    Pages through the user's playlists once, looking for all `playlist_names` at the same time,
+    and stops as soon as every one of them was found. Returns {name: playlist} for the names found.
+    """
+    scheduler = get_scheduler("spotify")
+    remaining = set(playlist_names)
+    found = {}
+    playlists = scheduler.call(sp.current_user_playlists, limit=50)
+    while playlists and remaining:
         for playlist in playlists['items']:
-            if playlist['name'] == playlist_name and playlist['owner']['id'] == user_id:
-                return playlist
-        if playlists['next']:
-            playlists = sp.next(playlists)
-            time.sleep(0.05)
+            if playlist['name'] in remaining and playlist['owner']['id'] == user_id:
+                found[playlist['name']] = playlist
+                remaining.discard(playlist['name'])
+        if remaining and playlists['next']:
+            playlists = scheduler.call(sp.next, playlists)
         else:
             playlists = None
-    return None
+    return found
 
 
-def get_or_create_playlist_id(sp, user_id, playlist_name, public=True):
-    playlist_object = get_playlist_by_name(sp, playlist_name, user_id)
-    if playlist_object:
-        print(f"Found existing playlist: '{playlist_name}' (ID: {playlist_object['id']})")
-        return playlist_object['id']
-    else:
-        print(f"Playlist '{playlist_name}' not found. Creating it...")
+def get_playlist_by_name(sp, playlist_name, user_id):
+    return find_playlists_by_name(sp, [playlist_name], user_id).get(playlist_name)
+
+
+def _is_cached_playlist_valid(sp, playlist_id, playlist_name, user_id):
+    # One small GET: the playlist still exists, is the user's and still has that name.
+    try:
+        playlist = get_scheduler("spotify").call(sp.playlist, playlist_id, fields="name,owner(id)")
+    except Exception as e:
+        print(f"Cached ID of playlist '{playlist_name}' could not be checked ({e}), looking it up again.")
+        return False
+    return bool(playlist) and playlist.get('name') == playlist_name and (playlist.get('owner') or {}).get('id') == user_id
+
+
+def get_or_create_playlist_ids(sp, user_id, playlist_names, library_store=None, public=True, create=True):
+    """
+    Resolves several playlist names to IDs, creating the playlists that don't exist (unless not `create`).
+    IDs cached in `library_store` are checked with one GET each; the names that are not cached (or
+    whose cached ID is stale) are all looked up in a single scan of the user's playlists.
+    Returns {name: playlist_id}; a playlist that could not be created is left out.
+    """
+    playlist_ids = {}
+    if library_store:
+        for name, playlist_id in library_store.get_playlist_ids(playlist_names).items():
+            if _is_cached_playlist_valid(sp, playlist_id, name, user_id):
+                print(f"Found existing playlist: '{name}' (ID: {playlist_id}, cached)")
+                playlist_ids[name] = playlist_id
+            else:
+                library_store.forget_playlist_ids([name])
+
+    missing = [name for name in playlist_names if name not in playlist_ids]
+    if missing:
+        for name, playlist_object in find_playlists_by_name(sp, missing, user_id).items():
+            print(f"Found existing playlist: '{name}' (ID: {playlist_object['id']})")
+            playlist_ids[name] = playlist_object['id']
+
+    for name in playlist_names:
+        if name in playlist_ids or not create:
+            continue
+        print(f"Playlist '{name}' not found. Creating it...")
         try:
-            new_playlist = sp.user_playlist_create(user=user_id, name=playlist_name, public=public)
-            print(f"Successfully created playlist: '{playlist_name}' (ID: {new_playlist['id']})")
-            return new_playlist['id']
+            # Not retried on a timeout or a 5xx: the playlist may exist by then, and a retry would duplicate it
+            new_playlist = get_scheduler("spotify").call(sp.user_playlist_create, user=user_id, name=name, public=public,
+                                                         retry_transient=False)
+            print(f"Successfully created playlist: '{name}' (ID: {new_playlist['id']})")
+            playlist_ids[name] = new_playlist['id']
         except Exception as e:
-            print(f"Error creating playlist '{playlist_name}': {e}")
-            return None
+            print(f"Error creating playlist '{name}': {e}")
+
+    if library_store:
+        library_store.set_playlist_ids(playlist_ids)
+    return playlist_ids
+
+
+def get_or_create_playlist_id(sp, user_id, playlist_name, public=True, library_store=None):
+    return get_or_create_playlist_ids(sp, user_id, [playlist_name], library_store, public).get(playlist_name)
+
+
+PLAYLIST_ITEM_FIELDS = "items(track(uri,name,artists(name),external_ids(isrc))),next,total"
+
+
+def playlist_item_to_record(item):
+    track_info = item.get('track')
+    if track_info and track_info.get('name') and track_info.get('artists'):
+        if track_info['artists']:
+            return {
+                "uri": track_info.get('uri'),
+                "track": track_info['name'],
+                "artist": track_info['artists'][0]['name'],
+                "isrc": (track_info.get('external_ids') or {}).get('isrc')
+            }
+    return None
+
+
+def fetch_playlist_items(sp, playlist_id, max_workers=SPOTIFY_MAX_CONCURRENT_REQUESTS, throttle=None):
+    """Returns a tuple: (raw playlist items in playlist order, complete), see paging.fetch_all_pages."""
+    return fetch_all_pages(
+        lambda limit, offset: sp.playlist_items(playlist_id, limit=limit, offset=offset, fields=PLAYLIST_ITEM_FIELDS),
+        limit=100,
+        max_workers=max_workers,
+        throttle=throttle or get_scheduler("spotify"),
+        label=f"tracks from playlist ID {playlist_id}"
+    )
 
 
-def get_playlist_tracks_simplified(sp, playlist_id):
+def get_playlist_tracks_simplified(sp, playlist_id, max_workers=SPOTIFY_MAX_CONCURRENT_REQUESTS, throttle=None):
     if not playlist_id: return []
     print(f"Fetching tracks from playlist ID: {playlist_id}...")
-    playlist_tracks = []
-    offset = 0
-    limit = 100
-    while True:
-        try:
-            results = sp.playlist_items(playlist_id, limit=limit, offset=offset, fields="items(track(name,artists(name))),next")
-            if not results or not results['items']: break
-            for item in results['items']:
-                track_info = item.get('track')
-                if track_info and track_info.get('name') and track_info.get('artists'):
-                    if track_info['artists']:
-                        artist_name = track_info['artists'][0]['name']
-                        playlist_tracks.append({"track": track_info['name'], "artist": artist_name})
-            offset += limit
-            print(f"Fetched {len(playlist_tracks)} tracks from playlist ID {playlist_id} so far...")
-            if not results.get('next'): break
-            time.sleep(0.05)
-        except Exception as e:
-            print(f"Error fetching playlist items for {playlist_id}: {e}")
-            break
+    items, _ = fetch_playlist_items(sp, playlist_id, max_workers, throttle)
+    playlist_tracks = [record for record in map(playlist_item_to_record, items) if record]
     print(f"Total tracks fetched from playlist ID {playlist_id}: {len(playlist_tracks)}")
     return playlist_tracks
 
 
-def get_recommendations_openai(api_key, conversation_history):
+def _print_parse_outcome(provider_label, result):
+    if result.parse_path == "fast":
+        print(f"Successfully parsed JSON response from {provider_label} ({len(result.recommendations)} recommendations, {result.elapsed:.1f}s).")
+    elif result.parse_path == "recovered":
+        print(f"Recovered {len(result.recommendations)} recommendations from a malformed {provider_label} response ({result.error}).")
+    else:
+        print(f"Error: {provider_label} response could not be parsed: {result.error}")
+        print(f"{provider_label} Raw Response Content:\n{result.raw}")
+
+
+def _openai_error_result(e, started_at):
+    from openai import APIError # Only reached once the OpenAI SDK is loaded
+    if isinstance(e, APIError):
+        print(f"Error calling OpenAI API: {e}")
+        if hasattr(e, 'status_code'): print(f"Status code: {e.status_code}")
+        if hasattr(e, 'body') and e.body:
+             try: print(f"Error body: {json.dumps(e.body)}")
+             except: print(f"Error body (raw): {e.body}")
+    else:
+        print(f"An unexpected error occurred: {e.__class__.__name__}: {e}")
+    return RecommendationResult.failed(f"{e.__class__.__name__}: {e}", elapsed=time.monotonic() - started_at)
+
+
+def _check_conversation(conversation_history):
+    if not conversation_history or conversation_history[-1]["role"] != "user":
+        print("Error: Conversation history is empty or does not end with a user message.")
+        return False
+    return True
+
+
+def get_recommendations_openai(api_key, conversation_history, base_url=None):
     """
     Sends the conversation history to model provider and requests a JSON response.
-    Returns a tuple: (parsed_recommendations_list, raw_assistant_response_content_string)
+    Returns a RecommendationResult (see response_parser.py), also on failure.
     The last message in conversation_history should ideally instruct the AI to respond in JSON.
     """
     print(f"\nSending request to OpenAI with {len(conversation_history)} messages...")
-    if not conversation_history or conversation_history[-1]["role"] != "user":
-        print("Error: Conversation history is empty or does not end with a user message.")
-        return None, None
+    if not _check_conversation(conversation_history):
+        return RecommendationResult.failed("conversation does not end with a user message")
 
+    started_at = time.monotonic()
     try:
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
+        client = get_openai_client(api_key, base_url or OPENAI_BASE_URL)
+        response = get_scheduler("openai").call(
+            client.chat.completions.create,
             model=OPENAI_MODEL,
             messages=conversation_history,
             response_format={"type": "json_object"},
             timeout=60.0
         )
+        metrics.record_token_usage("openai", response.usage)
         raw_assistant_response_content = response.choices[0].message.content
         if raw_assistant_response_content is None:
             print("Error: OpenAI returned no content. This should not happen with JSON mode.")
             print(f"Full OpenAI Response: {response.model_dump_json(indent=2)}")
-            return None, None
+            return RecommendationResult.failed("no content", elapsed=time.monotonic() - started_at, response=response)
 
-        try:
-            parsed_json = json.loads(raw_assistant_response_content)["recommendations"]
-            print("Successfully parsed JSON response from OpenAI.")
-            return parsed_json, raw_assistant_response_content, response
-        except json.JSONDecodeError as e:
-            print(f"Error: OpenAI response was not valid JSON, despite requesting json_object mode: {e}")
-            print(f"OpenAI Raw Response Content:\n{raw_assistant_response_content}")
-            return None, raw_assistant_response_content
-
-    except APIError as e:
-        print(f"Error calling OpenAI API: {e}")
-        if hasattr(e, 'status_code'): print(f"Status code: {e.status_code}")
-        if hasattr(e, 'body') and e.body:
-             try: print(f"Error body: {json.dumps(e.body)}")
-             except: print(f"Error body (raw): {e.body}")
-        return None, None
+        result = parse_response(raw_assistant_response_content, started_at, response)
+        _print_parse_outcome("OpenAI", result)
+        return result
     except Exception as e:
-        print(f"An unexpected error occurred: {e.__class__.__name__}: {e}")
-        return None, None
+        return _openai_error_result(e, started_at)
+
+
+def stream_recommendations_openai(api_key, conversation_history, on_recommendation=None, base_url=None, cancel=None):
+    """
+    Streaming variant of get_recommendations_openai.
+    Each Recommendation is passed to `on_recommendation` as soon as its closing brace is streamed,
+    so Spotify verification can start before the model has finished answering.
+    Once the `cancel` threading.Event is set (e.g. the run has collected enough songs), the stream is
+    closed at the next chunk, which ends the HTTP request and the generation billed for it.
+    Returns a RecommendationResult once the stream is complete or cancelled.
+    """
+    print(f"\nStreaming request to OpenAI with {len(conversation_history)} messages...")
+    if not _check_conversation(conversation_history):
+        return RecommendationResult.failed("conversation does not end with a user message")
+    if cancel is not None and cancel.is_set():
+        return RecommendationResult.failed("cancelled")
+
+    started_at = time.monotonic()
+    try:
+        client = get_openai_client(api_key, base_url or OPENAI_BASE_URL)
+        stream = get_scheduler("openai").call( # Retries cover opening the stream, not a stream cut midway
+            client.chat.completions.create,
+            model=OPENAI_MODEL,
+            messages=conversation_history,
+            response_format={"type": "json_object"},
+            timeout=60.0,
+            stream=True,
+            stream_options={"include_usage": True} # Token counts arrive in a last chunk without choices
+        )
+        parser = IncrementalRecommendationParser()
+        with stream: # Closes the response, also when the stream is given up halfway
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    print("OpenAI stream closed: the run no longer needs this reply.")
+                    return RecommendationResult.failed("cancelled", elapsed=time.monotonic() - started_at)
+                if getattr(chunk, "usage", None):
+                    metrics.record_token_usage("openai", chunk.usage)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                for rec in parser.feed(chunk.choices[0].delta.content):
+                    if on_recommendation:
+                        on_recommendation(rec)
+
+        if not parser.text:
+            print("Error: OpenAI streamed no content. This should not happen with JSON mode.")
+            return RecommendationResult.failed("no content", elapsed=time.monotonic() - started_at)
+
+        result = parse_response(parser.text, started_at)
+        _print_parse_outcome("OpenAI", result)
+        return result
+    except Exception as e:
+        return _openai_error_result(e, started_at)
 
 
-def get_recommendations_openrouter(api_key, conversation_history):
+def get_recommendations_openrouter(api_key, conversation_history, base_url=None):
     """
     Sends the conversation history to Gemini and requests recommendations.
-    Returns a tuple: (parsed_recommendations_list, raw_assistant_response_content_string)
+    Returns a RecommendationResult (see response_parser.py), also on failure.
     The last message in conversation_history is assumed to be the current user prompt.
     """
     print(f"\nSending request to Gemini with {len(conversation_history)} messages in history...")
-    if not conversation_history or conversation_history[-1]["role"] != "user":
-        print("Error: Conversation history is empty or does not end with a user message.")
-        return [], None
+    if not _check_conversation(conversation_history):
+        return RecommendationResult.failed("conversation does not end with a user message")
 
+    import httpx # Loaded with the OpenRouter client (see clients.py)
+    started_at = time.monotonic()
     try:
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": GEMINI_MODEL,
-                "messages": conversation_history,
-                "response_format": {"type": "json_object"}
-            },
-            timeout=60 # Increased timeout for potentially longer LLM responses
-        )
-        response.raise_for_status()
+        def post_completion():
+            response = get_http_client("openrouter").post(
+                url=f"{base_url or OPENROUTER_BASE_URL}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": GEMINI_MODEL,
+                    "messages": conversation_history,
+                    "response_format": {"type": "json_object"}
+                },
+                timeout=60 # Increased timeout for potentially longer LLM responses
+            )
+            response.raise_for_status() # Raised inside the scheduler call so 429/5xx are retried
+            return response
+
+        response = get_scheduler("openrouter").call(post_completion)
         
         response_data = response.json()
+        metrics.record_token_usage("openrouter", response_data.get('usage'))
         raw_assistant_response_content = response_data['choices'][0]['message']['content']
-        
-        recommendations = []
-        try:
-            parsed_content = json.loads(raw_assistant_response_content)
-            if isinstance(parsed_content, list):
-                recommendations = parsed_content
-            elif isinstance(parsed_content, dict) and len(parsed_content.keys()) == 1:
-                key = list(parsed_content.keys())[0]
-                if isinstance(parsed_content[key], list):
-                    recommendations = parsed_content[key]
-        except json.JSONDecodeError:
-            print("Gemini response was not directly parsable JSON. Attempting to clean...")
-            content_to_parse = raw_assistant_response_content
-            if content_to_parse.startswith("```json"): content_to_parse = content_to_parse[7:]
-            if content_to_parse.endswith("```"): content_to_parse = content_to_parse[:-3]
-            content_to_parse = content_to_parse.strip()
-            try:
-                parsed_content = json.loads(content_to_parse)
-                if isinstance(parsed_content, list): recommendations = parsed_content
-                elif isinstance(parsed_content, dict) and len(parsed_content.keys()) == 1:
-                    key = list(parsed_content.keys())[0]
-                    if isinstance(parsed_content[key], list): recommendations = parsed_content[key]
-            except json.JSONDecodeError as e_clean:
-                print(f"Error: Gemini response could not be parsed as JSON even after cleaning: {e_clean}")
-                print(f"Gemini Raw Response Content:\n{raw_assistant_response_content}")
-                return [], raw_assistant_response_content # Return raw content for history even on parse error
-
-        valid_recommendations = []
-        for rec in recommendations:
-            if isinstance(rec, dict) and "track" in rec and "artist" in rec:
-                valid_recommendations.append({"track": str(rec["track"]), "artist": str(rec["artist"])})
-            else:
-                print(f"Warning: Skipping invalid recommendation format from Gemini: {rec}")
-        
-        print(f"Received {len(valid_recommendations)} validly structured recommendations from Gemini.")
-        return valid_recommendations, raw_assistant_response_content
+        result = parse_response(raw_assistant_response_content, started_at, response_data)
+        _print_parse_outcome("Gemini", result)
+        return result
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error calling OpenRouter API: {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"Response status: {e.response.status_code}")
             try: print(f"Response content: {e.response.json()}")
             except json.JSONDecodeError: print(f"Response content: {e.response.text}")
-        return [], None
-    except (KeyError, IndexError) as e:
+        return RecommendationResult.failed(f"{e.__class__.__name__}: {e}", elapsed=time.monotonic() - started_at)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
         raw_resp_text = response.text if 'response' in locals() else 'No response object'
         print(f"Error parsing Gemini response structure: {e}")
         print(f"Gemini Raw Response (full): {raw_resp_text}")
-        return [], None
+        return RecommendationResult.failed(f"unexpected response structure: {e}", elapsed=time.monotonic() - started_at)
 
 
-def verify_songs_on_spotify_v2(sp, recommended_songs_details):
-    print("\nVerifying recommended songs on Spotify...")
-    available_songs_info = []
+def search_song_on_spotify(sp, track_name, artist_name):
+    """
+    Returns {"uri", "track", "artist", "isrc"} for the best Spotify match, or None if there is none.
+    Errors propagate to the caller (rate limits and transient errors are retried by the scheduler running it).
+    """
+    query = f"track:{track_name} artist:{artist_name}"
+    results = sp.search(q=query, type="track", limit=1)
+    if results and results['tracks']['items']:
+        found_track = results['tracks']['items'][0]
+        return {
+            "uri": found_track['uri'],
+            "track": found_track['name'],
+            "artist": found_track['artists'][0]['name'],
+            "isrc": (found_track.get('external_ids') or {}).get('isrc')
+        }
+    return None
+
+
+def iter_verified_songs(sp, recommended_songs_details, resolution_cache=None, executor=None,
+                        max_workers=SPOTIFY_MAX_CONCURRENT_REQUESTS, throttle=None):
+    """
+    Resolves the model's Recommendation suggestions to Spotify tracks, yielding as results arrive.
+    Pairs already in `resolution_cache` (found or not found) are answered locally; the rest are
+    searched concurrently (on `executor` if given, else on a private bounded thread pool) and
+    recorded in the cache. Searches that error out are reported and skipped.
+    Yields tuples: (song_detail, {"uri", "track", "artist"} or None if not on Spotify)
+    Closing the generator early cancels the searches that have not started yet.
+    """
+    throttle = throttle or get_scheduler("spotify")
+    cached_results = []
+    to_search = {} # normalized key -> song_detail
+    seen_keys = set()
     for song_detail in recommended_songs_details:
-        track_name = song_detail.get('track')
-        artist_name = song_detail.get('artist')
+        track_name = song_detail.track
+        artist_name = song_detail.artist
         if not track_name or not artist_name: continue
-        query = f"track:{track_name} artist:{artist_name}"
+        key = normalize_song_key(track_name, artist_name)
+        if key in seen_keys: continue
+        seen_keys.add(key)
+        cached = resolution_cache.lookup(track_name, artist_name) if resolution_cache else CACHE_MISS
+        if cached is CACHE_MISS:
+            to_search[key] = song_detail
+        else:
+            cached_results.append((song_detail, cached))
+
+    if resolution_cache:
+        print(f"  {len(cached_results)} resolved from cache, {len(to_search)} to search on Spotify.")
+
+    own_executor = executor is None and bool(to_search)
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_search))))
+    futures = {
+        executor.submit(throttle.call, search_song_on_spotify, sp, song_detail.track, song_detail.artist): song_detail
+        for song_detail in to_search.values()
+    }
+    try:
+        for song_detail, found in cached_results:
+            _print_verification(song_detail, found)
+            yield song_detail, found
+        for future in as_completed(futures):
+            song_detail = futures[future]
+            try:
+                found = future.result()
+            except Exception as e:
+                print(f"  Error searching for '{song_detail.track}' by {song_detail.artist}: {e}")
+                continue
+            if resolution_cache:
+                resolution_cache.store(song_detail.track, song_detail.artist, found)
+            _print_verification(song_detail, found)
+            yield song_detail, found
+    finally:
+        for future in futures:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+def _print_verification(song_detail, found):
+    if found:
+        print(f"  Found on Spotify: '{found['track']}' by {found['artist']}")
+    else:
+        print(f"  Not found on Spotify: '{song_detail.track}' by {song_detail.artist}")
+
+
+def resolve_song_async(sp, song_detail, resolution_cache, executor, throttle, callback):
+    """
+    Resolves one Recommendation suggestion without blocking.
+    `callback(song_detail, found_or_None, error_or_None)` is called right away on a cache hit, otherwise
+    from the search worker once the Spotify search is done (the result is stored in the cache).
+    With a resolution cache, a pair that is already being searched (e.g. for another user of a batch run)
+    joins that search instead of starting a new one.
+    Returns the search Future if this call started one, or None (cache hit or joined search).
+    """
+    track_name, artist_name = song_detail.track, song_detail.artist
+    cached = resolution_cache.lookup(track_name, artist_name) if resolution_cache else CACHE_MISS
+    if cached is not CACHE_MISS:
+        callback(song_detail, cached, None)
+        return None
+
+    def on_done(future):
+        if future.cancelled():
+            # Cancelled by whoever started it; tell the other callers joined on it instead of leaving them waiting.
+            callback(song_detail, None, CancelledError("search cancelled"))
+            return
         try:
-            results = sp.search(q=query, type="track", limit=1)
-            time.sleep(0.05)
-            if results and results['tracks']['items']:
-                found_track = results['tracks']['items'][0]
-                available_songs_info.append({
-                    "uri": found_track['uri'],
-                    "track": found_track['name'],
-                    "artist": found_track['artists'][0]['name']
-                })
-                print(f"  Found on Spotify: '{found_track['name']}' by {found_track['artists'][0]['name']}")
-            else:
-                print(f"  Not found on Spotify: '{track_name}' by {artist_name}")
+            found = future.result()
         except Exception as e:
-            print(f"  Error searching for '{track_name}' by {artist_name}: {e}")
+            callback(song_detail, None, e)
+            return
+        if resolution_cache and started:
+            resolution_cache.store(track_name, artist_name, found)
+        callback(song_detail, found, None)
+
+    def start_search():
+        return executor.submit(throttle.call, search_song_on_spotify, sp, track_name, artist_name)
+
+    if resolution_cache:
+        future, started = resolution_cache.join_search(track_name, artist_name, start_search)
+    else:
+        future, started = start_search(), True
+    future.add_done_callback(on_done)
+    return future if started else None
+
+
+def verify_songs_on_spotify_v2(sp, recommended_songs_details, resolution_cache=None,
+                               max_workers=SPOTIFY_MAX_CONCURRENT_REQUESTS, throttle=None):
+    """
+    Batch version of iter_verified_songs.
+    Returns the list of {"uri", "track", "artist"} dicts found, in suggestion order.
+    """
+    print("\nVerifying recommended songs on Spotify...")
+    resolved = {}
+    for song_detail, found in iter_verified_songs(sp, recommended_songs_details, resolution_cache,
+                                                  max_workers=max_workers, throttle=throttle):
+        resolved[normalize_song_key(song_detail.track, song_detail.artist)] = found
+    available_songs_info = []
+    for song_detail in recommended_songs_details:
+        key = normalize_song_key(song_detail.track, song_detail.artist)
+        found = resolved.pop(key, None)
+        if found:
+            available_songs_info.append(found)
     print(f"\nVerified {len(available_songs_info)} songs as available on Spotify.")
     return available_songs_info
 
 
 def update_playlist_items(sp, playlist_id, track_uris, replace=False):
     if not playlist_id: return False
+    scheduler = get_scheduler("spotify")
     if not track_uris and not replace: return True
     if not track_uris and replace:
         try:
-            sp.playlist_replace_items(playlist_id, [])
+            scheduler.call(sp.playlist_replace_items, playlist_id, [])
             print(f"Cleared all items from playlist ID {playlist_id}.")
             return True
         except Exception as e: print(f"Error clearing playlist {playlist_id}: {e}"); return False
@@ -302,16 +601,14 @@ def update_playlist_items(sp, playlist_id, track_uris, replace=False):
             # or spotipy might make multiple calls.
             # Let's stick to safer manual batching if >100 for replace.
             if len(track_uris) <= 100:
-                 sp.playlist_replace_items(playlist_id, track_uris)
+                 scheduler.call(sp.playlist_replace_items, playlist_id, track_uris)
             else:
-                sp.playlist_replace_items(playlist_id, []) # Clear
+                scheduler.call(sp.playlist_replace_items, playlist_id, []) # Clear
                 for i in range(0, len(track_uris), 100):
-                    sp.playlist_add_items(playlist_id, track_uris[i:i + 100])
-                    time.sleep(0.1)
+                    scheduler.call(sp.playlist_add_items, playlist_id, track_uris[i:i + 100], retry_transient=False)
         else: # Appending
             for i in range(0, len(track_uris), 100):
-                sp.playlist_add_items(playlist_id, track_uris[i:i + 100])
-                time.sleep(0.1)
+                scheduler.call(sp.playlist_add_items, playlist_id, track_uris[i:i + 100], retry_transient=False)
         print(f"Successfully {action.lower()}ed songs in playlist ID {playlist_id}.")
         return True
     except Exception as e:
@@ -0,0 +1,205 @@
+import sqlite3
+import threading
+import time
+
+from track_index import TrackIndex
+
+
+class LibraryStore:
+    """
+    On-disk store of the user's Saved Tracks, keyed by track URI.
+    Keeps the `added_at` timestamp of every liked song so that a run only has to
+    fetch the pages that are newer than the last one seen.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS liked_tracks (
+                uri TEXT PRIMARY KEY,
+                track TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                isrc TEXT,
+                added_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_liked_tracks_added_at ON liked_tracks (added_at);
+            CREATE TABLE IF NOT EXISTS library_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS playlist_ids (
+                name TEXT PRIMARY KEY,
+                playlist_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS playlist_snapshots (
+                playlist_id TEXT PRIMARY KEY,
+                snapshot_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS playlist_tracks (
+                playlist_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                uri TEXT,
+                track TEXT,
+                artist TEXT,
+                isrc TEXT,
+                PRIMARY KEY (playlist_id, position)
+            );
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM liked_tracks").fetchone()[0]
+
+    def last_added_at(self):
+        # Spotify timestamps are ISO-8601 UTC ("2024-05-01T12:34:56Z"), so they sort lexicographically.
+        with self._lock:
+            return self._conn.execute("SELECT MAX(added_at) FROM liked_tracks").fetchone()[0]
+
+    def contains(self, uri):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM liked_tracks WHERE uri = ?", (uri,)).fetchone() is not None
+
+    def upsert_many(self, records):
+        rows = [(r['uri'], r['track'], r['artist'], r.get('isrc'), r['added_at']) for r in records]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO liked_tracks (uri, track, artist, isrc, added_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(uri) DO UPDATE SET track = excluded.track, artist = excluded.artist, "
+                "isrc = excluded.isrc, added_at = excluded.added_at",
+                rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def replace_all(self, records):
+        """
+        Full reconcile: the store ends up holding exactly `records`.
+        Returns a tuple: (number_of_tracks_stored, number_of_tracks_removed)
+        """
+        rows = [(r['uri'], r['track'], r['artist'], r.get('isrc'), r['added_at']) for r in records]
+        with self._lock:
+            before = self._conn.execute("SELECT COUNT(*) FROM liked_tracks").fetchone()[0]
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_uris (uri TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM seen_uris")
+            self._conn.executemany("INSERT OR IGNORE INTO seen_uris (uri) VALUES (?)", [(row[0],) for row in rows])
+            self._conn.execute("DELETE FROM liked_tracks WHERE uri NOT IN (SELECT uri FROM seen_uris)")
+            removed = before - self._conn.execute("SELECT COUNT(*) FROM liked_tracks").fetchone()[0]
+            self._conn.executemany(
+                "INSERT INTO liked_tracks (uri, track, artist, isrc, added_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(uri) DO UPDATE SET track = excluded.track, artist = excluded.artist, "
+                "isrc = excluded.isrc, added_at = excluded.added_at",
+                rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO library_meta (key, value) VALUES ('last_full_sync', ?)",
+                (str(time.time()),)
+            )
+            self._conn.commit()
+            stored = self._conn.execute("SELECT COUNT(*) FROM liked_tracks").fetchone()[0]
+        return stored, removed
+
+    def last_full_sync(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM library_meta WHERE key = 'last_full_sync'").fetchone()
+        return float(row[0]) if row else None
+
+    def get_suggestion_hit_rate(self):
+        """Share of model suggestions collected in past runs (see collector.SuggestionBudget), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM library_meta WHERE key = 'suggestion_hit_rate'").fetchone()
+        return float(row[0]) if row else None
+
+    def set_suggestion_hit_rate(self, hit_rate):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO library_meta (key, value) VALUES ('suggestion_hit_rate', ?)",
+                (str(hit_rate),)
+            )
+            self._conn.commit()
+
+    def get_liked_songs_details(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT uri, track, artist, isrc, added_at FROM liked_tracks ORDER BY added_at DESC"
+            ).fetchall()
+        return [{"uri": uri, "track": track, "artist": artist, "isrc": isrc, "added_at": added_at}
+                for uri, track, artist, isrc, added_at in rows]
+
+    def get_playlist_ids(self, names):
+        """Cached playlist name -> ID mapping for the given names (names never resolved are left out)."""
+        names = list(names)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT name, playlist_id FROM playlist_ids WHERE name IN ({', '.join('?' * len(names))})", names
+            ).fetchall()
+        return dict(rows)
+
+    def set_playlist_ids(self, playlist_ids):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO playlist_ids (name, playlist_id) VALUES (?, ?)", list(playlist_ids.items())
+            )
+            self._conn.commit()
+
+    def forget_playlist_ids(self, names):
+        with self._lock:
+            self._conn.executemany("DELETE FROM playlist_ids WHERE name = ?", [(name,) for name in names])
+            self._conn.commit()
+
+    def get_playlist_snapshot(self, playlist_id):
+        """Returns (snapshot_id, tracks) as last recorded for the playlist, or (None, None)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT snapshot_id FROM playlist_snapshots WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+            if not row:
+                return None, None
+            rows = self._conn.execute(
+                "SELECT uri, track, artist, isrc FROM playlist_tracks WHERE playlist_id = ? ORDER BY position",
+                (playlist_id,)
+            ).fetchall()
+        return row[0], [{"uri": uri, "track": track, "artist": artist, "isrc": isrc} for uri, track, artist, isrc in rows]
+
+    def get_playlist_snapshot_id(self, playlist_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT snapshot_id FROM playlist_snapshots WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_playlist_snapshot(self, playlist_id, snapshot_id, tracks):
+        """Records the playlist's content (dicts with "uri", "track", "artist", "isrc", in playlist order)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,))
+            self._conn.executemany(
+                "INSERT INTO playlist_tracks (playlist_id, position, uri, track, artist, isrc) VALUES (?, ?, ?, ?, ?, ?)",
+                [(playlist_id, position, t.get('uri'), t.get('track'), t.get('artist'), t.get('isrc'))
+                 for position, t in enumerate(tracks)]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO playlist_snapshots (playlist_id, snapshot_id) VALUES (?, ?)",
+                (playlist_id, snapshot_id)
+            )
+            self._conn.commit()
+
+    def forget_playlist_snapshot(self, playlist_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM playlist_snapshots WHERE playlist_id = ?", (playlist_id,))
+            self._conn.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,))
+            self._conn.commit()
+
+    def get_liked_songs_index(self, approximate=False):
+        """TrackIndex of the liked songs (URI, ISRC and canonical title/artist) for de-duplication."""
+        with self._lock:
+            rows = self._conn.execute("SELECT uri, track, artist, isrc FROM liked_tracks").fetchall()
+        index = TrackIndex(approximate=approximate)
+        for uri, track, artist, isrc in rows:
+            index.add(track, artist, uri, isrc)
+        return index
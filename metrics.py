@@ -0,0 +1,213 @@
+"""
+Process-wide run metrics: counters, timings and spans of the pipeline stages and API calls.
+
+    from metrics import metrics
+    metrics.incr("search_cache_total", result="hit")
+    with metrics.span("library_sync", user=user_id):
+        ...
+
+Each run is written as one JSON line to the run log (begin_run / end_run: counters are the deltas of the
+run), and the cumulative values can be scraped in the Prometheus text format (start_metrics_server).
+"""
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+METRIC_PREFIX = "spotifai_"
+MAX_SPANS = 10000 # Spans kept per run; older ones are dropped (their timings are still aggregated)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def _prometheus_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters (incr), gauges (set_gauge) and timings (observe: count / sum / max
+    seconds). span() times a block as a timing named after the span and also keeps the span itself
+    (start, duration, attributes, enclosing span) for the run log.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {} # key -> [count, sum, max]
+        self._run_max = {} # key -> max seconds since the current run began
+        self._spans = []
+        self._run = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            timing = self._timings.setdefault(key, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            self._run_max[key] = max(self._run_max.get(key, 0.0), seconds)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        stack = self._local.__dict__.setdefault("stack", [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            self.observe("stage_seconds", duration, stage=name)
+            span = {"name": name, "started_at": round(started_at, 3), "duration": round(duration, 4)}
+            if parent:
+                span["parent"] = parent
+            if attributes:
+                span["attributes"] = attributes
+            with self._lock:
+                if len(self._spans) < MAX_SPANS:
+                    self._spans.append(span)
+
+    def record_token_usage(self, provider, usage):
+        """Token counts of an OpenAI-style `usage` (object or dict); missing usage is ignored."""
+        if usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            count = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+            if count:
+                self.incr("model_tokens_total", count, provider=provider, kind=kind.split("_")[0])
+
+    def begin_run(self, **info):
+        """Starts a run: its spans and the counter / timing deltas from here go into the next end_run() record."""
+        with self._lock:
+            self._spans = []
+            self._run = {
+                "run_id": uuid.uuid4().hex[:12],
+                "started_at": time.time(),
+                "info": info,
+                "counters": dict(self._counters),
+                "timings": {key: list(timing) for key, timing in self._timings.items()},
+            }
+            self._run_max = {}
+            return self._run["run_id"]
+
+    def end_run(self, log_path=None, **info):
+        """Returns the record of the current run and appends it as one JSON line to `log_path`, if given."""
+        with self._lock:
+            run = self._run or {"run_id": uuid.uuid4().hex[:12], "started_at": time.time(), "info": {},
+                                "counters": {}, "timings": {}}
+            self._run = None
+            finished_at = time.time()
+            counters = {}
+            for key, value in self._counters.items():
+                delta = value - run["counters"].get(key, 0)
+                if delta:
+                    counters[_format_key(key)] = delta
+            timings = {}
+            for key, (count, total, _) in self._timings.items():
+                before = run["timings"].get(key, [0, 0.0, 0.0])
+                if count > before[0]:
+                    timings[_format_key(key)] = {"count": count - before[0], "sum": round(total - before[1], 4),
+                                                 "max": round(self._run_max.get(key, 0.0), 4)}
+            self._run_max = {}
+            record = {
+                "run_id": run["run_id"],
+                "started_at": round(run["started_at"], 3),
+                "duration": round(finished_at - run["started_at"], 3),
+                "info": {**run["info"], **info},
+                "counters": counters,
+                "gauges": {_format_key(key): value for key, value in self._gauges.items()},
+                "timings": timings,
+                "spans": list(self._spans),
+            }
+        if log_path:
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        return record
+
+    def prometheus_text(self):
+        """Cumulative metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {key: list(timing) for key, timing in self._timings.items()}
+        lines = []
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({key[0] for key in values}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+                lines.extend(f"{METRIC_PREFIX}{name}{_prometheus_labels(labels)} {value}"
+                             for (metric, labels), value in sorted(values.items()) if metric == name)
+        for name in sorted({key[0] for key in timings}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} summary")
+            for (metric, labels), (count, total, longest) in sorted(timings.items()):
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}{name}_count{_prometheus_labels(labels)} {count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{_prometheus_labels(labels)} {total:.6f}")
+                    lines.append(f"{METRIC_PREFIX}{name}{_prometheus_labels(labels, [('quantile', '1')])} {longest:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def print_stage_timings(self, record):
+        """Prints where the wall-clock time of a run (an end_run() record) went, stage by stage."""
+        stages = {key: timing for key, timing in record["timings"].items() if key.startswith("stage_seconds")}
+        if not stages:
+            return
+        print(f"\nStage timings (run {record['run_id']}, {record['duration']:.1f}s):")
+        for key, timing in sorted(stages.items(), key=lambda item: -item[1]["sum"]):
+            stage = key.split('stage="', 1)[1].split('"', 1)[0]
+            print(f"  {stage}: {timing['sum']:.2f}s" + (f" over {timing['count']} spans" if timing["count"] > 1 else ""))
+
+
+metrics = Metrics()
+
+
+def start_metrics_server(port, host="127.0.0.1", registry=metrics):
+    """Serves `registry` in the Prometheus text format at http://host:port/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Prometheus metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 8
+MAX_RATE_LIMIT_RETRIES = 5
+DEFAULT_RETRY_AFTER = 1.0 # Seconds to wait on a 429 that carries no Retry-After header
+
+
+def get_status_code(exc):
+    """HTTP status of an error from spotipy (`http_status`), openai (`status_code`) or requests/httpx (`response`)."""
+    status = getattr(exc, 'http_status', None) or getattr(exc, 'status_code', None)
+    response = getattr(exc, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return status
+
+
+def get_retry_after(exc):
+    """
+    Returns the Retry-After delay (seconds) of a rate-limited (HTTP 429) error, or None if `exc` is not one.
+    Works with spotipy's SpotifyException and anything else exposing `http_status`/`status_code` and `headers`.
+    """
+    if get_status_code(exc) != 429:
+        return None
+    response = getattr(exc, 'response', None)
+    headers = getattr(exc, 'headers', None) or (getattr(response, 'headers', None) if response is not None else None) or {}
+    try:
+        return max(float(headers.get('Retry-After')), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class AdaptiveThrottle:
+    """
+    Shared concurrency gate for the page workers.
+    Runs up to `max_concurrency` requests at once with no artificial delay. On a 429 every worker
+    pauses for Retry-After and the allowed concurrency is halved; it then grows back by one
+    for every `recovery_successes` successful requests.
+    With a `rate_limiter` (a rate_limit.TokenBucket), every request also takes a token from it first.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_WORKERS, recovery_successes=4, rate_limiter=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = rate_limiter
+        self.current_limit = self.max_concurrency
+        self.recovery_successes = recovery_successes
+        self.rate_limited_count = 0
+        self._in_flight = 0
+        self._successes = 0
+        self._pause_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._pause_until - time.monotonic()
+                if wait <= 0 and self._in_flight < self.current_limit:
+                    self._in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, success=True):
+        with self._cond:
+            self._in_flight -= 1
+            if success:
+                self._successes += 1
+                if self.current_limit < self.max_concurrency and self._successes >= self.recovery_successes:
+                    self.current_limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def backoff(self, retry_after):
+        with self._cond:
+            self.rate_limited_count += 1
+            self._pause_until = max(self._pause_until, time.monotonic() + retry_after)
+            self.current_limit = max(1, self.current_limit // 2)
+            self._successes = 0
+            self._cond.notify_all()
+
+    def call(self, fn, *args, retry_transient=True, **kwargs):
+        """
+        Runs `fn` under the throttle, waiting and retrying on 429 responses (the only errors retried here,
+        so `retry_transient` is accepted for compatibility with scheduler.RequestScheduler.call).
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retry_after = get_retry_after(e)
+                self.release(success=False)
+                if retry_after is None or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                self.backoff(retry_after)
+                print(f"Rate limited (429). Backing off {retry_after:.1f}s, concurrency now {self.current_limit}...")
+                continue
+            self.release(success=True)
+            return result
+
+
+def fetch_all_pages(fetch_page, limit, max_workers=DEFAULT_MAX_WORKERS, throttle=None, label="items"):
+    """
+    Fetches every page of a Spotify paging object.
+    `fetch_page(limit, offset)` must return the raw page dict (with 'items' and 'total').
+    The first page is fetched alone to learn `total`; the remaining offsets are then fanned out over
+    a bounded thread pool and reassembled in offset order.
+    Returns a tuple: (items_list, complete) where `complete` is False if a page could not be fetched,
+    in which case items_list holds the items of the pages before the first failed one.
+    """
+    throttle = throttle or AdaptiveThrottle(max_workers)
+    try:
+        first_page = throttle.call(fetch_page, limit, 0)
+    except Exception as e:
+        print(f"Error fetching first page of {label}: {e}")
+        return [], False
+    if not first_page or not first_page.get('items'):
+        return [], True
+
+    items = list(first_page['items'])
+    total = first_page.get('total') or 0
+    offsets = list(range(limit, total, limit))
+    if not offsets:
+        return items, True
+
+    fetched_count = [len(items)]
+    count_lock = threading.Lock()
+
+    def fetch_offset(offset):
+        page = throttle.call(fetch_page, limit, offset)
+        with count_lock:
+            fetched_count[0] += len(page.get('items') or []) if page else 0
+            print(f"Fetched {fetched_count[0]}/{total} {label} so far...")
+        return page
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(offsets)))) as executor:
+        futures = [executor.submit(fetch_offset, offset) for offset in offsets]
+        for offset, future in zip(offsets, futures):
+            try:
+                page = future.result()
+            except Exception as e:
+                print(f"Error fetching {label} page at offset {offset}: {e}")
+                for pending in futures:
+                    pending.cancel()
+                return items, False
+            if not page or not page.get('items'):
+                # Library shrank while we were paging: nothing past this offset.
+                break
+            items.extend(page['items'])
+    return items, True
@@ -0,0 +1,285 @@
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from helper_functions import resolve_song_async
+from metrics import metrics
+from scheduler import get_scheduler, jittered_backoff
+from track_index import canonical_key
+from response_parser import RecommendationResult
+from settings import SPOTIFY_MAX_CONCURRENT_REQUESTS
+
+
+def run_in_background(fn, *args, **kwargs):
+    """
+    Runs `fn` on a daemon thread and returns a Future for its result.
+    Unlike an executor worker, an abandoned call (e.g. a speculative model request that is no
+    longer needed) never holds up interpreter exit.
+    """
+    future = Future()
+
+    def runner():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=runner, daemon=True).start()
+    return future
+
+
+def submit_model_request(request_recommendations, conversation_history, on_recommendation=None, cancel=None):
+    """
+    Starts a model request for the `conversation_history` messages.
+    `request_recommendations` is either a plain callable or a router exposing `submit()` (see providers.py).
+    Routers call `on_recommendation(provider, rec)` for every recommendation their streaming providers
+    emit before the reply is complete, and stop those streams once the `cancel` threading.Event is set.
+    Returns a list of (provider_or_None, Future) pairs, one per backend queried.
+    """
+    if hasattr(request_recommendations, 'submit'):
+        return request_recommendations.submit(list(conversation_history), on_recommendation=on_recommendation,
+                                              cancel=cancel)
+    return [(None, run_in_background(request_recommendations, list(conversation_history)))]
+
+
+def collect_recommendations(sp, request_recommendations, conversation, consider_song, target_count, max_attempts,
+                            resolution_cache=None, pipelined=True, max_workers=SPOTIFY_MAX_CONCURRENT_REQUESTS,
+                            search_executor=None, throttle=None, rank_suggestions=None, score_suggestions=None,
+                            prefilter=None, suggestion_budget=None):
+    """
+    Runs the model -> Spotify verification loop until `target_count` songs were collected or
+    `max_attempts` model request rounds were made.
+
+    `request_recommendations(conversation_history)` returns a RecommendationResult.
+    It can also be a ProviderRouter, in which case each round fans out to several providers; songs
+    already suggested by another provider are dropped, and songs from streaming providers are
+    searched on Spotify as soon as they are streamed.
+    `conversation` is a ConversationContext (see conversation.py) that receives the model's replies and
+    the follow-up prompts, and decides which messages are sent.
+    `consider_song(verified_song_info)` is called for each verified song as soon as it is resolved
+    and returns True if the song was collected.
+
+    Model replies, streamed recommendations and search results all arrive as events on one queue and
+    are handled on the calling thread, so `consider_song` and `conversation` need no locking.
+    In pipelined mode the follow-up request is sent as soon as the first reply of a round is in, so
+    the next batch is generated while the current one is being verified; with a `suggestion_budget`, only
+    once the searches still in flight are not expected to reach the target at its hit rate. When the run ends the outstanding
+    searches are cancelled and the streams of in-flight model requests are closed; a non-streamed request
+    cannot be interrupted and is abandoned (its late reply is ignored and not counted in the provider stats).
+    Searches run on `search_executor` when given (e.g. shared by the users of a batch run), otherwise on a
+    private pool of `max_workers` threads, under `throttle` (default: the shared Spotify RequestScheduler).
+    `rank_suggestions(recommendations)`, if given, reorders each reply before its songs are searched (e.g.
+    TasteProfile.rank: closest to the user's taste first), so the likeliest keepers are verified first.
+    A streamed suggestion is searched right away unless `score_suggestions(recommendations)` (e.g.
+    TasteProfile.score, None without a profile) rates it below the median of the ones streamed before it
+    in the same reply; those are held back and searched with the complete, ranked reply.
+    Before any search, a suggestion is dropped when `prefilter(recommendation)` returns a reason (e.g.
+    RecommendationCollector.prefilter: its raw names already match a liked / history / collected song) or
+    when `resolution_cache` remembers it as not found on Spotify.
+    `suggestion_budget` (a collector.SuggestionBudget) is given the outcome of the run to tune the hit rate.
+    Returns the list of Recommendation suggestions the model made this session (raw names from the model).
+    """
+    events = queue.Queue()
+    throttle = throttle or get_scheduler("spotify")
+    own_executor = search_executor is None
+    if own_executor:
+        search_executor = ThreadPoolExecutor(max_workers=max_workers)
+    searches = [] # Futures of the Spotify searches started by this run
+    cancel = threading.Event() # Set when the run ends: streaming model requests still in flight stop
+    record_yield = getattr(request_recommendations, 'record_yield', None)
+    start_time = time.monotonic()
+
+    all_suggestions = []
+    seen_suggestion_keys = set()
+    collected_count = 0
+    attempt = 0
+    model_requests = [] # Futures of every model request made
+    rounds = {} # attempt -> {"pending_replies", "follow_up_sent"}
+    replies = {} # (attempt, provider) -> {"suggested", "collected", "searching", "done"}
+    failed_rounds = 0 # Consecutive rounds in which no backend replied
+    settled_count = 0 # Suggestions with an outcome: dropped before search, not found or verified
+    known_misses = 0
+
+    def start_round(speculative=False):
+        nonlocal attempt
+        if attempt > 0:
+            conversation.add_follow_up(all_suggestions)
+        attempt += 1
+        metrics.incr("model_rounds_total", speculative=speculative)
+        round_no = attempt
+        label = " (speculative)" if speculative else ""
+        print(f"\n--- AI Model Request Attempt {round_no}/{max_attempts}{label} ---")
+        requests = submit_model_request(
+            request_recommendations,
+            conversation.messages(),
+            on_recommendation=lambda provider, rec: events.put(("streamed", round_no, provider, rec)),
+            cancel=cancel
+        )
+        rounds[round_no] = {"pending_replies": len(requests), "follow_up_sent": False}
+        for provider, future in requests:
+            replies[(round_no, provider)] = {"suggested": 0, "collected": 0, "searching": 0, "done": False,
+                                             "streamed_scores": [], "held_back": []}
+            model_requests.append((provider, future))
+            future.add_done_callback(lambda f, provider=provider: events.put(("reply", round_no, provider, f)))
+
+    def suggest(round_no, provider, rec):
+        nonlocal settled_count, known_misses
+        key = canonical_key(rec.track, rec.artist) # "Song (feat. X)" and "Song" are the same suggestion
+        if not key[0] or not key[1] or key in seen_suggestion_keys:
+            return
+        seen_suggestion_keys.add(key)
+        all_suggestions.append(rec) # Still listed in the follow-up prompt's "avoid these"
+        if prefilter and prefilter(rec):
+            settled_count += 1
+            return
+        if resolution_cache and resolution_cache.is_known_miss(rec.track, rec.artist):
+            print(f"  -- Dropped before search: '{rec.track}' by '{rec.artist}' (Reason: not found on Spotify recently)")
+            settled_count += 1
+            known_misses += 1
+            metrics.incr("songs_skipped_total", reason="not_found", stage="prefilter")
+            return
+        reply = replies[(round_no, provider)]
+        reply["searching"] += 1
+        search = resolve_song_async(
+            sp, rec, resolution_cache, search_executor, throttle,
+            lambda song_detail, found, error: events.put(("verified", round_no, provider, (song_detail, found, error)))
+        )
+        if search is not None:
+            searches.append(search)
+
+    def holds_back(round_no, provider, rec):
+        scores = score_suggestions([rec]) if score_suggestions else None
+        if scores is None:
+            return False
+        streamed_scores = replies[(round_no, provider)]["streamed_scores"]
+        streamed_scores.append(float(scores[0]))
+        return streamed_scores[-1] < statistics.median(streamed_scores)
+
+    def finish_reply_if_settled(round_no, provider):
+        reply = replies[(round_no, provider)]
+        if reply["done"] and reply["searching"] == 0 and reply["suggested"]:
+            if record_yield:
+                record_yield(provider, reply["suggested"], reply["collected"])
+            provider_label = f" from {provider.name}" if provider else ""
+            print(f"Added {reply['collected']} new songs{provider_label} this turn "
+                  f"(total collected so far: {collected_count}/{target_count}).")
+            reply["suggested"] = 0 # Report only once
+
+    def is_settled():
+        return all(r["pending_replies"] == 0 for r in rounds.values()) and all(
+            reply["searching"] == 0 for reply in replies.values()
+        )
+
+    def expects_shortfall():
+        # Pipelined mode sends the next request before the current round is verified, unless the searches
+        # still in flight are expected to fill the playlist at the budget's hit rate. Every miss lowers
+        # the expectation, so the request goes out as soon as a shortfall shows.
+        if not pipelined or attempt >= max_attempts or not rounds[attempt]["follow_up_sent"]:
+            return False
+        if suggestion_budget is None:
+            return True
+        searching = sum(reply["searching"] for reply in replies.values())
+        return collected_count + searching * suggestion_budget.hit_rate < target_count
+
+    start_round()
+    try:
+        while collected_count < target_count:
+            if is_settled():
+                if attempt >= max_attempts:
+                    break
+                if not rounds[attempt]["follow_up_sent"]:
+                    # Every backend failed this round (after the scheduler's own retries): back off a little more
+                    # each time it happens in a row, but don't wait at all after a successful round.
+                    time.sleep(jittered_backoff(failed_rounds))
+                    failed_rounds += 1
+                else:
+                    failed_rounds = 0
+                start_round()
+                continue
+            if expects_shortfall():
+                start_round(speculative=True)
+                continue
+
+            kind, round_no, provider, payload = events.get()
+            if kind == "streamed":
+                if holds_back(round_no, provider, payload):
+                    replies[(round_no, provider)]["held_back"].append(payload) # Searched once the reply is complete
+                else:
+                    suggest(round_no, provider, payload)
+
+            elif kind == "reply":
+                rounds[round_no]["pending_replies"] -= 1
+                reply = replies[(round_no, provider)]
+                reply["done"] = True
+                try:
+                    result = payload.result()
+                except Exception as e:
+                    print(f"Model request failed: {e.__class__.__name__}: {e}")
+                    result = RecommendationResult.failed(f"{e.__class__.__name__}: {e}")
+                model_batch_recs_parsed, raw_assistant_response_str = result.recommendations, result.raw
+
+                # Only the first reply of a round goes into the history; the other providers'
+                # suggestions still end up in the "avoid these" list of the follow-up prompt.
+                if raw_assistant_response_str and not rounds[round_no]["follow_up_sent"]:
+                    conversation.add_reply(raw_assistant_response_str, model_batch_recs_parsed)
+                    rounds[round_no]["follow_up_sent"] = True
+
+                if not model_batch_recs_parsed:
+                    print("AI Model returned no valid recommendations in this batch or there was an API error.")
+                    for rec in reply["held_back"]: # Streamed before the reply failed
+                        suggest(round_no, provider, rec)
+                    continue
+                reply["suggested"] = len(model_batch_recs_parsed)
+                print(f"AI Model suggested {len(model_batch_recs_parsed)} songs. Verifying on Spotify and filtering...")
+                if rank_suggestions:
+                    model_batch_recs_parsed = rank_suggestions(model_batch_recs_parsed)
+                for rec in model_batch_recs_parsed:
+                    suggest(round_no, provider, rec) # No-op for songs already streamed or suggested elsewhere
+                finish_reply_if_settled(round_no, provider)
+
+            elif kind == "verified":
+                song_detail, verified_song_info, error = payload
+                reply = replies[(round_no, provider)]
+                reply["searching"] -= 1
+                if error is None:
+                    settled_count += 1
+                if error is not None:
+                    print(f"  Error searching for '{song_detail.track}' by {song_detail.artist}: {error}")
+                elif not verified_song_info:
+                    print(f"  Not found on Spotify: '{song_detail.track}' by {song_detail.artist}")
+                    metrics.incr("songs_skipped_total", reason="not_found", stage="verified")
+                elif consider_song(verified_song_info):
+                    if collected_count == 0:
+                        print(f"  (first new song collected after {time.monotonic() - start_time:.1f}s)")
+                    collected_count += 1
+                    reply["collected"] += 1
+                finish_reply_if_settled(round_no, provider)
+
+        if collected_count >= target_count:
+            print("\nTarget number of new songs reached.")
+            outstanding = [provider for provider, future in model_requests if not future.done()]
+            stopped = sum(1 for provider in outstanding if provider is not None and provider.streaming)
+            if stopped:
+                print(f"Stopping {stopped} outstanding streamed model request(s).")
+            if len(outstanding) > stopped:
+                print(f"Abandoned {len(outstanding) - stopped} outstanding model request(s) that can't be interrupted.")
+        if known_misses:
+            print(f"Skipped {known_misses} suggestions already known not to be on Spotify.")
+        metrics.incr("suggestions_settled_total", settled_count)
+        if suggestion_budget:
+            previous_hit_rate = suggestion_budget.hit_rate
+            suggestion_budget.record(settled_count, collected_count)
+            print(f"Hit rate: {collected_count}/{settled_count} suggestions collected this run "
+                  f"(estimate {previous_hit_rate:.0%} -> {suggestion_budget.hit_rate:.0%}).")
+            metrics.set_gauge("suggestion_hit_rate", round(suggestion_budget.hit_rate, 4))
+    finally:
+        cancel.set()
+        for search in searches:
+            search.cancel()
+        if own_executor:
+            search_executor.shutdown(wait=False, cancel_futures=True)
+    return all_suggestions
@@ -0,0 +1,176 @@
+import math
+
+from helper_functions import fetch_playlist_items, playlist_item_to_record
+from scheduler import get_scheduler
+
+MAX_ITEMS_PER_WRITE = 100 # Spotify accepts up to 100 tracks per add / remove / replace request
+
+
+def get_playlist_state(sp, playlist_id, library_store=None, throttle=None):
+    """
+    Current content of a playlist, as a tuple: (snapshot_id, tracks) where tracks are
+    {"uri", "track", "artist", "isrc"} dicts in playlist order (unplayable items keep their position
+    with "track" set to None).
+    One small GET for the snapshot_id; the tracks are only re-read when it differs from the one
+    recorded in `library_store`. Returns (None, None) if the playlist could not be read completely.
+    """
+    throttle = throttle or get_scheduler("spotify")
+    try:
+        snapshot_id = throttle.call(sp.playlist, playlist_id, fields="snapshot_id")['snapshot_id']
+    except Exception as e:
+        print(f"Error reading snapshot of playlist ID {playlist_id}: {e}")
+        return None, None
+    if library_store:
+        stored_snapshot_id, stored_tracks = library_store.get_playlist_snapshot(playlist_id)
+        if stored_snapshot_id == snapshot_id:
+            print(f"Playlist ID {playlist_id} unchanged since last run ({len(stored_tracks)} tracks cached).")
+            return snapshot_id, stored_tracks
+
+    print(f"Fetching tracks from playlist ID: {playlist_id}...")
+    items, complete = fetch_playlist_items(sp, playlist_id, throttle=throttle)
+    if not complete:
+        return None, None
+    tracks = [
+        playlist_item_to_record(item) or {"uri": (item.get('track') or {}).get('uri'), "track": None, "artist": None, "isrc": None}
+        for item in items
+    ]
+    print(f"Total tracks fetched from playlist ID {playlist_id}: {len(tracks)}")
+    if library_store:
+        library_store.set_playlist_snapshot(playlist_id, snapshot_id, tracks)
+    return snapshot_id, tracks
+
+
+def plan_reorder(current_uris, desired_uris):
+    """
+    Moves that turn `current_uris` into `desired_uris` (same items, other order), as
+    (range_start, insert_before, range_length) tuples for Spotify's reorder endpoint.
+    Runs of items that are already consecutive in the right order are moved as one range.
+    """
+    working = list(current_uris)
+    moves = []
+    for i, uri in enumerate(desired_uris):
+        if working[i] == uri:
+            continue
+        j = working.index(uri, i + 1)
+        length = 1
+        while (j + length < len(working) and i + length < len(desired_uris)
+               and working[j + length] == desired_uris[i + length]):
+            length += 1
+        moves.append((j, i, length))
+        working[i:i] = working[j:j + length]
+        del working[j + length:j + 2 * length]
+    return moves
+
+
+def plan_playlist_sync(current_uris, desired_uris):
+    """
+    Minimal changes from the current to the desired list of track URIs (the desired list is de-duplicated).
+    Every occurrence of a URI that is not wanted, or that appears more than once, is removed; the wanted
+    URIs that are then missing are appended; finally the result is reordered.
+    Returns a tuple: (uris_to_remove, uris_to_add, moves)
+    """
+    desired = list(dict.fromkeys(desired_uris))
+    desired_set = set(desired)
+    seen = set()
+    duplicated = set()
+    for uri in current_uris:
+        if uri in seen:
+            duplicated.add(uri)
+        seen.add(uri)
+    to_remove = list(dict.fromkeys(uri for uri in current_uris if uri not in desired_set or uri in duplicated))
+    removed = set(to_remove)
+    kept = [uri for uri in current_uris if uri not in removed]
+    kept_set = set(kept)
+    to_add = [uri for uri in desired if uri not in kept_set]
+    return to_remove, to_add, plan_reorder(kept + to_add, desired)
+
+
+def _write_count(item_count):
+    return math.ceil(item_count / MAX_ITEMS_PER_WRITE)
+
+
+def _batches(uris):
+    for i in range(0, len(uris), MAX_ITEMS_PER_WRITE):
+        yield uris[i:i + MAX_ITEMS_PER_WRITE]
+
+
+def sync_playlist(sp, playlist_id, desired_tracks, library_store=None, throttle=None):
+    """
+    Makes the playlist contain exactly `desired_tracks` ({"uri", "track", "artist", "isrc"} dicts), in order,
+    with as few write requests as possible: either the remove / add / reorder changes from
+    plan_playlist_sync, or a full replace when that takes fewer requests (or when the playlist holds items
+    that can't be removed by URI). Tracks that stay keep their "added at" date.
+    The new snapshot_id and content are recorded in `library_store`, so the next run doesn't re-read it.
+    Returns True on success.
+    """
+    throttle = throttle or get_scheduler("spotify")
+    desired_tracks = list({track['uri']: track for track in desired_tracks}.values())
+    desired_uris = [track['uri'] for track in desired_tracks]
+    snapshot_id, current_tracks = get_playlist_state(sp, playlist_id, library_store, throttle)
+
+    try:
+        if current_tracks is not None and all(track['uri'] for track in current_tracks):
+            to_remove, to_add, moves = plan_playlist_sync([track['uri'] for track in current_tracks], desired_uris)
+            diff_writes = _write_count(len(to_remove)) + _write_count(len(to_add)) + len(moves)
+        else:
+            to_remove = to_add = moves = None
+            diff_writes = math.inf
+        replace_writes = max(1, _write_count(len(desired_uris)))
+
+        if diff_writes == 0:
+            print(f"Playlist ID {playlist_id} already up to date.")
+        elif diff_writes <= replace_writes:
+            print(f"Syncing playlist ID {playlist_id}: {len(to_remove)} removed, {len(to_add)} added, "
+                  f"{len(moves)} moves ({diff_writes} write requests).")
+            for batch in _batches(to_remove):
+                snapshot_id = throttle.call(sp.playlist_remove_all_occurrences_of_items, playlist_id, batch)['snapshot_id']
+            for batch in _batches(to_add):
+                snapshot_id = throttle.call(sp.playlist_add_items, playlist_id, batch, retry_transient=False)['snapshot_id']
+            for range_start, insert_before, range_length in moves:
+                snapshot_id = throttle.call(
+                    sp.playlist_reorder_items, playlist_id, range_start, insert_before,
+                    range_length=range_length, snapshot_id=snapshot_id, retry_transient=False
+                )['snapshot_id']
+        else:
+            print(f"Replacing the {len(desired_uris)} tracks of playlist ID {playlist_id} ({replace_writes} write requests).")
+            batches = list(_batches(desired_uris)) or [[]]
+            snapshot_id = throttle.call(sp.playlist_replace_items, playlist_id, batches[0])['snapshot_id']
+            for batch in batches[1:]:
+                snapshot_id = throttle.call(sp.playlist_add_items, playlist_id, batch, retry_transient=False)['snapshot_id']
+    except Exception as e:
+        print(f"Error syncing playlist {playlist_id}: {e}")
+        if library_store:
+            library_store.forget_playlist_snapshot(playlist_id)
+        return False
+
+    if library_store:
+        library_store.set_playlist_snapshot(playlist_id, snapshot_id, desired_tracks)
+    return True
+
+
+def append_to_playlist(sp, playlist_id, new_tracks, library_store=None, throttle=None):
+    """
+    Appends `new_tracks` ({"uri", "track", "artist", "isrc"} dicts) in batches of 100 and records the
+    playlist's new snapshot_id and content, provided the playlist was in its recorded state before.
+    Returns True on success.
+    """
+    throttle = throttle or get_scheduler("spotify")
+    stored_snapshot_id, stored_tracks = library_store.get_playlist_snapshot(playlist_id) if library_store else (None, None)
+    try:
+        snapshot_id = throttle.call(sp.playlist, playlist_id, fields="snapshot_id")['snapshot_id']
+        up_to_date = stored_snapshot_id == snapshot_id
+        print(f"Appending {len(new_tracks)} songs to playlist ID {playlist_id}...")
+        for batch in _batches([track['uri'] for track in new_tracks]):
+            snapshot_id = throttle.call(sp.playlist_add_items, playlist_id, batch, retry_transient=False)['snapshot_id']
+    except Exception as e:
+        print(f"Error appending songs to playlist {playlist_id}: {e}")
+        if library_store:
+            library_store.forget_playlist_snapshot(playlist_id)
+        return False
+
+    if library_store:
+        if up_to_date:
+            library_store.set_playlist_snapshot(playlist_id, snapshot_id, stored_tracks + list(new_tracks))
+        else: # Changed elsewhere since we last read it: re-read next time
+            library_store.forget_playlist_snapshot(playlist_id)
+    return True
@@ -0,0 +1,176 @@
+import threading
+import time
+
+from helper_functions import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, OPENROUTER_API_KEY, OPENROUTER_BASE_URL,
+    get_recommendations_openai, get_recommendations_openrouter, stream_recommendations_openai
+)
+from metrics import metrics
+from pipeline import run_in_background
+from response_parser import RecommendationResult
+from settings import GEMINI_MODEL, OPENAI_MODEL, STREAM_MODEL_RESPONSES
+
+EWMA_ALPHA = 0.3 # Weight of the latest observation in the latency / yield moving averages
+MIN_RELATIVE_SCORE = 0.25 # Providers scoring below this fraction of the best one are left out of the fan-out...
+EXPLORE_EVERY = 3 # ...except every Nth round, so they get a chance to recover
+
+
+class Provider:
+    """
+    One LLM backend plus the running statistics the router ranks it by.
+    `request_fn(conversation_history)` returns a RecommendationResult (see response_parser.py).
+    A `streaming` provider's request_fn also takes an `on_recommendation` callback, called with each
+    recommendation as soon as it has been streamed, and a `cancel` threading.Event that stops the stream
+    once set.
+    """
+
+    def __init__(self, name, request_fn, streaming=False):
+        self.name = name
+        self.request_fn = request_fn
+        self.streaming = streaming
+        self.calls = 0
+        self.failures = 0
+        self.suggested_total = 0
+        self.collected_total = 0
+        self.latency_ewma = None # seconds per request
+        self.yield_ewma = None # collected songs / suggested songs
+
+    def score(self):
+        """New verified songs per second of waiting. Untried providers score infinitely high."""
+        if self.latency_ewma is None:
+            return float('inf')
+        yield_rate = self.yield_ewma if self.yield_ewma is not None else 1.0
+        return yield_rate / max(self.latency_ewma, 1e-3)
+
+    def __repr__(self):
+        return f"Provider({self.name!r})"
+
+
+def _ewma(previous, value):
+    return value if previous is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+
+
+class ProviderRouter:
+    """
+    Sends the same conversation to several LLM providers at once.
+    Every provider's reply is handed back as soon as it arrives (see `submit`); the caller
+    reports how many of its songs were actually collected (`record_yield`), and providers that
+    are slow or mostly suggest songs we can't use drop out of the fan-out automatically.
+    """
+
+    def __init__(self, providers, min_relative_score=MIN_RELATIVE_SCORE, explore_every=EXPLORE_EVERY):
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider.")
+        self.providers = list(providers)
+        self.min_relative_score = min_relative_score
+        self.explore_every = explore_every
+        self.rounds = 0
+        self._lock = threading.Lock()
+
+    def select_providers(self):
+        with self._lock:
+            self.rounds += 1
+            ranked = sorted(self.providers, key=lambda p: p.score(), reverse=True)
+            if self.explore_every and self.rounds % self.explore_every == 0:
+                return ranked
+            untried = [p for p in ranked if p.latency_ewma is None]
+            tried = [p for p in ranked if p.latency_ewma is not None]
+            if not tried:
+                return untried
+            best_score = tried[0].score()
+            return untried + [p for p in tried if p.score() >= best_score * self.min_relative_score]
+
+    def _timed_request(self, provider, conversation_history, on_recommendation=None, cancel=None):
+        start = time.monotonic()
+        try:
+            if provider.streaming and on_recommendation:
+                result = provider.request_fn(conversation_history,
+                                             on_recommendation=lambda rec: on_recommendation(provider, rec),
+                                             cancel=cancel)
+            else:
+                result = provider.request_fn(conversation_history)
+        except Exception as e:
+            print(f"Provider '{provider.name}' failed: {e.__class__.__name__}: {e}")
+            result = RecommendationResult.failed(f"{e.__class__.__name__}: {e}")
+        elapsed = time.monotonic() - start
+        if cancel is not None and cancel.is_set():
+            return result # Stopped or finished after its run ended: says nothing about the provider
+        metrics.observe("model_request_seconds", elapsed, provider=provider.name)
+        with self._lock:
+            provider.calls += 1
+            provider.latency_ewma = _ewma(provider.latency_ewma, elapsed)
+            if not result.recommendations:
+                provider.failures += 1
+                provider.yield_ewma = _ewma(provider.yield_ewma, 0.0)
+        return result
+
+    def submit(self, conversation_history, on_recommendation=None, cancel=None):
+        """
+        Starts one request per selected provider. Returns a list of (provider, Future) pairs.
+        Streaming providers call `on_recommendation(provider, rec)` for each recommendation as it is streamed,
+        and close their stream once the `cancel` threading.Event is set.
+        """
+        selected = self.select_providers()
+        print(f"Fanning out to providers: {', '.join(p.name for p in selected)}")
+        return [
+            (provider, run_in_background(self._timed_request, provider, list(conversation_history),
+                                         on_recommendation, cancel))
+            for provider in selected
+        ]
+
+    def record_yield(self, provider, suggested_count, collected_count):
+        if not provider or not suggested_count:
+            return
+        with self._lock:
+            provider.suggested_total += suggested_count
+            provider.collected_total += collected_count
+            provider.yield_ewma = _ewma(provider.yield_ewma, collected_count / suggested_count)
+        metrics.incr("model_suggestions_total", suggested_count, provider=provider.name)
+        metrics.incr("model_suggestions_collected_total", collected_count, provider=provider.name)
+
+    def print_stats(self):
+        print("\nProvider statistics:")
+        for p in sorted(self.providers, key=lambda p: p.score(), reverse=True):
+            latency = f"{p.latency_ewma:.2f}s" if p.latency_ewma is not None else "n/a"
+            yield_rate = f"{p.yield_ewma:.0%}" if p.yield_ewma is not None else "n/a"
+            print(f"  {p.name}: {p.calls} calls, {p.failures} empty/failed, latency {latency}, "
+                  f"yield {yield_rate} ({p.collected_total}/{p.suggested_total} collected)")
+
+
+def configured_provider_names():
+    """Names of the providers that have an API key configured, as accepted by build_provider_router."""
+    return [name for name, api_key in (("openai", OPENAI_API_KEY), ("openrouter", OPENROUTER_API_KEY)) if api_key]
+
+
+def build_provider_router(names=None, stream=STREAM_MODEL_RESPONSES):
+    """
+    Router over every provider that has an API key configured (or only those in `names`, which must all
+    be configured: see configured_provider_names).
+    With `stream`, OpenAI responses are streamed and parsed incrementally.
+    Base URLs come from OPENAI_BASE_URL / OPENROUTER_BASE_URL, so the router can be pointed at local stub servers.
+    """
+    available = {}
+    if OPENAI_API_KEY and stream:
+        available["openai"] = Provider(
+            f"openai:{OPENAI_MODEL}",
+            lambda history, on_recommendation=None, cancel=None: stream_recommendations_openai(
+                OPENAI_API_KEY, history, on_recommendation=on_recommendation, base_url=OPENAI_BASE_URL, cancel=cancel
+            ),
+            streaming=True
+        )
+    elif OPENAI_API_KEY:
+        available["openai"] = Provider(
+            f"openai:{OPENAI_MODEL}",
+            lambda history: get_recommendations_openai(OPENAI_API_KEY, history, base_url=OPENAI_BASE_URL)
+        )
+    if OPENROUTER_API_KEY:
+        available["openrouter"] = Provider(
+            f"openrouter:{GEMINI_MODEL}",
+            lambda history: get_recommendations_openrouter(OPENROUTER_API_KEY, history, base_url=OPENROUTER_BASE_URL)
+        )
+    if names:
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise ValueError(f"providers not available (unknown or missing API key): {', '.join(unknown)}")
+        available = {name: provider for name, provider in available.items() if name in names}
+    return ProviderRouter(list(available.values()))
@@ -0,0 +1,312 @@
+"""
+Record / replay of the HTTP exchanges with Spotify and the model APIs, and a local stand-in server.
+
+Record a real run into a fixture (one JSON exchange per line; OAuth token requests are not recorded):
+
+    python spotify_playlist.py --record=fixtures/run.jsonl
+
+Serve it back offline, optionally with latency and a rate limit answered with 429s:
+
+    python replay.py fixtures/run.jsonl [--port 8765] [--latency-ms 50] [--model-latency-ms 2000] [--rate-limit-rps 10]
+
+and point the script at it (any value works for the API keys):
+
+    SPOTIFY_API_PREFIX=http://127.0.0.1:8765/v1/ OPENAI_BASE_URL=http://127.0.0.1:8765/v1 \\
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765/v1 python spotify_playlist.py
+
+StandInServer takes any backend with a `handle(method, path, query, body, base_url)` method, such as
+FixtureBackend here or the synthetic one of benchmarks/synthetic_backend.py.
+"""
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+from clients import REQUESTS_POOL_MAXSIZE, add_response_hook, get_requests_session
+from rate_limit import TokenBucket
+
+SPOTIFY_API_ROOT = "https://api.spotify.com/v1/"
+UNRECORDED_HOSTS = ("accounts.spotify.com",) # Token exchanges: nothing to replay, and they carry secrets
+DEFAULT_RETRY_AFTER = 1 # Seconds, sent with the stand-in server's 429s
+
+
+def canonical_query(query):
+    """Query string with sorted parameters, so the same request always has the same key."""
+    return urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+
+def is_model_request(path):
+    return path.rstrip("/").endswith("/chat/completions")
+
+
+class Recorder:
+    """Appends HTTP exchanges to a JSONL fixture; shared by every thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, method, url, request_body, status, headers, body, elapsed=None):
+        parts = urlsplit(str(url))
+        if parts.hostname in UNRECORDED_HOSTS:
+            return
+        stream = False
+        if is_model_request(parts.path) and request_body:
+            try:
+                stream = bool(json.loads(request_body).get("stream"))
+            except (ValueError, AttributeError):
+                pass
+        exchange = {
+            "method": method,
+            "host": parts.hostname,
+            "path": parts.path,
+            "query": canonical_query(parts.query),
+            "stream": stream,
+            "status": status,
+            "content_type": headers.get("Content-Type", "application/json"),
+            "retry_after": headers.get("Retry-After"),
+            "body": body.decode("utf-8", errors="replace"),
+            "elapsed": elapsed,
+        }
+        with self._lock:
+            self._file.write(json.dumps(exchange) + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def record_httpx(self, response):
+        # httpx response hook: the body is read here, so streamed model responses arrive in one piece while recording.
+        response.read()
+        self.record(response.request.method, response.request.url, response.request.content,
+                    response.status_code, response.headers, response.content)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingAdapter(requests.adapters.HTTPAdapter):
+    """requests transport adapter that hands every exchange (spotipy's) to a Recorder."""
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        self.recorder.record(request.method, request.url, request.body, response.status_code,
+                             response.headers, response.content, time.perf_counter() - started)
+        return response
+
+
+def start_recording(path, requests_session=None):
+    """
+    Records the exchanges of `requests_session` (default: the shared session of clients.get_requests_session,
+    which get_spotify_client uses by default) and of every model API client into the fixture at `path`.
+    Returns the Recorder.
+    """
+    recorder = Recorder(path)
+    session = requests_session or get_requests_session()
+    adapter = RecordingAdapter(recorder, pool_connections=4, pool_maxsize=REQUESTS_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    add_response_hook(recorder.record_httpx)
+    print(f"Recording HTTP exchanges to '{path}'.")
+    return recorder
+
+
+def load_fixture(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class FixtureBackend:
+    """
+    Answers requests from recorded exchanges: by method, path and query, else by method and path (the
+    first recorded one). Model requests get the recorded completions in turn (streamed or not, as asked),
+    unrecorded searches find nothing and unrecorded playlist writes succeed with a placeholder snapshot_id.
+    """
+
+    def __init__(self, exchanges):
+        self._exact = {}
+        self._by_path = {}
+        completions = {False: [], True: []}
+        for exchange in exchanges:
+            if is_model_request(exchange['path']):
+                if exchange['status'] == 200:
+                    completions[exchange.get('stream', False)].append(exchange)
+                continue
+            self._exact.setdefault((exchange['method'], exchange['path'], exchange['query']), exchange)
+            self._by_path.setdefault((exchange['method'], exchange['path']), exchange)
+        # Cycled through; a streamed request is answered with a plain completion if none was streamed, and vice versa
+        self._completions = {}
+        for stream in (False, True):
+            recorded = completions[stream] or completions[not stream]
+            self._completions[stream] = itertools.cycle(recorded) if recorded else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_fixture(path))
+
+    def handle(self, method, path, query, body, base_url):
+        if is_model_request(path):
+            try:
+                stream = bool(json.loads(body or b"{}").get("stream"))
+            except ValueError:
+                stream = False
+            with self._lock:
+                completions = self._completions[stream]
+                exchange = next(completions) if completions else None
+        elif path.endswith("/search"):
+            exchange = self._exact.get((method, path, canonical_query(query)))
+            if exchange is None:
+                return 200, {"Content-Type": "application/json"}, json.dumps({"tracks": {"items": [], "total": 0}}).encode()
+        else:
+            exchange = (self._exact.get((method, path, canonical_query(query)))
+                        or self._by_path.get((method, path)))
+        if exchange is None:
+            if method in ("POST", "PUT", "DELETE") and not is_model_request(path):
+                return 201, {"Content-Type": "application/json"}, json.dumps({"snapshot_id": "replay"}).encode()
+            return 404, {"Content-Type": "application/json"}, json.dumps(
+                {"error": {"status": 404, "message": f"No recorded response for {method} {path}"}}
+            ).encode()
+        headers = {"Content-Type": exchange['content_type']}
+        if exchange.get('retry_after'):
+            headers["Retry-After"] = exchange['retry_after']
+        # Paging links point at the real API: send them to the stand-in instead
+        body = exchange['body'].replace(SPOTIFY_API_ROOT, f"{base_url}/v1/").encode()
+        return exchange['status'], headers, body
+
+
+class StandInServer:
+    """
+    Local HTTP server standing in for the Spotify Web API and the chat-completions APIs, answered by `backend`.
+    Every request waits `latency` seconds (model requests `model_latency`). With `rate_limit_rps`, requests
+    beyond that rate get a 429 with a Retry-After of `retry_after` seconds, like the real APIs.
+    """
+
+    def __init__(self, backend, latency=0.0, model_latency=0.0, rate_limit_rps=None,
+                 retry_after=DEFAULT_RETRY_AFTER, host="127.0.0.1", port=0):
+        self.backend = backend
+        self.latency = latency
+        self.model_latency = model_latency
+        self.retry_after = retry_after
+        self.rate_limiter = TokenBucket(rate_limit_rps) if rate_limit_rps else None
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def spotify_prefix(self):
+        return f"{self.url}/v1/"
+
+    @property
+    def model_base_url(self):
+        return f"{self.url}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = self.rate_limited = 0
+
+    def respond(self, method, target, body):
+        """(status, headers, body) for one request, after the configured latency / rate limit."""
+        with self._lock:
+            self.requests += 1
+        if self.rate_limiter and not self.rate_limiter.try_acquire():
+            with self._lock:
+                self.rate_limited += 1
+            return 429, {"Content-Type": "application/json", "Retry-After": str(self.retry_after)}, json.dumps(
+                {"error": {"status": 429, "message": "API rate limit exceeded"}}
+            ).encode()
+        parts = urlsplit(target)
+        delay = self.model_latency if is_model_request(parts.path) else self.latency
+        if delay:
+            time.sleep(delay)
+        return self.backend.handle(method, parts.path, parts.query, body, self.url)
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+            disable_nagle_algorithm = True # Headers and body are separate writes: don't wait for a delayed ACK
+
+            def _serve(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                status, headers, payload = stand_in.respond(self.command, self.path, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a recorded fixture on a local stand-in server.")
+    parser.add_argument("fixture")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--model-latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rps", type=float, default=None)
+    parser.add_argument("--retry-after", type=int, default=DEFAULT_RETRY_AFTER)
+    args = parser.parse_args()
+
+    server = StandInServer(FixtureBackend.from_file(args.fixture), latency=args.latency_ms / 1000,
+                           model_latency=args.model_latency_ms / 1000, rate_limit_rps=args.rate_limit_rps,
+                           retry_after=args.retry_after, port=args.port)
+    print(f"Serving '{args.fixture}' on {server.url} (Ctrl+C to stop). Point the script at it with:")
+    print(f"  SPOTIFY_API_PREFIX={server.spotify_prefix} OPENAI_BASE_URL={server.model_base_url} "
+          f"OPENROUTER_BASE_URL={server.model_base_url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"\nServed {server.requests} requests ({server.rate_limited} rate limited).")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
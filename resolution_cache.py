@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+DEFAULT_CAPACITY = 20000 # Entries kept in memory
+FOUND_TTL = 30 * 24 * 3600 # A resolved URI stays valid for a month
+NOT_FOUND_TTL = 3 * 24 * 3600 # "Not on Spotify" is re-checked after a few days
+
+CACHE_MISS = object() # Returned by lookup() when the pair has never been resolved (or expired)
+
+
+def normalize_song_key(track_name, artist_name):
+    track = " ".join(str(track_name or "").split()).lower()
+    artist = " ".join(str(artist_name or "").split()).lower()
+    return track, artist
+
+
+class ResolutionCache:
+    """
+    Maps a normalized (track, artist) pair as suggested by the model to the Spotify search result:
+    a {"uri", "track", "artist", "isrc"} dict, or None when the song was not found.
+    Entries live in an in-memory LRU backed by a SQLite table, and expire after
+    `found_ttl` / `not_found_ttl` seconds.
+    """
+
+    def __init__(self, db_path, capacity=DEFAULT_CAPACITY, found_ttl=FOUND_TTL, not_found_ttl=NOT_FOUND_TTL):
+        self.capacity = capacity
+        self.found_ttl = found_ttl
+        self.not_found_ttl = not_found_ttl
+        self.hits = 0
+        self.misses = 0
+        self.joined_searches = 0 # Searches answered by another caller's in-flight search
+        self._memory = OrderedDict() # key -> (value, resolved_at)
+        self._searches = {} # key -> Future of the Spotify search in progress
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS search_resolutions (
+                query_track TEXT NOT NULL,
+                query_artist TEXT NOT NULL,
+                uri TEXT,
+                track TEXT,
+                artist TEXT,
+                isrc TEXT,
+                resolved_at REAL NOT NULL,
+                PRIMARY KEY (query_track, query_artist)
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(search_resolutions)")]
+        if "isrc" not in columns: # Cache created before ISRCs were recorded
+            self._conn.execute("ALTER TABLE search_resolutions ADD COLUMN isrc TEXT")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stored_counts(self):
+        """(found, not found) search results stored on disk, expired ones included."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(uri), COUNT(*) - COUNT(uri) FROM search_resolutions").fetchone()
+
+    def _is_fresh(self, value, resolved_at, now):
+        ttl = self.found_ttl if value is not None else self.not_found_ttl
+        return now - resolved_at < ttl
+
+    def _remember(self, key, value, resolved_at):
+        self._memory[key] = (value, resolved_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def _fresh_entry(self, key, now):
+        # (value, resolved_at) from memory or SQLite, or None when unknown or expired. Caller holds the lock.
+        entry = self._memory.get(key)
+        if entry is None:
+            row = self._conn.execute(
+                "SELECT uri, track, artist, isrc, resolved_at FROM search_resolutions "
+                "WHERE query_track = ? AND query_artist = ?",
+                key
+            ).fetchone()
+            if row:
+                uri, track, artist, isrc, resolved_at = row
+                value = {"uri": uri, "track": track, "artist": artist, "isrc": isrc} if uri else None
+                entry = (value, resolved_at)
+                self._remember(key, value, resolved_at)
+        else:
+            self._memory.move_to_end(key)
+        if entry is None or not self._is_fresh(entry[0], entry[1], now):
+            return None
+        return entry
+
+    def lookup(self, track_name, artist_name):
+        """Returns the cached result dict, None for a cached "not found", or CACHE_MISS."""
+        key = normalize_song_key(track_name, artist_name)
+        with self._lock:
+            entry = self._fresh_entry(key, time.time())
+            if entry is None:
+                self.misses += 1
+                metrics.incr("search_cache_total", result="miss")
+                return CACHE_MISS
+            self.hits += 1
+        metrics.incr("search_cache_total", result="hit")
+        return entry[0]
+
+    def is_known_miss(self, track_name, artist_name):
+        """True when the pair was searched recently and not found on Spotify (not counted as a hit / miss)."""
+        key = normalize_song_key(track_name, artist_name)
+        with self._lock:
+            entry = self._fresh_entry(key, time.time())
+        return entry is not None and entry[0] is None
+
+    def store(self, track_name, artist_name, value):
+        """Records a search result (`value` dict) or a "not found" (`value` None)."""
+        key = normalize_song_key(track_name, artist_name)
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_resolutions (query_track, query_artist, uri, track, artist, isrc, resolved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key[0], key[1],
+                 value['uri'] if value else None,
+                 value['track'] if value else None,
+                 value['artist'] if value else None,
+                 value.get('isrc') if value else None,
+                 now)
+            )
+            self._conn.commit()
+
+    def join_search(self, track_name, artist_name, start_search):
+        """
+        Returns (future, started): the Future of the search already in progress for this pair, or the one
+        returned by `start_search()`, in which case `started` is True and the caller stores the result.
+        """
+        key = normalize_song_key(track_name, artist_name)
+        with self._lock:
+            future = self._searches.get(key)
+            if future is not None:
+                self.joined_searches += 1
+                metrics.incr("search_cache_total", result="joined")
+                return future, False
+            future = start_search()
+            self._searches[key] = future
+        future.add_done_callback(lambda f: self._forget_search(key, f))
+        return future, True
+
+    def _forget_search(self, key, future):
+        with self._lock:
+            if self._searches.get(key) is future:
+                del self._searches[key]
+
+    def purge_expired(self):
+        """Deletes the expired results from SQLite (lookups already ignore them); returns how many were dropped."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM search_resolutions WHERE (uri IS NOT NULL AND resolved_at < ?) "
+                "OR (uri IS NULL AND resolved_at < ?)",
+                (now - self.found_ttl, now - self.not_found_ttl)
+            )
+            self._conn.commit()
+            return cursor.rowcount
@@ -0,0 +1,178 @@
+import json
+import time
+from itertools import chain
+from operator import itemgetter
+from typing import NamedTuple, Optional
+
+
+class Recommendation(NamedTuple):
+    track: str
+    artist: str
+
+
+class RecommendationResult(NamedTuple):
+    """
+    What every model provider returns, whether the request succeeded or not.
+    `raw` is the assistant message content (kept for the conversation history even when it
+    could not be parsed), `parse_path` is "fast", "recovered" or None, `elapsed` is the request
+    time in seconds and `response` the provider's response object, if any.
+    """
+    recommendations: list
+    raw: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    parse_path: Optional[str] = None
+    response: object = None
+
+    @classmethod
+    def failed(cls, error, raw=None, elapsed=0.0, response=None):
+        return cls([], raw, error, elapsed, None, response)
+
+
+_track_and_artist = itemgetter("track", "artist")
+
+
+def validate_recommendations(items):
+    """Keeps the {track, artist} dicts with non-empty values. Returns (recommendations_list, invalid_count)."""
+    recommendations = []
+    invalid = 0
+    for item in items:
+        if isinstance(item, dict) and item.get("track") and item.get("artist"):
+            recommendations.append(Recommendation(str(item["track"]), str(item["artist"])))
+        else:
+            invalid += 1
+    return recommendations, invalid
+
+
+def _well_formed_recommendations(items):
+    """
+    Recommendations of `items` when every one is a {track, artist} dict with non-empty string values,
+    else None. The whole list is checked at once rather than item by item, as nearly every response
+    has this shape.
+    """
+    try:
+        recommendations = list(map(Recommendation._make, map(_track_and_artist, items))) # KeyError / TypeError
+        if all(map(str.__len__, chain.from_iterable(recommendations))): # TypeError on non-string values
+            return recommendations
+    except (KeyError, TypeError):
+        pass
+    return None
+
+
+def _extract_list(parsed):
+    # Accepted shapes: {"recommendations": [...]}, [...], or any object with a single list value.
+    if isinstance(parsed, dict):
+        items = parsed.get("recommendations")
+        if isinstance(items, list):
+            return items
+        if len(parsed) == 1:
+            items = next(iter(parsed.values()))
+            if isinstance(items, list):
+                return items
+        return None
+    if isinstance(parsed, list):
+        return parsed
+    return None
+
+
+def _strip_markdown_fences(content):
+    content = content.strip()
+    if content.startswith("```"):
+        content = content[3:]
+        if content.lower().startswith("json"):
+            content = content[4:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content.strip()
+
+
+def parse_recommendations(raw_content):
+    """
+    Parses a model response into Recommendation records.
+    Fast path: a single json.loads of a well-formed response. Only when that fails (markdown fences,
+    text around the JSON, unexpected shape, truncated output) does it fall back to tolerant recovery,
+    which ends with salvaging every complete {track, artist} object it can find.
+    Returns a tuple: (recommendations_list, parse_path, error_or_None)
+    """
+    if not raw_content:
+        return [], None, "empty response"
+    try:
+        items = _extract_list(json.loads(raw_content))
+        if items is not None:
+            recommendations = _well_formed_recommendations(items)
+            if recommendations is not None:
+                return recommendations, "fast", None
+    except ValueError:
+        pass
+
+    cleaned = _strip_markdown_fences(raw_content)
+    for start_char, end_char in (("{", "}"), ("[", "]")):
+        start, end = cleaned.find(start_char), cleaned.rfind(end_char)
+        if start == -1 or end <= start:
+            continue
+        try:
+            items = _extract_list(json.loads(cleaned[start:end + 1]))
+        except ValueError:
+            continue
+        if items is not None:
+            recommendations, invalid = validate_recommendations(items)
+            if recommendations:
+                error = f"skipped {invalid} invalid recommendation(s)" if invalid else None
+                return recommendations, "recovered", error
+
+    recommendations = IncrementalRecommendationParser().feed(raw_content)
+    if recommendations:
+        return recommendations, "recovered", "response was not valid JSON; salvaged complete objects"
+    return [], None, "no recommendations found in response"
+
+
+def parse_response(raw_content, started_at, response=None):
+    """Builds the RecommendationResult for a response whose request started at `started_at` (time.monotonic())."""
+    recommendations, parse_path, error = parse_recommendations(raw_content)
+    return RecommendationResult(recommendations, raw_content, error, time.monotonic() - started_at, parse_path, response)
+
+
+class IncrementalRecommendationParser:
+    """
+    Incremental parser for a model response streamed as text chunks.
+    `feed()` returns a Recommendation for every {"track", "artist"} object whose closing brace arrived
+    in the new chunk, so songs can be verified while the rest of the response is still being generated.
+    Works whether the objects sit in a top-level array or under a key such as "recommendations",
+    and ignores anything around them (e.g. markdown fences).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._in_string = False
+        self._escape = False
+        self._open_braces = [] # Start offsets of the objects currently open
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == '{':
+                self._open_braces.append(i)
+            elif c == '}' and self._open_braces:
+                start = self._open_braces.pop()
+                try:
+                    obj = json.loads(text[start:i + 1])
+                except ValueError:
+                    continue
+                if isinstance(obj, dict) and "track" in obj and "artist" in obj:
+                    recommendations, _ = validate_recommendations([obj])
+                    completed.extend(recommendations)
+        self._pos = len(text)
+        return completed
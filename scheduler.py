@@ -0,0 +1,129 @@
+import random
+import sys
+import threading
+import time
+
+import requests
+
+from metrics import metrics
+from paging import AdaptiveThrottle, get_retry_after, get_status_code
+from rate_limit import TokenBucket
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5 # Seconds; the n-th retry of a transient error waits up to BACKOFF_BASE * 2**n...
+BACKOFF_CAP = 30.0 # ...but never more than this
+
+# Per-API limits, shared by every thread and every user of the process
+API_LIMITS = {
+    "spotify": {"requests_per_second": 20, "max_concurrency": 32},
+    "openai": {"requests_per_second": 2, "max_concurrency": 8},
+    "openrouter": {"requests_per_second": 2, "max_concurrency": 8},
+}
+
+_TRANSIENT_ERRORS = (
+    TimeoutError, ConnectionError,
+    requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+)
+
+
+def is_transient_error(exc):
+    """True for server errors (5xx), timeouts and dropped connections: worth retrying after a backoff."""
+    status = get_status_code(exc)
+    if isinstance(status, int) and status >= 500:
+        return True
+    if isinstance(exc, _TRANSIENT_ERRORS):
+        return True
+    httpx = sys.modules.get("httpx") # Only imported once a model client is used (see clients.py)
+    if httpx is not None and isinstance(exc, (httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    openai = sys.modules.get("openai") # Only imported once an OpenAI provider is used (see clients.py)
+    # openai.APIConnectionError includes openai.APITimeoutError
+    return openai is not None and isinstance(exc, openai.APIConnectionError)
+
+
+def jittered_backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # "Full jitter": a random delay up to the exponential bound, so retrying callers don't stay in lockstep.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RequestScheduler(AdaptiveThrottle):
+    """
+    Gate for every request to one API: a token bucket for its rate limit, the AdaptiveThrottle
+    concurrency limit, and the retry policy. Requests go out immediately while there is headroom.
+    A 429 pauses every caller for Retry-After (and halves the concurrency); a 5xx, a timeout or a
+    dropped connection is retried by that caller alone after a jittered exponential backoff.
+    Anything else, or an error still failing after `max_retries` retries, is raised to the caller.
+    """
+
+    def __init__(self, name, requests_per_second=None, max_concurrency=8, max_retries=MAX_RETRIES):
+        super().__init__(max_concurrency, rate_limiter=TokenBucket(requests_per_second) if requests_per_second else None)
+        self.name = name
+        self.max_retries = max_retries
+        self.retried_count = 0
+
+    def call(self, fn, *args, retry_transient=True, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` under the rate limit and concurrency limit, with the retry policy above.
+        Writes that are not safe to repeat (creating playlists, adding or moving playlist items) pass
+        `retry_transient=False`: a timeout or a 5xx may come after the server applied the change, so only
+        429s are retried for them.
+        """
+        call_name = getattr(fn, "__name__", "call")
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                waited = self.rate_limiter.acquire()
+                if waited:
+                    metrics.observe("rate_limit_wait_seconds", waited, api=self.name)
+            self.acquire()
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.release(success=False)
+                metrics.observe("api_request_seconds", time.perf_counter() - start, api=self.name, call=call_name)
+                retry_after = get_retry_after(e)
+                metrics.incr("api_requests_total", api=self.name, outcome="rate_limited" if retry_after is not None else "error")
+                if attempt == self.max_retries or (retry_after is None and not (retry_transient and is_transient_error(e))):
+                    raise
+                self.retried_count += 1
+                metrics.incr("api_retries_total", api=self.name)
+                if retry_after is not None:
+                    self.backoff(retry_after)
+                    print(f"{self.name}: rate limited (429). Backing off {retry_after:.1f}s, "
+                          f"concurrency now {self.current_limit}...")
+                else:
+                    delay = jittered_backoff(attempt)
+                    print(f"{self.name}: {e.__class__.__name__} ({e}). Retrying in {delay:.1f}s "
+                          f"(attempt {attempt + 2}/{self.max_retries + 1})...")
+                    time.sleep(delay)
+                continue
+            self.release(success=True)
+            metrics.observe("api_request_seconds", time.perf_counter() - start, api=self.name, call=call_name)
+            metrics.incr("api_requests_total", api=self.name, outcome="ok")
+            return result
+
+    def summary(self):
+        waited = self.rate_limiter.waited_total if self.rate_limiter else 0.0
+        return (f"{self.name}: {self.rate_limited_count} rate limited (429), {self.retried_count} retries, "
+                f"{waited:.1f}s waiting for the rate limit")
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api):
+    """The process-wide RequestScheduler of `api` ("spotify", "openai" or "openrouter"), see API_LIMITS."""
+    with _schedulers_lock:
+        if api not in _schedulers:
+            _schedulers[api] = RequestScheduler(api, **API_LIMITS.get(api, {}))
+        return _schedulers[api]
+
+
+def print_scheduler_stats():
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    if schedulers:
+        print("\nRequest scheduling:")
+        for scheduler in schedulers:
+            print(f"  {scheduler.summary()}")
@@ -0,0 +1,241 @@
+"""
+Service mode: one long-running process for one account that keeps the Spotify and model clients, the liked
+songs (with their de-duplication index and taste profile), the history index and the search cache warm,
+refreshes them on a schedule, and updates the playlists whenever it is triggered.
+
+    python service.py [--port=8710] [--refresh-minutes=15] [--full-sync-hours=24] [--run-every-hours=0]
+                      [--token-cache=PATH] [--sequential] [--no-stream] [--providers=openai]
+    python service.py --trigger [--port=8710]
+
+A refresh syncs the liked songs added since the last one and re-reads the history playlist if its
+snapshot_id moved, so a triggered run only has to ask the models, verify their songs and write the
+playlists. Local HTTP endpoints (127.0.0.1 only):
+
+    POST /run       updates the playlists now, answers {"run_id", "trigger", "collected", "seconds", ...}
+    POST /refresh   refreshes the warm state now
+    GET  /status    last refresh and last run
+    GET  /metrics   counters and timings in the Prometheus text format
+
+`--trigger` sends POST /run to a running service and prints the result. `--run-every-hours` also
+updates the playlists on a schedule.
+"""
+import json
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import metrics
+from settings import ALL_RECS_PLAYLIST_NAME, CACHE_DB_PATH, METRICS_LOG_PATH, NEW_PLAYLIST_NAME, SPOTIFY_TOKEN_CACHE
+
+# The backend (spotipy, the model clients, SQLite, NumPy) is imported where it's used, so that
+# `--trigger` only loads the standard library.
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8710
+SERVICE_REFRESH_MINUTES = 15 # Incremental sync of the liked songs and history
+SERVICE_FULL_SYNC_HOURS = 24 # Full reconcile, the only way to notice songs that were un-liked
+
+
+class PlaylistService:
+    """
+    Warm state of one account, and the refreshes and runs on it. Refreshes and runs are serialized:
+    a trigger that arrives during a run waits for it to finish.
+    """
+
+    def __init__(self, sp_client, provider_router, library_store, resolution_cache, pipelined=True):
+        self.sp_client = sp_client
+        self.provider_router = provider_router
+        self.library_store = library_store
+        self.resolution_cache = resolution_cache
+        self.pipelined = pipelined
+        from warm_state import WarmState
+        self.warm_state = WarmState()
+        self.last_refresh = None
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def refresh(self, full_sync=False):
+        """
+        Brings the warm state up to date with Spotify (liked songs, their index and profile, history index)
+        and drops the expired search results.
+        """
+        from helper_functions import get_or_create_playlist_ids, sync_liked_songs
+        from playlist_sync import get_playlist_state
+        with self._lock:
+            start = time.monotonic()
+            with metrics.span("service_refresh", full=full_sync):
+                if self.warm_state.user_info is None:
+                    self.warm_state.user_info = self.sp_client.me()
+                if sync_liked_songs(self.sp_client, self.library_store, full=full_sync) or full_sync:
+                    self.warm_state.invalidate_library()
+                liked_songs = self.warm_state.liked_songs(self.library_store)
+                self.warm_state.liked_index(self.library_store)
+                self.warm_state.taste_profile(self.library_store)
+                playlist_ids = get_or_create_playlist_ids(self.sp_client, self.warm_state.user_info['id'],
+                                                          [ALL_RECS_PLAYLIST_NAME, NEW_PLAYLIST_NAME], self.library_store)
+                all_recs_playlist_id = playlist_ids.get(ALL_RECS_PLAYLIST_NAME)
+                if all_recs_playlist_id:
+                    snapshot_id, history = get_playlist_state(self.sp_client, all_recs_playlist_id, self.library_store)
+                    self.warm_state.history_index(all_recs_playlist_id, snapshot_id, history)
+                purged = self.resolution_cache.purge_expired()
+            if purged:
+                print(f"Dropped {purged} expired search results from the cache.")
+            self.last_refresh = {"finished_at": time.time(), "seconds": round(time.monotonic() - start, 3),
+                                 "full_sync": full_sync, "liked_songs": len(liked_songs)}
+            print(f"Warm state refreshed in {self.last_refresh['seconds']:.1f}s ({len(liked_songs)} liked songs).")
+            return self.last_refresh
+
+    def run(self, trigger="manual"):
+        """Updates the recommendation playlists from the warm state; returns a summary of the run."""
+        from spotify_playlist import update_recommendation_playlists
+        with self._lock:
+            start = time.monotonic()
+            run_id = metrics.begin_run(mode="service", trigger=trigger, pipelined=self.pipelined)
+            collected = None
+            try:
+                collector = update_recommendation_playlists(
+                    self.sp_client, self.provider_router, self.library_store, self.resolution_cache,
+                    pipelined=self.pipelined, warm_state=self.warm_state
+                )
+                collected = len(collector) if collector else 0
+            finally:
+                run_record = metrics.end_run(METRICS_LOG_PATH, collected=collected)
+                metrics.print_stage_timings(run_record)
+                self.last_run = {"run_id": run_id, "trigger": trigger, "finished_at": time.time(),
+                                 "seconds": round(time.monotonic() - start, 3), "collected": collected}
+            return self.last_run
+
+    def status(self):
+        return {"user": (self.warm_state.user_info or {}).get('id'), "last_refresh": self.last_refresh,
+                "last_run": self.last_run}
+
+    def run_schedule(self, stop, refresh_interval, full_sync_interval=None, run_interval=None):
+        """
+        Refreshes every `refresh_interval` seconds (a full sync every `full_sync_interval`) and, with
+        `run_interval`, also updates the playlists on that schedule, until the `stop` event is set.
+        """
+        now = time.monotonic()
+        due = {"refresh": now + refresh_interval}
+        if full_sync_interval:
+            due["full_sync"] = now + full_sync_interval
+        if run_interval:
+            due["run"] = now + run_interval
+        while not stop.wait(max(0.0, min(due.values()) - time.monotonic())):
+            task = min(due, key=due.get)
+            try:
+                if task == "run":
+                    self.run(trigger="schedule")
+                else:
+                    self.refresh(full_sync=task == "full_sync")
+            except Exception as e:
+                print(f"Scheduled {task} failed: {e.__class__.__name__}: {e}")
+            now = time.monotonic()
+            due[task] = now + {"refresh": refresh_interval, "full_sync": full_sync_interval, "run": run_interval}[task]
+            if task != "refresh": # A full sync or a run refreshes as well
+                due["refresh"] = now + refresh_interval
+
+
+def start_service_server(service, port=SERVICE_PORT, host=SERVICE_HOST):
+    """Serves the trigger / status endpoints of `service` from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body, content_type="application/json"):
+            body = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/status":
+                self._reply(200, service.status())
+            elif path == "/metrics":
+                self._reply(200, metrics.prometheus_text(), "text/plain; version=0.0.4")
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            actions = {"/run": lambda: service.run(trigger="http"), "/refresh": service.refresh}
+            action = actions.get(self.path.split("?", 1)[0])
+            if action is None:
+                self.send_error(404)
+                return
+            try:
+                self._reply(200, action())
+            except Exception as e:
+                self._reply(500, {"error": f"{e.__class__.__name__}: {e}"})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Service listening on http://{host}:{server.server_address[1]} (POST /run, POST /refresh, GET /status, GET /metrics)")
+    return server
+
+
+def trigger_run(port=SERVICE_PORT, host=SERVICE_HOST):
+    """Asks the service running on `port` to update the playlists now; returns its summary of the run."""
+    request = urllib.request.Request(f"http://{host}:{port}/run", method="POST")
+    with urllib.request.urlopen(request) as response: # Raises HTTPError (an OSError) on error statuses
+        return json.load(response)
+
+
+def get_option(argv, name, default, cast=str):
+    return next((cast(arg.split("=", 1)[1]) for arg in argv if arg.startswith(f"--{name}=")), default)
+
+
+def main(argv):
+    """Starts the service (or triggers a run with --trigger); `argv` are the options, see the usage above."""
+    port = get_option(argv, "port", SERVICE_PORT, int)
+    if "--trigger" in argv:
+        try:
+            print(json.dumps(trigger_run(port), indent=2))
+        except OSError as e:
+            print(f"Could not trigger a run on port {port}: {e}"); return 1
+        return 0
+
+    from helper_functions import (
+        OPENAI_API_KEY, OPENROUTER_API_KEY, SPOTIFY_API_PREFIX, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_REDIRECT_URI,
+        get_spotify_client
+    )
+    from clients import get_requests_session
+    from library_cache import LibraryStore
+    from resolution_cache import ResolutionCache
+    from spotify_playlist import check_provider_args, get_provider_router_from_args
+    if not ((SPOTIFY_API_PREFIX or (SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET and SPOTIFY_REDIRECT_URI))
+            and (OPENROUTER_API_KEY or OPENAI_API_KEY)):
+        print("Error: Missing environment variables. Please check .env file."); return 1
+    if not check_provider_args(argv): return 1
+
+    token_cache = get_option(argv, "token-cache", SPOTIFY_TOKEN_CACHE)
+    sp_client = get_spotify_client(token_cache, requests_session=get_requests_session())
+    if not sp_client: return 1
+
+    service = PlaylistService(
+        sp_client, get_provider_router_from_args(argv), LibraryStore(CACHE_DB_PATH), ResolutionCache(CACHE_DB_PATH),
+        pipelined="--sequential" not in argv
+    )
+    service.refresh()
+    start_service_server(service, port)
+
+    stop = threading.Event()
+    try:
+        service.run_schedule(
+            stop,
+            refresh_interval=get_option(argv, "refresh-minutes", SERVICE_REFRESH_MINUTES, float) * 60,
+            full_sync_interval=get_option(argv, "full-sync-hours", SERVICE_FULL_SYNC_HOURS, float) * 3600,
+            run_interval=get_option(argv, "run-every-hours", 0, float) * 3600
+        )
+    except KeyboardInterrupt:
+        print("\nService stopped.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,43 @@
+"""
+Settings that don't depend on the environment, importable without loading any Spotify or model client
+(cli.py reads them for the cache-only commands). The API keys and endpoints are read from the
+environment / .env file in helper_functions.py, after load_environment().
+"""
+GEMINI_MODEL = "google/gemini-2.5-flash-preview"
+# OPENAI_MODEL = "openai/gpt-4.1" # or "openai/o1", "openai/gpt-4o-2024-11-20",  "openai/o1-preview"
+# ANTHROPIC_MODEL = "anthropic/claude-3.7-sonnet"  # or "anthropic/claude-3.7-sonnet:thinking", "anthropic/claude-3.5-haiku", "anthropic/claude-3.5-sonnet" 
+OPENAI_MODEL = "gpt-4o" # gpt-4.1, o3, o1
+
+# Ensure the model IDs are valid
+
+SCOPES = "user-library-read playlist-modify-public playlist-read-private playlist-read-collaborative"
+NEW_PLAYLIST_NAME = "New AI Recommendations"
+ALL_RECS_PLAYLIST_NAME = "All AI Recommendations"
+
+TARGET_NEW_SONGS_COUNT = 20
+MAX_MODEL_ATTEMPTS = 10 # Increased attempts as we ask for exactly 20 each time
+MAX_SONGS_TO_MODEL_PROMPT = 200 # Max liked songs for the initial model prompt
+MAX_PROMPT_TOKENS = 6000 # Older turns are folded into a compact exclusion list beyond this
+APPROXIMATE_DEDUP = True # Also treat near-identical titles by the same artist as duplicates
+STREAM_MODEL_RESPONSES = True # Verify each song as soon as the model has streamed it
+# Spread the prompt sample over k-means clusters of the library and look up the suggestions closest to
+# them first (needs NumPy). Off by default: it costs 0.5-1s per library and collected no more songs
+# than a random sample in our runs.
+TASTE_PROFILE_CLUSTERING = False
+
+CACHE_DB_PATH = ".spotifai_cache.db" # Local SQLite store (liked songs library, ...)
+SPOTIFY_MAX_CONCURRENT_REQUESTS = 8 # Concurrency limit for paged Spotify fetches
+SPOTIFY_TOKEN_CACHE = ".spotify_cache" # Default OAuth token cache file
+METRICS_LOG_PATH = ".spotifai_runs.jsonl" # One JSON line of metrics per run (see metrics.py)
+BATCH_MAX_CONCURRENT_REQUESTS = 32 # Spotify search workers shared by all users of a batch run (batch.py)
+
+_environment_loaded = False
+
+
+def load_environment():
+    """Loads the .env file into os.environ, once; variables already set in the environment are kept."""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _environment_loaded = True
@@ -1,76 +1,94 @@
-import os
-import json
-import random
-import time
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-import requests
-from dotenv import load_dotenv
-from openai import OpenAI, APIError
-from helper_functions import *
-
-load_dotenv()
-
-
-
-if __name__ == "__main__":
-    
-    if not (SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET and SPOTIFY_REDIRECT_URI and (OPENROUTER_API_KEY or OPENAI_API_KEY)):
-        print("Error: Missing environment variables. Please check .env file."); exit(1)
-
-    sp_client = get_spotify_client()
-    if not sp_client: exit(1)
-
-    user_info = sp_client.me()
+import sys
+from helper_functions import (
+    OPENAI_API_KEY, OPENROUTER_API_KEY, SPOTIFY_API_PREFIX, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_REDIRECT_URI,
+    get_or_create_playlist_ids, get_spotify_client, sync_liked_songs
+)
+from library_cache import LibraryStore
+from resolution_cache import ResolutionCache
+from pipeline import collect_recommendations
+from providers import build_provider_router, configured_provider_names
+from conversation import ConversationContext
+from track_index import TrackIndex
+from collector import RecommendationCollector, SuggestionBudget
+from warm_state import WarmState
+from playlist_sync import append_to_playlist, get_playlist_state, sync_playlist
+from clients import print_connection_stats
+from scheduler import print_scheduler_stats
+from metrics import metrics, start_metrics_server
+from settings import (
+    ALL_RECS_PLAYLIST_NAME, APPROXIMATE_DEDUP, CACHE_DB_PATH, MAX_MODEL_ATTEMPTS, MAX_SONGS_TO_MODEL_PROMPT, METRICS_LOG_PATH,
+    NEW_PLAYLIST_NAME, SPOTIFY_TOKEN_CACHE, STREAM_MODEL_RESPONSES, TARGET_NEW_SONGS_COUNT
+)
+
+
+def update_recommendation_playlists(sp_client, provider_router, library_store, resolution_cache, full_sync=False,
+                                    pipelined=True, search_executor=None, throttle=None, warm_state=None):
+    """
+    One run for the account of `sp_client`: sync its liked songs into `library_store`, ask the models
+    behind `provider_router` for new songs and write them to the two recommendation playlists.
+    The router, the resolution cache and the optional search executor / throttle can be shared
+    between accounts (see batch.py). A `warm_state` (WarmState) kept from a previous run of the same
+    account skips rebuilding what didn't change since (see service.py).
+    Returns the RecommendationCollector, or None if nothing was collected.
+    """
+    warm_state = warm_state or WarmState()
+    if warm_state.user_info is None:
+        warm_state.user_info = sp_client.me()
+    user_info = warm_state.user_info
     user_id = user_info['id']
     print(f"Logged in as: {user_info.get('display_name', user_id)}")
 
-    # 1. Get ALL liked songs and create a set for filtering
-    all_my_liked_songs_details = get_all_liked_songs_details(sp_client)
+    # 1. Sync the local liked songs store (incremental unless full_sync) and create a set for filtering
+    with metrics.span("library_sync", user=user_id, full=full_sync):
+        if sync_liked_songs(sp_client, library_store, full=full_sync, throttle=throttle) or full_sync:
+            warm_state.invalidate_library()
+        all_my_liked_songs_details = warm_state.liked_songs(library_store)
     if not all_my_liked_songs_details:
-        print("No liked songs found. Exiting."); exit()
+        print("No liked songs found. Exiting."); return None
 
-    all_my_liked_songs_set = set()
-    for song_detail in all_my_liked_songs_details:
-        track = song_detail.get('track', "").strip().lower()
-        artist = song_detail.get('artist', "").strip().lower()
-        if track and artist:
-            all_my_liked_songs_set.add((track, artist))
-    print(f"Created set of {len(all_my_liked_songs_set)} unique liked songs for de-duplication.")
+    with metrics.span("liked_index", user=user_id, songs=len(all_my_liked_songs_details)):
+        all_my_liked_songs_index = warm_state.liked_index(library_store)
+    print(f"Created index of {len(all_my_liked_songs_index)} unique liked songs for de-duplication.")
 
 
-    # 2. Shuffle liked songs and take a sample for the initial model prompt
-    random.shuffle(all_my_liked_songs_details)
-    sample_liked_songs_for_model_prompt = all_my_liked_songs_details[:MAX_SONGS_TO_MODEL_PROMPT]
+    # 2. Take a sample for the initial model prompt (spread over the clusters of the library with TASTE_PROFILE_CLUSTERING)
+    with metrics.span("prompt_sample", user=user_id):
+        taste_profile = warm_state.taste_profile(library_store)
+        sample_liked_songs_for_model_prompt = taste_profile.sample(MAX_SONGS_TO_MODEL_PROMPT)
+    if taste_profile.clustered:
+        print(f"Sampled {len(sample_liked_songs_for_model_prompt)} liked songs across "
+              f"{len(taste_profile.centroids)} clusters of the library.")
 
     # Get "All AI Recommendations" playlist history
-    all_recs_playlist_id = get_or_create_playlist_id(sp_client, user_id, ALL_RECS_PLAYLIST_NAME)
-    existing_all_recs_songs_details = []
-    if all_recs_playlist_id:
-        existing_all_recs_songs_details = get_playlist_tracks_simplified(sp_client, all_recs_playlist_id)
-
-    all_recs_history_set = set() # Stores (track.lower(), artist.lower()) from "All model Recs" playlist
-    for song_detail in existing_all_recs_songs_details:
-        track = song_detail.get('track', "").strip().lower()
-        artist = song_detail.get('artist', "").strip().lower()
-        if track and artist:
-            all_recs_history_set.add((track, artist))
-    print(f"Found {len(all_recs_history_set)} unique songs in '{ALL_RECS_PLAYLIST_NAME}' history.")
+    # Both playlists are resolved at once: cached IDs first, then a single scan of the user's playlists
+    with metrics.span("playlist_ids", user=user_id):
+        playlist_ids = get_or_create_playlist_ids(sp_client, user_id, [ALL_RECS_PLAYLIST_NAME, NEW_PLAYLIST_NAME], library_store)
+    all_recs_playlist_id = playlist_ids.get(ALL_RECS_PLAYLIST_NAME)
+    with metrics.span("history_fetch", user=user_id):
+        if all_recs_playlist_id:
+            # Only re-read when its snapshot_id changed since the last run
+            all_recs_snapshot_id, existing_all_recs_songs_details = get_playlist_state(
+                sp_client, all_recs_playlist_id, library_store, throttle)
+            # URIs, ISRCs and canonical (track, artist) keys of the "All model Recs" playlist
+            all_recs_history_index = warm_state.history_index(all_recs_playlist_id, all_recs_snapshot_id,
+                                                              existing_all_recs_songs_details)
+        else:
+            all_recs_history_index = TrackIndex(approximate=APPROXIMATE_DEDUP)
+    print(f"Found {len(all_recs_history_index)} unique songs in '{ALL_RECS_PLAYLIST_NAME}' history.")
 
 
     # 3-5. Iteratively get new recommendations
-    collected_new_songs_for_playlist_uris = []
-    collected_new_songs_for_playlist_details = [] # Stores Spotify-verified dicts for final playlist
-
-    conversation_history = []
-    # Stores dicts {track, artist} of ALL songs the AI model suggests in this session (raw names from the model)
-    # Used to tell the model what to avoid in follow-up prompts.
-    all_ai_suggestions_this_session_raw_details = [] 
+    # Spotify-verified songs for the final playlist, skipping liked / already recommended / duplicate songs
+    collector = RecommendationCollector(TARGET_NEW_SONGS_COUNT, all_my_liked_songs_index, all_recs_history_index)
+    # Ask for more songs than needed, by the share of suggestions that past runs ended up keeping
+    suggestion_budget = SuggestionBudget(library_store.get_suggestion_hit_rate())
+    initial_request_size = suggestion_budget.request_size(TARGET_NEW_SONGS_COUNT)
+    print(f"Asking for {initial_request_size} songs per request (expected hit rate {suggestion_budget.hit_rate:.0%}).")
 
     # Initial user prompt for the very first message to the model
     liked_songs_prompt_str = "\n".join([f"- \"{s['track']}\" by {s['artist']}" for s in sample_liked_songs_for_model_prompt])
     initial_user_prompt_content = f"""You are a music recommendation assistant. I will provide you with a list of songs I like.
-    Based on this list, please recommend {TARGET_NEW_SONGS_COUNT} additional songs that I might enjoy.
+    Based on this list, please recommend {initial_request_size} additional songs that I might enjoy.
     It's important that your response is ONLY a valid JSON array of objects, where each object has a "track" key (song title) and an "artist" key (artist name).
     Format example:
     {{
@@ -85,133 +103,152 @@ if __name__ == "__main__":
     Here are some songs I like:
     {liked_songs_prompt_str}
 
-    Please provide {TARGET_NEW_SONGS_COUNT} new song recommendations in the specified JSON format."""
-    conversation_history.append({"role": "user", "content": initial_user_prompt_content})
-
-    for attempt in range(MAX_MODEL_ATTEMPTS):
-        if len(collected_new_songs_for_playlist_uris) >= TARGET_NEW_SONGS_COUNT:
-            print("\nTarget number of new songs reached.")
-            break
+    Please provide {initial_request_size} new song recommendations in the specified JSON format."""
 
-        print(f"\n--- AI Model Request Attempt {attempt + 1}/{MAX_MODEL_ATTEMPTS} ---")
-        
-        # If this is not the first attempt, construct and add follow-up user message
-        if attempt > 0:
-            songs_suggested_by_ai_this_session_str = "\n".join(
-                [f"- \"{s['track']}\" by {s['artist']}" for s in all_ai_suggestions_this_session_raw_details]
-            )
-            if not songs_suggested_by_ai_this_session_str:
-                songs_suggested_by_ai_this_session_str = "(None previously suggested in this session)"
-
-            follow_up_user_prompt_content = f"""Okay, thank you. Now, please provide {TARGET_NEW_SONGS_COUNT} MORE unique song recommendations based on the initial list of songs I like (provided at the start of our conversation).
-    It is very important that these new recommendations are different from any songs you've already suggested to me in this conversation. For reference, here are the songs you've suggested so far (please avoid these):
-    {songs_suggested_by_ai_this_session_str}
+    def build_follow_up_prompt(songs_to_avoid_str):
+        # songs_to_avoid_str: suggestions of this session (raw names from the model) that aren't already visible
+        # in the conversation, e.g. those made by another provider, as a compact "Artist: Track; Track" list.
+        request_size = suggestion_budget.request_size(max(1, TARGET_NEW_SONGS_COUNT - len(collector)))
+        return f"""Okay, thank you. Now, please provide {request_size} MORE unique song recommendations based on the initial list of songs I like (provided at the start of our conversation).
+    It is very important that these new recommendations are different from any songs you've already suggested to me in this conversation, including the ones above and these:
+    {songs_to_avoid_str}
 
     Also, ensure these new recommendations are different from the initial list of liked songs I provided.
     Your response must be ONLY a valid JSON array of objects, with "track" and "artist" keys, as before."""
-            conversation_history.append({"role": "user", "content": follow_up_user_prompt_content})
-            # Prune conversation history if it gets too long (optional, depends on model limits)
-            # For now, let it grow for a few turns. Especially if using a model with a decent context window like Gemini Flash.
-            # if len(conversation_history) > 10: # Example: keep last 10 messages + initial prompt
-            #     conversation_history = [conversation_history[0]] + conversation_history[-9:]
-
-        # print(conversation_history)
-        # conversation_history = [{'role': 'user', 'content': 'You are a music recommendation assistant. I will provide you with a list of songs I like.\nBased on this list, please recommend 5 additional songs that I might enjoy.\nIt\'s important that your response is ONLY a valid JSON array of objects, where each object has a "track" key (song title) and an "artist" key (artist name).\nDo not include any other text, explanations, or markdown formatting outside of the JSON array.\n\nHere are some songs I like:\n- "When We Were Young" by Adele\n- "Interlude" by SCH\n- "Cheum" by Nekfeu\n- "Blinding Lights" by The Weeknd\n- "Isoler" by Benab\n- "Sheita" by PNL\n- "Step Into Christmas - Remastered 1995" by Elton John\n- "Spécial (feat. Dosseh)" by Lefa\n- "Skin" by Rihanna\n- "Barillet" by La Fouine\n- "Rude" by Benab\n- "Lettre à la république" by Kery James\n- "999 (with Camilo)" by Selena Gomez\n- "Sinequanone" by Dinos\n- "The Next Episode" by Dr. Dre\n- "Attendez-moi" by Guizmo\n- "Ice Cream (with Selena Gomez)" by BLACKPINK\n- "Bagarre" by Jul\n- "HIBIKI" by Bad Bunny\n- "VS – Call of duty : Modern Warfare III" by Dosseh\n\nPlease provide 5 new song recommendations in the specified JSON format.'}]
-
-        model_batch_recs_parsed, raw_assistant_response_str, raw = get_recommendations_openai(
-            OPENAI_API_KEY,
-            conversation_history
-        )
 
-        # model_batch_recs_parsed, raw_assistant_response_str, raw = get_recommendations_openrouter(
-        #     OPENAI_API_KEY,
-        #     conversation_history
-        # )
-
-        if raw_assistant_response_str: # If the model responded, add its response to history
-            conversation_history.append({"role": "assistant", "content": raw_assistant_response_str})
-        
-        if not model_batch_recs_parsed:
-            print("AI Model returned no valid recommendations in this batch or there was an API error.")
-            if attempt < MAX_MODEL_ATTEMPTS - 1: time.sleep(3)
-            continue
-
-        # Add raw suggestions from this model batch to `all_ai_suggestions_this_session_raw_details`
-        # This list helps construct the "avoid these" part of the next follow-up prompt.
-        for rec in model_batch_recs_parsed: # rec is dict {track, artist}
-            all_ai_suggestions_this_session_raw_details.append(rec)
-        
-        print(f"AI Model suggested {len(model_batch_recs_parsed)} songs. Verifying on Spotify and filtering...")
-        verified_spotify_songs_this_batch = verify_songs_on_spotify_v2(sp_client, model_batch_recs_parsed)
-        
-        newly_added_this_turn_count = 0
-        for verified_song_info in verified_spotify_songs_this_batch: # dict {'uri', 'track', 'artist'}
-            if len(collected_new_songs_for_playlist_uris) >= TARGET_NEW_SONGS_COUNT:
-                break
-
-            # Use Spotify's canonical track/artist names for consistent checking
-            spotify_track_name_lower = verified_song_info['track'].lower()
-            spotify_artist_name_lower = verified_song_info['artist'].lower()
-            spotify_song_key = (spotify_track_name_lower, spotify_artist_name_lower)
-            
-            is_liked = spotify_song_key in all_my_liked_songs_set
-            is_in_all_recs_playlist_history = spotify_song_key in all_recs_history_set
-            
-            # Check if URI is already in the list we are building this session
-            is_already_collected_for_new_playlist_this_session = any(
-                vs['uri'] == verified_song_info['uri'] for vs in collected_new_songs_for_playlist_details
-            )
-
-            if not is_liked and not is_in_all_recs_playlist_history and not is_already_collected_for_new_playlist_this_session:
-                collected_new_songs_for_playlist_uris.append(verified_song_info['uri'])
-                collected_new_songs_for_playlist_details.append(verified_song_info)
-                newly_added_this_turn_count +=1
-                print(f"  ++ Collected for new playlist: '{verified_song_info['track']}' by '{verified_song_info['artist']}'")
-            else:
-                reason = []
-                if is_liked: reason.append("is liked")
-                if is_in_all_recs_playlist_history: reason.append("in all_recs history")
-                if is_already_collected_for_new_playlist_this_session: reason.append("already collected this session")
-                print(f"  -- Skipped '{verified_song_info['track']}' by '{verified_song_info['artist']}' (Reason: {', '.join(reason)})")
-
-        print(f"Added {newly_added_this_turn_count} new songs this turn.")
-        print(f"Total collected for new playlist so far: {len(collected_new_songs_for_playlist_uris)}/{TARGET_NEW_SONGS_COUNT}")
-        
-        if len(collected_new_songs_for_playlist_uris) >= TARGET_NEW_SONGS_COUNT:
-            break 
-        elif attempt < MAX_MODEL_ATTEMPTS -1 :
-            time.sleep(2) # Pause before next the model attempt
+    # Kept under MAX_PROMPT_TOKENS: older turns get folded into a compact exclusion list
+    conversation = ConversationContext(initial_user_prompt_content, build_follow_up_prompt)
+    with metrics.span("collect_recommendations", user=user_id):
+        collect_recommendations(
+            sp_client,
+            provider_router,
+            conversation,
+            collector,
+            TARGET_NEW_SONGS_COUNT,
+            MAX_MODEL_ATTEMPTS,
+            resolution_cache=resolution_cache,
+            pipelined=pipelined,
+            search_executor=search_executor,
+            throttle=throttle,
+            rank_suggestions=taste_profile.rank,
+            score_suggestions=taste_profile.score,
+            prefilter=collector.prefilter,
+            suggestion_budget=suggestion_budget
+        )
+    library_store.set_suggestion_hit_rate(suggestion_budget.hit_rate)
 
+    conversation.print_token_report()
+    collector.print_summary()
     # --- End of iterative collection ---
 
-    final_uris_for_new_playlist = collected_new_songs_for_playlist_uris[:TARGET_NEW_SONGS_COUNT]
-    final_details_for_all_recs_update = collected_new_songs_for_playlist_details[:TARGET_NEW_SONGS_COUNT]
+    final_uris_for_new_playlist = collector.uris
+    final_details_for_all_recs_update = collector.songs
 
     if not final_uris_for_new_playlist:
         print("\nNo new, verifiable songs were collected from the model after all attempts. Exiting.")
-        exit()
+        return None
 
     print(f"\nCollected {len(final_uris_for_new_playlist)} final new songs for '{NEW_PLAYLIST_NAME}'.")
 
-    # 5. Save to "New AI Recommendations" (replacing)
-    new_playlist_id = get_or_create_playlist_id(sp_client, user_id, NEW_PLAYLIST_NAME)
+    # 5. Save to "New AI Recommendations" (replacing its content, with the fewest writes)
+    new_playlist_id = playlist_ids.get(NEW_PLAYLIST_NAME)
     if new_playlist_id:
-        print(f"\nUpdating playlist '{NEW_PLAYLIST_NAME}' by replacing items...")
-        if update_playlist_items(sp_client, new_playlist_id, final_uris_for_new_playlist, replace=True):
-            playlist_url_new = sp_client.playlist(new_playlist_id)['external_urls']['spotify']
+        print(f"\nUpdating playlist '{NEW_PLAYLIST_NAME}'...")
+        with metrics.span("playlist_write", user=user_id, playlist=NEW_PLAYLIST_NAME):
+            synced = sync_playlist(sp_client, new_playlist_id, collector.songs, library_store, throttle)
+        if synced:
+            playlist_url_new = f"https://open.spotify.com/playlist/{new_playlist_id}"
             print(f"Successfully updated '{NEW_PLAYLIST_NAME}'. URL: {playlist_url_new}")
     else:
         print(f"Could not create or find playlist '{NEW_PLAYLIST_NAME}'.")
 
     # 6. Add these songs to "All AI Recommendations" (appending)
-    if all_recs_playlist_id and final_details_for_all_recs_update: # Use details to get URIs
-        uris_to_add_to_all_recs = [song['uri'] for song in final_details_for_all_recs_update]
-        print(f"\nAppending {len(uris_to_add_to_all_recs)} songs to '{ALL_RECS_PLAYLIST_NAME}'...")
-        if update_playlist_items(sp_client, all_recs_playlist_id, uris_to_add_to_all_recs, replace=False):
-            playlist_url_all = sp_client.playlist(all_recs_playlist_id)['external_urls']['spotify']
+    if all_recs_playlist_id and final_details_for_all_recs_update:
+        print(f"\nAppending {len(final_details_for_all_recs_update)} songs to '{ALL_RECS_PLAYLIST_NAME}'...")
+        with metrics.span("playlist_write", user=user_id, playlist=ALL_RECS_PLAYLIST_NAME):
+            appended = append_to_playlist(sp_client, all_recs_playlist_id, final_details_for_all_recs_update, library_store, throttle)
+        if appended:
+            warm_state.extend_history(all_recs_playlist_id, library_store.get_playlist_snapshot_id(all_recs_playlist_id),
+                                      final_details_for_all_recs_update)
+            playlist_url_all = f"https://open.spotify.com/playlist/{all_recs_playlist_id}"
             print(f"Successfully appended songs to '{ALL_RECS_PLAYLIST_NAME}'. URL: {playlist_url_all}")
     elif not all_recs_playlist_id:
             print(f"Could not find or create playlist '{ALL_RECS_PLAYLIST_NAME}' to append songs.")
+    return collector
+
+
+def get_provider_names_from_args(argv):
+    return next((arg.split("=", 1)[1].split(",") for arg in argv if arg.startswith("--providers=")), None)
+
+
+def check_provider_args(argv):
+    """Prints an error and returns False when --providers names a provider that is unknown or has no API key."""
+    available = configured_provider_names()
+    unavailable = [name for name in get_provider_names_from_args(argv) or [] if name not in available]
+    if unavailable:
+        print(f"Error: --providers: unknown provider or no API key in .env for {', '.join(map(repr, unavailable))} "
+              f"(available: {', '.join(available) or 'none'})."); return False
+    return True
+
+
+def get_provider_router_from_args(argv):
+    # Every provider with an API key gets the same prompt (--providers=openai,openrouter to choose),
+    # and streamed songs are verified before the model has finished answering (--no-stream to disable).
+    return build_provider_router(get_provider_names_from_args(argv),
+                                 stream=STREAM_MODEL_RESPONSES and "--no-stream" not in argv)
+
+
+def main(argv):
+    """
+    One run for one account; `argv` are the options (sys.argv[1:]):
+    [--full-sync] [--sequential] [--no-stream] [--providers=openai,openrouter] [--token-cache=PATH]
+    [--record=PATH] [--metrics-port=N]
+    """
+    if not ((SPOTIFY_API_PREFIX or (SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET and SPOTIFY_REDIRECT_URI))
+            and (OPENROUTER_API_KEY or OPENAI_API_KEY)):
+        print("Error: Missing environment variables. Please check .env file."); return 1
+    if not check_provider_args(argv): return 1
+
+    # --record=PATH saves every Spotify / model exchange of the run as a fixture for replay.py
+    record_path = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--record=")), None)
+    if record_path:
+        from replay import start_recording
+        start_recording(record_path)
+
+    # --metrics-port=N serves the run's counters and timings to Prometheus at http://127.0.0.1:N/metrics
+    metrics_port = next((int(arg.split("=", 1)[1]) for arg in argv if arg.startswith("--metrics-port=")), None)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    metrics.begin_run(mode="single", full_sync="--full-sync" in argv, pipelined="--sequential" not in argv)
+
+    # --token-cache=PATH keeps the login of another account in its own file (see batch.py)
+    token_cache = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--token-cache=")), SPOTIFY_TOKEN_CACHE)
+    sp_client = get_spotify_client(token_cache)
+    if not sp_client: return 1
+
+    provider_router = get_provider_router_from_args(argv)
+    library_store = LibraryStore(CACHE_DB_PATH)
+    # Cache of previous Spotify searches, so songs the model keeps suggesting aren't searched again
+    resolution_cache = ResolutionCache(CACHE_DB_PATH)
+    purged = resolution_cache.purge_expired()
+    if purged:
+        print(f"Dropped {purged} expired search results from the cache.")
+    # The model request for the next batch is sent while the current batch is verified (--sequential to disable)
+    collector = update_recommendation_playlists(
+        sp_client, provider_router, library_store, resolution_cache,
+        full_sync="--full-sync" in argv,
+        pipelined="--sequential" not in argv
+    )
+    provider_router.print_stats()
+    print_connection_stats()
+    print_scheduler_stats()
+    run_record = metrics.end_run(METRICS_LOG_PATH, collected=len(collector) if collector else 0)
+    metrics.print_stage_timings(run_record)
 
     print("\nScript finished :) !!!.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
 
@@ -0,0 +1,192 @@
+import random
+import zlib
+from collections import Counter
+
+from settings import TASTE_PROFILE_CLUSTERING
+from track_index import canonical_artist, canonical_title
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError: # Optional: without NumPy the prompt sample is a plain random one, even with clustering on
+    np = None
+    NUMPY_AVAILABLE = False
+
+EMBEDDING_DIM = 128 # Columns of the hashed feature matrix (float32: 100k songs take ~50 MB)
+TASTE_CLUSTERS = 24 # k-means clusters of the library the prompt sample is spread over
+KMEANS_ITERATIONS = 12
+TASTE_PROFILE_MAX_SONGS = 20000 # Larger libraries are profiled on a random subset of this size
+
+# Weights of the hashed features; the artist dominates so clusters roughly follow artists and scenes
+_ARTIST_WEIGHT = 2.0
+_WORD_WEIGHT = 1.0
+_TRIGRAM_WEIGHT = 0.5
+_METADATA_WEIGHT = 0.5
+
+
+def _artist_features(artist_name):
+    artist = canonical_artist(artist_name)
+    return [(f"a:{artist}", _ARTIST_WEIGHT)] + [(f"aw:{word}", _WORD_WEIGHT) for word in artist.split()]
+
+
+def _title_features(track_name):
+    title = canonical_title(track_name)
+    padded = f" {title} "
+    # Bare trigrams can't clash with the prefixed features: canonical titles have no ":"
+    return ([(f"w:{word}", _WORD_WEIGHT) for word in title.split()]
+            + [(padded[i:i + 3], _TRIGRAM_WEIGHT) for i in range(len(padded) - 2)])
+
+
+def _metadata_features(isrc, added_at):
+    features = []
+    if isrc and len(isrc) == 12: # CC-XXX-YY-NNNNN
+        features.append((f"cc:{isrc[:2].upper()}", _METADATA_WEIGHT))
+        features.append((f"y:{isrc[5:7]}", _METADATA_WEIGHT))
+    if added_at:
+        features.append((f"liked:{str(added_at)[:4]}", _METADATA_WEIGHT))
+    return features
+
+
+def song_features(track_name, artist_name, isrc=None, added_at=None):
+    """
+    Weighted string features of a song for embed_songs(): the canonical lead artist and its words,
+    the canonical title's words and character trigrams, and the cached metadata when known (ISRC
+    country and year of registration, year the song was liked).
+    """
+    return _artist_features(artist_name) + _title_features(track_name) + _metadata_features(isrc, added_at)
+
+
+def embed_songs(songs, dim=EMBEDDING_DIM):
+    """
+    L2-normalized float32 matrix (one row per song) of the hashed song_features(). `songs` are
+    {"track", "artist", ["isrc", "added_at"]} dicts or Recommendation records.
+    Features are hashed with CRC-32, so the same song gets the same row in every process (Python's
+    hash() of a string changes from one process to the next).
+    """
+    artist_cache = {} # Artists repeat a lot in a library: their features are built once
+    feature_hashes = {} # So are words and trigrams
+    slots, values = [], []
+    for row, song in enumerate(songs):
+        if isinstance(song, dict):
+            track, artist, isrc, added_at = song.get('track'), song.get('artist'), song.get('isrc'), song.get('added_at')
+        else:
+            track, artist, isrc, added_at = song.track, song.artist, None, None
+        if artist not in artist_cache:
+            artist_cache[artist] = _artist_features(artist)
+        offset = row * dim
+        for feature, weight in artist_cache[artist] + _title_features(track) + _metadata_features(isrc, added_at):
+            h = feature_hashes.get(feature)
+            if h is None:
+                h = feature_hashes[feature] = zlib.crc32(feature.encode())
+            slots.append(offset + h % dim)
+            values.append(weight if h & (1 << 20) else -weight) # Signed hashing: collisions cancel out on average
+    matrix = np.bincount(np.asarray(slots, dtype=np.intp), weights=np.asarray(values, dtype=np.float64),
+                         minlength=len(songs) * dim).astype(np.float32).reshape(len(songs), dim)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def spherical_kmeans(matrix, k, iterations=KMEANS_ITERATIONS, rng=None):
+    """
+    k-means on unit rows with cosine similarity (k-means++ seeding).
+    Returns (centroids, labels): a (k, dim) matrix of unit centroids and the cluster of every row.
+    """
+    rng = rng or np.random.default_rng()
+    n = len(matrix)
+    centroids = np.empty((k, matrix.shape[1]), dtype=matrix.dtype)
+    centroids[0] = matrix[rng.integers(n)]
+    closest = 1.0 - matrix @ centroids[0]
+    for i in range(1, k):
+        weights = np.maximum(closest, 0) ** 2
+        total = weights.sum()
+        centroids[i] = matrix[rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)]
+        closest = np.minimum(closest, 1.0 - matrix @ centroids[i])
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmax(matrix @ centroids.T, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.stack([matrix[labels == cluster].sum(axis=0) for cluster in range(k)])
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        if empty.any(): # Re-seed empty clusters on random songs
+            sums[empty] = matrix[rng.integers(n, size=int(empty.sum()))]
+            norms[empty] = 1.0
+        centroids = sums / norms[:, None]
+    return centroids, labels
+
+
+class TasteProfile:
+    """
+    Prompt sample and suggestion ranking for a song library.
+    By default sample() is a random sample, rank() keeps the model's order and score() is None (so the
+    pipeline holds nothing back). With `clustering` (TASTE_PROFILE_CLUSTERING) and NumPy, the hashed
+    embedding of every song (embed_songs) is grouped into TASTE_CLUSTERS k-means clusters: sample() then
+    covers every cluster in proportion to its size, with as many different artists as possible, and
+    score() / rank() rate suggestions in one matrix product by their similarity to the closest cluster.
+    Libraries too small to cluster get the random behaviour; those over `max_songs` are profiled on a
+    random subset (a few hundred songs drawn from it are as representative, and embedding is the costly part).
+    """
+
+    def __init__(self, songs, clustering=TASTE_PROFILE_CLUSTERING, n_clusters=TASTE_CLUSTERS, dim=EMBEDDING_DIM,
+                 seed=None, max_songs=TASTE_PROFILE_MAX_SONGS):
+        self._random = random.Random(seed)
+        self.songs = list(songs)
+        if len(self.songs) > max_songs:
+            self.songs = self._random.sample(self.songs, max_songs)
+        self.dim = dim
+        self.centroids = None
+        self.labels = None
+        if clustering and NUMPY_AVAILABLE and len(self.songs) >= 2 * n_clusters:
+            rng = np.random.default_rng(seed)
+            self.centroids, self.labels = spherical_kmeans(embed_songs(self.songs, dim), n_clusters, rng=rng)
+
+    @property
+    def clustered(self):
+        return self.centroids is not None
+
+    def sample(self, k):
+        """Up to `k` songs of the library, spread over its clusters (a fresh sample on every call)."""
+        if len(self.songs) <= k:
+            return self._random.sample(self.songs, len(self.songs))
+        if not self.clustered:
+            return self._random.sample(self.songs, k)
+
+        sizes = np.bincount(self.labels, minlength=len(self.centroids))
+        # Largest-remainder allocation of the k slots, proportional to the cluster sizes
+        shares = sizes * (k / sizes.sum())
+        quotas = np.floor(shares).astype(int)
+        for cluster in np.argsort(quotas - shares)[:k - quotas.sum()]:
+            quotas[cluster] += 1
+
+        sample = []
+        for cluster in np.flatnonzero(quotas):
+            members = np.flatnonzero(self.labels == cluster).tolist()
+            self._random.shuffle(members)
+            # First song of each artist before anybody's second one
+            artist_counts = Counter()
+            ranked = []
+            for index in members:
+                artist = self.songs[index].get('artist')
+                ranked.append((artist_counts[artist], len(ranked), index))
+                artist_counts[artist] += 1
+            ranked.sort()
+            sample.extend(self.songs[index] for _, _, index in ranked[:quotas[cluster]])
+        self._random.shuffle(sample)
+        return sample
+
+    def score(self, recommendations):
+        """Cosine similarity of each suggestion to its closest cluster centroid, or None without a profile."""
+        if not self.clustered or not recommendations:
+            return None
+        return (embed_songs(recommendations, self.dim) @ self.centroids.T).max(axis=1)
+
+    def rank(self, recommendations):
+        """The suggestions, closest to the library's taste first (unchanged without a profile)."""
+        scores = self.score(recommendations)
+        if scores is None:
+            return list(recommendations)
+        return [recommendations[i] for i in np.argsort(-scores, kind="stable")]
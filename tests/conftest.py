@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubModelServer:
+    """
+    Local OpenAI-compatible /chat/completions endpoint answering every request with `recommendations`,
+    streamed (one server-sent event per `chunk_size` characters, `chunk_delay` seconds apart) when the
+    request asks for it. `status` other than 200 answers with an error instead.
+    """
+
+    def __init__(self, recommendations, status=200, chunk_size=40, chunk_delay=0.0):
+        self.content = json.dumps({"recommendations": [{"track": track, "artist": artist}
+                                                       for track, artist in recommendations]})
+        self.status = status
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self.chunks_sent = 0
+        self.disconnected = threading.Event() # Set when the client closed a stream before its end
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.requests += 1
+                if server.status != 200:
+                    self._reply(server.status, {"error": {"message": "stub error"}})
+                elif body.get("stream"):
+                    self._stream()
+                else:
+                    self._reply(200, {"id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                                      "choices": [{"index": 0, "finish_reason": "stop",
+                                                   "message": {"role": "assistant", "content": server.content}}]})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                content = server.content
+                try:
+                    for i in range(0, len(content), server.chunk_size):
+                        self._event({"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                                     "choices": [{"index": 0, "finish_reason": None,
+                                                  "delta": {"content": content[i:i + server.chunk_size]}}]})
+                        server.chunks_sent += 1
+                        time.sleep(server.chunk_delay)
+                    self._event("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    server.disconnected.set()
+
+            def _event(self, payload):
+                data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub_model_server():
+    """Factory of StubModelServer instances, shut down after the test."""
+    servers = []
+
+    def start(recommendations, **options):
+        servers.append(StubModelServer(recommendations, **options))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
@@ -0,0 +1,60 @@
+from collector import RecommendationCollector
+from metrics import metrics
+from response_parser import Recommendation
+from track_index import TrackIndex
+
+
+def song(number, track=None, artist="Artist"):
+    return {"uri": f"spotify:track:{number}", "track": track or f"Song {number}", "artist": artist, "isrc": None}
+
+
+def make_collector(target_count=10):
+    liked_index = TrackIndex()
+    liked_index.add("Liked Song", "Artist", "spotify:track:liked")
+    history_index = TrackIndex()
+    history_index.add("Old Recommendation", "Artist", "spotify:track:old")
+    return RecommendationCollector(target_count, liked_index, history_index)
+
+
+def test_skipped_songs_are_counted_per_reason():
+    collector = make_collector()
+    metrics.begin_run()
+
+    assert collector(song(1))
+    assert not collector(song(1)) # Same URI
+    assert not collector(song(2, track="Song 1 - Remastered")) # Same canonical key
+    assert not collector(song(3, track="Liked Song"))
+    assert not collector(song("liked", track="Liked (another name)")) # Same URI as the liked song
+    assert not collector(song(4, track="Old Recommendation"))
+
+    counters = metrics.end_run()["counters"]
+    assert collector.skipped == {"collected": 2, "liked": 2, "history": 1}
+    assert collector.prefiltered == {}
+    assert counters['songs_collected_total'] == 1
+    assert counters['songs_skipped_total{reason="collected",stage="verified"}'] == 2
+    assert counters['songs_skipped_total{reason="liked",stage="verified"}'] == 2
+    assert counters['songs_skipped_total{reason="history",stage="verified"}'] == 1
+
+
+def test_prefiltered_suggestions_are_counted_apart():
+    collector = make_collector()
+    collector(song(1))
+    metrics.begin_run()
+
+    assert collector.prefilter(Recommendation("Song 1", "Artist")) == "collected"
+    assert collector.prefilter(Recommendation("Liked Song (feat. Someone)", "Artist")) == "liked"
+    assert collector.prefilter(Recommendation("Old Recommendation", "Artist")) == "history"
+    assert collector.prefilter(Recommendation("New Song", "Artist")) is None
+
+    counters = metrics.end_run()["counters"]
+    assert collector.prefiltered == {"collected": 1, "liked": 1, "history": 1}
+    assert collector.skipped == {}
+    assert all(counters[f'songs_skipped_total{{reason="{reason}",stage="prefilter"}}'] == 1
+               for reason in ("collected", "liked", "history"))
+
+
+def test_nothing_is_collected_or_counted_once_full():
+    collector = make_collector(target_count=1)
+    assert collector(song(1))
+    assert not collector(song(2))
+    assert len(collector) == 1 and collector.skipped == {}
@@ -0,0 +1,58 @@
+from conversation import ConversationContext
+from response_parser import Recommendation
+
+
+def follow_up(songs_to_avoid_str):
+    return f"Suggest more songs. Avoid these:\n{songs_to_avoid_str}"
+
+
+def songs(turn, count=10):
+    return [Recommendation(f"Song {turn}-{i}", f"Artist {turn}") for i in range(count)]
+
+
+def reply(suggested):
+    return "{\"recommendations\": [" + ", ".join(f"{{\"track\": \"{s.track}\", \"artist\": \"{s.artist}\"}}" for s in suggested) + "]}"
+
+
+def run_turns(conversation, turns):
+    suggested = []
+    for turn in range(turns):
+        conversation.messages()
+        suggested.extend(songs(turn))
+        conversation.add_reply(reply(songs(turn)), songs(turn))
+        conversation.add_follow_up(suggested)
+    return conversation.messages()
+
+
+def test_history_under_the_budget_is_sent_whole():
+    conversation = ConversationContext("Recommend songs.", follow_up, token_budget=100000)
+    messages = run_turns(conversation, 3)
+
+    assert len(messages) == 1 + 3 * 2
+    assert conversation.sent_token_counts == conversation.unpruned_token_counts
+
+
+def test_history_over_the_budget_is_folded_into_the_exclusion_list():
+    budget = 400
+    conversation = ConversationContext("Recommend songs.", follow_up, token_budget=budget)
+    messages = run_turns(conversation, 8)
+
+    assert messages[0]['content'] == "Recommend songs."
+    exclusion = messages[1]['content']
+    assert exclusion.startswith("Songs you already suggested earlier")
+    assert "Artist 0: Song 0-0;" in exclusion # Dropped turns still tell the model what to avoid
+    assert messages[-1]['role'] == "user" # The latest follow-up is always kept
+    assert conversation.sent_token_counts[-1] <= budget
+    assert conversation.unpruned_token_counts[-1] > budget
+    assert len(messages) < 1 + 8 * 2
+
+
+def test_follow_up_only_lists_songs_the_model_cannot_see():
+    conversation = ConversationContext("Recommend songs.", follow_up, token_budget=100000)
+    conversation.add_reply(reply(songs(0)), songs(0))
+    other_provider = [Recommendation("Other Song", "Other Artist")]
+    conversation.add_follow_up(songs(0) + other_provider)
+
+    follow_up_message = conversation.messages()[-1]['content']
+    assert "Other Artist: Other Song" in follow_up_message
+    assert "Song 0-0" not in follow_up_message
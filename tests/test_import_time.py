@@ -0,0 +1,35 @@
+import os
+import statistics
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from bench_import_time import cases, measure
+
+REPEAT = 3
+
+
+@pytest.fixture(scope="module")
+def scratch_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("import_time"))
+
+
+@pytest.fixture(scope="module")
+def baseline(scratch_dir):
+    top_level, _, _ = measure(["-c", "pass"], scratch_dir)
+    return top_level
+
+
+@pytest.mark.parametrize("name", [case[0] for case in cases("")])
+def test_import_budget(name, scratch_dir, baseline):
+    # Cases are looked up by name: their arguments point into the scratch directory
+    _, arguments, budget_ms, forbidden = next(case for case in cases(scratch_dir) if case[0] == name)
+    import_ms = []
+    for _ in range(REPEAT):
+        top_level, imported, _ = measure(arguments, scratch_dir)
+        import_ms.append(sum(us for module, us in top_level.items() if module not in baseline) / 1000)
+        assert not set(forbidden) & imported, f"{name} imported {sorted(set(forbidden) & imported)}"
+    if budget_ms is not None:
+        assert statistics.median(import_ms) <= budget_ms
@@ -0,0 +1,117 @@
+import pytest
+
+from helper_functions import sync_liked_songs
+from library_cache import LibraryStore
+from scheduler import RequestScheduler
+
+
+class FakeSpotify:
+    """Saved Tracks of `count` songs, newest first; the offsets in `failing_offsets` fail once."""
+
+    def __init__(self, count):
+        self.items = []
+        self.requested_offsets = []
+        self.failing_offsets = set()
+        self.add_songs(count)
+
+    def add_songs(self, count):
+        # Liked after every song already there: they come first
+        start = len(self.items)
+        new_items = [self._item(start + i) for i in range(count)]
+        self.items = list(reversed(new_items)) + self.items
+
+    def unlike(self, uri):
+        self.items = [item for item in self.items if item['track']['uri'] != uri]
+
+    @staticmethod
+    def _item(number):
+        return {"added_at": f"2026-01-01T{number // 3600:02d}:{number // 60 % 60:02d}:{number % 60:02d}Z",
+                "track": {"uri": f"spotify:track:{number}", "name": f"Song {number}", "artists": [{"name": "Artist"}],
+                          "external_ids": {}}}
+
+    def current_user_saved_tracks(self, limit=20, offset=0):
+        self.requested_offsets.append(offset)
+        if offset in self.failing_offsets:
+            self.failing_offsets.discard(offset)
+            raise ConnectionError("connection reset")
+        return {"items": self.items[offset:offset + limit], "total": len(self.items),
+                "next": "next-page" if offset + limit < len(self.items) else None}
+
+
+@pytest.fixture
+def library_store(tmp_path):
+    store = LibraryStore(str(tmp_path / "cache.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def throttle():
+    return RequestScheduler("test", max_retries=0)
+
+
+def stored_uris(library_store):
+    return {song['uri'] for song in library_store.get_liked_songs_details()}
+
+
+def test_first_sync_stores_the_whole_library(library_store, throttle):
+    sp = FakeSpotify(120)
+    assert sync_liked_songs(sp, library_store, throttle=throttle) == 120
+    assert stored_uris(library_store) == {item['track']['uri'] for item in sp.items}
+
+
+def test_incremental_sync_stops_at_the_first_known_song(library_store, throttle):
+    sp = FakeSpotify(200)
+    sync_liked_songs(sp, library_store, throttle=throttle)
+    sp.add_songs(30)
+    sp.requested_offsets.clear()
+
+    assert sync_liked_songs(sp, library_store, throttle=throttle) == 30
+    assert library_store.count() == 230
+    assert sp.requested_offsets == [0] # The 30 new songs and the first known one are on the first page
+
+
+def test_failed_page_stores_nothing_and_the_next_sync_catches_up(library_store, throttle):
+    sp = FakeSpotify(100)
+    sync_liked_songs(sp, library_store, throttle=throttle)
+    sp.add_songs(120)
+    sp.failing_offsets = {50}
+
+    assert sync_liked_songs(sp, library_store, throttle=throttle) == 0
+    assert library_store.count() == 100 # A partial walk would have skipped the songs of the failed page
+
+    assert sync_liked_songs(sp, library_store, throttle=throttle) == 120
+    assert stored_uris(library_store) == {item['track']['uri'] for item in sp.items}
+
+
+def test_full_sync_drops_songs_no_longer_liked(library_store, throttle):
+    sp = FakeSpotify(80)
+    sync_liked_songs(sp, library_store, throttle=throttle)
+    sp.unlike("spotify:track:3")
+
+    sync_liked_songs(sp, library_store, full=True, throttle=throttle)
+    assert library_store.count() == 79
+    assert "spotify:track:3" not in stored_uris(library_store)
+
+
+def test_incomplete_first_fetch_stores_nothing(library_store, throttle):
+    sp = FakeSpotify(300)
+    sp.failing_offsets = {150}
+
+    assert sync_liked_songs(sp, library_store, throttle=throttle) == 0
+    assert library_store.count() == 0 # The newest pages alone would make later syncs skip the rest
+
+    assert sync_liked_songs(sp, library_store, throttle=throttle) == 300
+    assert library_store.count() == 300
+
+
+def test_incomplete_full_sync_keeps_the_store(library_store, throttle):
+    sp = FakeSpotify(100)
+    sync_liked_songs(sp, library_store, throttle=throttle)
+    sp.add_songs(200)
+    sp.failing_offsets = {150}
+
+    assert sync_liked_songs(sp, library_store, full=True, throttle=throttle) == 0
+    assert library_store.count() == 100
+    assert sync_liked_songs(sp, library_store, throttle=throttle) == 200
+    assert stored_uris(library_store) == {item['track']['uri'] for item in sp.items}
@@ -0,0 +1,44 @@
+import json
+
+from metrics import Metrics
+
+
+def test_run_record_holds_the_deltas_of_the_run(tmp_path):
+    registry = Metrics()
+    registry.incr("songs_collected_total", 5)
+    registry.incr("api_requests_total", api="spotify", outcome="ok")
+    registry.observe("api_request_seconds", 2.0, api="spotify")
+
+    registry.begin_run(user="alice")
+    registry.incr("songs_collected_total", 3)
+    registry.incr("songs_skipped_total", reason="liked", stage="prefilter")
+    registry.observe("api_request_seconds", 0.5, api="spotify")
+    registry.observe("api_request_seconds", 0.25, api="spotify")
+    registry.set_gauge("suggestion_hit_rate", 0.4)
+    log_path = tmp_path / "runs.jsonl"
+    record = registry.end_run(str(log_path), collected=3)
+
+    assert record["info"] == {"user": "alice", "collected": 3}
+    assert record["counters"] == {"songs_collected_total": 3, 'songs_skipped_total{reason="liked",stage="prefilter"}': 1}
+    # The longest call of the run, not the 2s one before it
+    assert record["timings"] == {'api_request_seconds{api="spotify"}': {"count": 2, "sum": 0.75, "max": 0.5}}
+    assert record["gauges"] == {"suggestion_hit_rate": 0.4}
+    assert json.loads(log_path.read_text())["run_id"] == record["run_id"]
+
+
+def test_each_run_starts_from_zero():
+    registry = Metrics()
+    registry.begin_run()
+    registry.incr("model_rounds_total")
+    registry.observe("stage_seconds", 3.0, stage="model_turn")
+    registry.end_run()
+
+    registry.begin_run()
+    registry.observe("stage_seconds", 1.0, stage="model_turn")
+    record = registry.end_run()
+
+    assert record["counters"] == {}
+    assert record["timings"] == {'stage_seconds{stage="model_turn"}': {"count": 1, "sum": 1.0, "max": 1.0}}
+    # Cumulative values keep growing for Prometheus
+    assert 'spotifai_model_rounds_total 1' in registry.prometheus_text()
+    assert 'spotifai_stage_seconds{stage="model_turn",quantile="1"} 3.000000' in registry.prometheus_text()
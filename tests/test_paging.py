@@ -0,0 +1,47 @@
+import random
+import time
+
+from paging import AdaptiveThrottle, fetch_all_pages
+
+
+def make_fetch_page(total, failing_offsets=(), jitter=0.0, seed=0):
+    rng = random.Random(seed)
+    requested = []
+
+    def fetch_page(limit, offset):
+        requested.append(offset)
+        time.sleep(rng.random() * jitter) # Pages complete out of order
+        if offset in failing_offsets:
+            raise ConnectionError("connection reset")
+        return {"items": list(range(offset, min(offset + limit, total))), "total": total}
+
+    return fetch_page, requested
+
+
+def test_pages_are_reassembled_in_offset_order():
+    fetch_page, requested = make_fetch_page(1000, jitter=0.01)
+    items, complete = fetch_all_pages(fetch_page, limit=50, max_workers=8, throttle=AdaptiveThrottle(8))
+    assert complete
+    assert items == list(range(1000))
+    assert sorted(requested) == list(range(0, 1000, 50))
+
+
+def test_failed_page_returns_the_pages_before_it():
+    fetch_page, _ = make_fetch_page(1000, failing_offsets={300}, jitter=0.005)
+    items, complete = fetch_all_pages(fetch_page, limit=50, max_workers=8, throttle=AdaptiveThrottle(8))
+    assert not complete
+    assert items == list(range(300))
+
+
+def test_failed_first_page():
+    fetch_page, requested = make_fetch_page(1000, failing_offsets={0})
+    assert fetch_all_pages(fetch_page, limit=50, throttle=AdaptiveThrottle(8)) == ([], False)
+    assert requested == [0]
+
+
+def test_single_and_empty_pages():
+    fetch_page, requested = make_fetch_page(30)
+    assert fetch_all_pages(fetch_page, limit=50, throttle=AdaptiveThrottle(8)) == (list(range(30)), True)
+    assert requested == [0]
+    fetch_page, _ = make_fetch_page(0)
+    assert fetch_all_pages(fetch_page, limit=50, throttle=AdaptiveThrottle(8)) == ([], True)
@@ -0,0 +1,128 @@
+import itertools
+import threading
+import time
+
+from collector import SuggestionBudget
+from conversation import ConversationContext
+from pipeline import collect_recommendations
+from providers import Provider, ProviderRouter
+from response_parser import Recommendation, RecommendationResult
+from scheduler import RequestScheduler
+
+
+class FakeSpotify:
+    """Finds every song, except titles listed in `missing`; each search takes `delay` seconds."""
+
+    def __init__(self, missing=(), delay=0.0):
+        self.missing = set(missing)
+        self.delay = delay
+        self.searched = []
+
+    def search(self, q, type, limit):
+        track = q.split("track:", 1)[1].split(" artist:", 1)[0]
+        self.searched.append(track)
+        time.sleep(self.delay)
+        if track in self.missing:
+            return {"tracks": {"items": []}}
+        return {"tracks": {"items": [{"uri": f"spotify:track:{track}", "name": track, "artists": [{"name": "Artist"}]}]}}
+
+
+def plain_provider(songs_per_reply, delay=0.0):
+    """Provider whose n-th reply suggests "Song n-0" .. "Song n-k"; `calls` counts its requests."""
+    counter = itertools.count()
+    calls = []
+
+    def request(history):
+        reply = next(counter)
+        calls.append(reply)
+        time.sleep(delay)
+        return RecommendationResult([Recommendation(f"Song {reply}-{i}", "Artist") for i in range(songs_per_reply)], "{}")
+
+    return Provider("plain", request), calls
+
+
+def collect(sp, router, target_count, max_attempts=5, **options):
+    collected = []
+
+    def consider_song(song):
+        collected.append(song)
+        return True
+
+    conversation = ConversationContext("Recommend songs.", lambda size: "More songs.")
+    suggestions = collect_recommendations(sp, router, conversation, consider_song, target_count, max_attempts,
+                                          throttle=RequestScheduler("test", max_retries=0), **options)
+    return collected, suggestions
+
+
+def test_reaching_the_target_stops_the_streaming_request():
+    stopped = threading.Event()
+
+    def endless_stream(history, on_recommendation=None, cancel=None):
+        for i in itertools.count():
+            if cancel.is_set():
+                stopped.set()
+                return RecommendationResult.failed("cancelled")
+            on_recommendation(Recommendation(f"Song {i}", "Artist"))
+            time.sleep(0.005)
+
+    provider = Provider("stream", endless_stream, streaming=True)
+    collected, _ = collect(FakeSpotify(), ProviderRouter([provider]), target_count=5)
+
+    assert len(collected) == 5
+    assert stopped.wait(5)
+    assert provider.calls == 0 # A request stopped for its run is left out of the provider stats
+
+
+def test_pipelined_mode_asks_again_while_the_reply_is_verified():
+    provider, calls = plain_provider(10)
+    sp = FakeSpotify(missing={f"Song 0-{i}" for i in range(10)}, delay=0.02)
+    started = time.monotonic()
+    collected, _ = collect(sp, ProviderRouter([provider]), target_count=10, max_workers=1)
+
+    assert len(collected) == 10
+    assert calls[:2] == [0, 1]
+    # The second request went out with the first reply, not after its 10 searches (0.2s)
+    assert time.monotonic() - started < 0.2 + 0.2 + 0.15
+
+
+def test_sequential_mode_waits_for_the_verification():
+    provider, calls = plain_provider(10)
+    sp = FakeSpotify(missing={f"Song 0-{i}" for i in range(10)})
+    collected, suggestions = collect(sp, ProviderRouter([provider]), target_count=10, pipelined=False)
+
+    assert len(collected) == 10
+    assert calls == [0, 1]
+    assert len(suggestions) == 20
+
+
+def test_prefiltered_suggestion_is_never_searched():
+    provider, _ = plain_provider(10)
+    sp = FakeSpotify()
+    collected, _ = collect(sp, ProviderRouter([provider]), target_count=5,
+                           prefilter=lambda rec: "already liked" if rec.track == "Song 0-0" else None)
+
+    assert "Song 0-0" not in sp.searched
+    assert len(collected) == 5
+
+
+def test_no_speculative_round_when_the_searches_in_flight_fill_the_playlist():
+    provider, calls = plain_provider(25)
+    collected, _ = collect(FakeSpotify(delay=0.01), ProviderRouter([provider]), target_count=20, max_workers=2,
+                           suggestion_budget=SuggestionBudget(hit_rate=0.9))
+
+    assert len(collected) == 20
+    assert calls == [0] # 25 searches at a 90% hit rate are expected to find the 20 songs
+
+
+def test_speculative_round_on_an_expected_shortfall():
+    provider, calls = plain_provider(10)
+    sp = FakeSpotify(delay=0.02)
+    request_times = []
+    counted_provider = Provider("plain", lambda history: request_times.append(time.monotonic()) or provider.request_fn(history))
+    collected, _ = collect(sp, ProviderRouter([counted_provider]), target_count=20, max_workers=1,
+                           suggestion_budget=SuggestionBudget(hit_rate=0.9))
+
+    assert len(collected) == 20
+    assert calls[:2] == [0, 1]
+    # 10 searches at a 90% hit rate can't fill 20 songs: the second request didn't wait for them
+    assert request_times[1] - request_times[0] < 0.1
@@ -0,0 +1,81 @@
+import pytest
+from spotipy import SpotifyException
+
+import scheduler
+from helper_functions import get_or_create_playlist_ids
+from library_cache import LibraryStore
+from scheduler import RequestScheduler
+
+USER_ID = "user"
+
+
+class FakeSpotify:
+    """The user's playlists by ID; counts the single-playlist GETs, the playlist scans and the creations."""
+
+    def __init__(self, playlists):
+        self.playlists = {playlist_id: {"id": playlist_id, "name": name, "owner": {"id": owner}}
+                          for playlist_id, (name, owner) in playlists.items()}
+        self.gets = 0
+        self.scans = 0
+        self.created = []
+
+    def playlist(self, playlist_id, fields=None):
+        self.gets += 1
+        if playlist_id not in self.playlists:
+            raise SpotifyException(404, -1, "not found")
+        return self.playlists[playlist_id]
+
+    def current_user_playlists(self, limit=50):
+        self.scans += 1
+        return {"items": list(self.playlists.values()), "next": None}
+
+    def user_playlist_create(self, user, name, public=True):
+        playlist_id = f"created{len(self.created)}"
+        self.created.append(name)
+        self.playlists[playlist_id] = {"id": playlist_id, "name": name, "owner": {"id": user}}
+        return self.playlists[playlist_id]
+
+
+@pytest.fixture(autouse=True)
+def spotify_scheduler(monkeypatch):
+    monkeypatch.setattr(scheduler, "_schedulers", {"spotify": RequestScheduler("spotify", max_retries=0)})
+
+
+@pytest.fixture
+def library_store(tmp_path):
+    store = LibraryStore(str(tmp_path / "cache.db"))
+    yield store
+    store.close()
+
+
+def test_valid_cached_ids_skip_the_playlist_scan(library_store):
+    sp = FakeSpotify({"id1": ("New", USER_ID), "id2": ("All", USER_ID)})
+    library_store.set_playlist_ids({"New": "id1", "All": "id2"})
+
+    assert get_or_create_playlist_ids(sp, USER_ID, ["New", "All"], library_store) == {"New": "id1", "All": "id2"}
+    assert (sp.gets, sp.scans, sp.created) == (2, 0, [])
+
+
+@pytest.mark.parametrize("change", ["deleted", "renamed", "other owner"])
+def test_stale_cached_id_is_looked_up_again(library_store, change):
+    sp = FakeSpotify({"id1": ("New", USER_ID), "id2": ("All", USER_ID)})
+    library_store.set_playlist_ids({"New": "stale", "All": "id2"})
+    if change != "deleted":
+        sp.playlists["stale"] = {"id": "stale", "name": "New" if change == "other owner" else "Renamed",
+                                 "owner": {"id": "someone else" if change == "other owner" else USER_ID}}
+
+    assert get_or_create_playlist_ids(sp, USER_ID, ["New", "All"], library_store) == {"New": "id1", "All": "id2"}
+    assert sp.scans == 1 and sp.created == []
+    assert library_store.get_playlist_ids(["New", "All"]) == {"New": "id1", "All": "id2"}
+
+
+def test_missing_playlists_are_created_and_cached(library_store):
+    sp = FakeSpotify({"id2": ("All", USER_ID)})
+
+    assert get_or_create_playlist_ids(sp, USER_ID, ["New", "All"], library_store) == {"New": "created0", "All": "id2"}
+    assert sp.created == ["New"]
+    assert library_store.get_playlist_ids(["New", "All"]) == {"New": "created0", "All": "id2"}
+
+    sp.scans = 0
+    assert get_or_create_playlist_ids(sp, USER_ID, ["New", "All"], library_store) == {"New": "created0", "All": "id2"}
+    assert sp.scans == 0 and sp.created == ["New"]
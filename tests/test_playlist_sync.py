@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from playlist_sync import plan_playlist_sync
+
+
+def apply_plan(current_uris, plan):
+    """What Spotify's remove / add / reorder endpoints make of `current_uris` under `plan`."""
+    to_remove, to_add, moves = plan
+    uris = [uri for uri in current_uris if uri not in set(to_remove)] + to_add
+    for range_start, insert_before, range_length in moves:
+        moved = uris[range_start:range_start + range_length]
+        del uris[range_start:range_start + range_length]
+        if insert_before > range_start:
+            insert_before -= range_length
+        uris[insert_before:insert_before] = moved
+    return uris
+
+
+def test_unchanged_playlist_needs_no_request():
+    assert plan_playlist_sync(["a", "b", "c"], ["a", "b", "c"]) == ([], [], [])
+
+
+def test_removes_unwanted_and_duplicated_songs_and_adds_missing_ones():
+    to_remove, to_add, moves = plan_playlist_sync(["a", "x", "b", "a"], ["a", "b", "c"])
+    assert to_remove == ["a", "x"] # Every occurrence of a duplicated URI goes, the wanted one comes back
+    assert to_add == ["a", "c"]
+    assert apply_plan(["a", "x", "b", "a"], (to_remove, to_add, moves)) == ["a", "b", "c"]
+
+
+def test_desired_list_is_deduplicated():
+    plan = plan_playlist_sync([], ["a", "b", "a"])
+    assert plan == ([], ["a", "b"], [])
+
+
+def test_consecutive_songs_move_as_one_range():
+    _, _, moves = plan_playlist_sync(["d", "e", "a", "b", "c"], ["a", "b", "c", "d", "e"])
+    assert moves == [(2, 0, 3)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_plan_reaches_the_desired_playlist(seed):
+    rng = random.Random(seed)
+    catalog = [f"spotify:track:{i}" for i in range(30)]
+    current = [rng.choice(catalog) for _ in range(rng.randint(0, 25))]
+    desired = rng.sample(catalog, rng.randint(0, 20))
+
+    assert apply_plan(current, plan_playlist_sync(current, desired)) == desired
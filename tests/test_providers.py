@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+import providers
+from helper_functions import get_recommendations_openrouter, stream_recommendations_openai
+from providers import Provider, ProviderRouter, build_provider_router
+from spotify_playlist import check_provider_args
+from response_parser import Recommendation
+
+HISTORY = [{"role": "user", "content": "Recommend songs."}]
+
+
+def streaming_provider(name, server):
+    return Provider(name, lambda history, on_recommendation=None, cancel=None: stream_recommendations_openai(
+        "test-key", history, on_recommendation=on_recommendation, base_url=server.base_url, cancel=cancel
+    ), streaming=True)
+
+
+def plain_provider(name, server):
+    return Provider(name, lambda history: get_recommendations_openrouter("test-key", history, base_url=server.base_url))
+
+
+def test_router_fans_out_to_every_provider(stub_model_server):
+    streamed_server = stub_model_server([("Song A", "Artist A"), ("Song B", "Artist B")])
+    plain_server = stub_model_server([("Song C", "Artist C")])
+    router = ProviderRouter([streaming_provider("streamed", streamed_server), plain_provider("plain", plain_server)])
+    streamed = []
+
+    requests = router.submit(HISTORY, on_recommendation=lambda provider, rec: streamed.append((provider.name, rec)))
+    results = {provider.name: future.result(timeout=30) for provider, future in requests}
+
+    assert results["streamed"].recommendations == [Recommendation("Song A", "Artist A"), Recommendation("Song B", "Artist B")]
+    assert results["plain"].recommendations == [Recommendation("Song C", "Artist C")]
+    assert streamed == [("streamed", Recommendation("Song A", "Artist A")), ("streamed", Recommendation("Song B", "Artist B"))]
+    assert streamed_server.requests == plain_server.requests == 1
+    assert all(provider.calls == 1 and provider.latency_ewma is not None for provider in router.providers)
+
+
+def test_router_leaves_failing_provider_out_of_the_fan_out(stub_model_server):
+    working = plain_provider("working", stub_model_server([("Song A", "Artist A")]))
+    failing = plain_provider("failing", stub_model_server([], status=404)) # Not retried by the scheduler
+    router = ProviderRouter([working, failing])
+
+    for provider, future in router.submit(HISTORY):
+        future.result(timeout=30)
+    router.record_yield(working, 1, 1)
+
+    assert failing.failures == 1
+    assert router.select_providers() == [working]
+
+
+@pytest.fixture
+def only_openai_configured(monkeypatch):
+    monkeypatch.setattr(providers, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(providers, "OPENROUTER_API_KEY", None)
+
+
+def test_build_provider_router_rejects_unavailable_providers(only_openai_configured):
+    assert [provider.name.split(":")[0] for provider in build_provider_router(["openai"]).providers] == ["openai"]
+    with pytest.raises(ValueError, match="openrouter"):
+        build_provider_router(["openai", "openrouter"])
+    with pytest.raises(ValueError, match="claude"):
+        build_provider_router(["claude"])
+
+
+def test_check_provider_args_reports_unavailable_providers(only_openai_configured, capsys):
+    assert check_provider_args(["--providers=openai"])
+    assert check_provider_args([])
+    assert not check_provider_args(["--providers=openai,openrouter"])
+    assert "'openrouter'" in capsys.readouterr().out
+
+
+def test_cancel_closes_the_stream(stub_model_server):
+    server = stub_model_server([(f"Song {i}", "Artist") for i in range(40)], chunk_size=20, chunk_delay=0.02)
+    router = ProviderRouter([streaming_provider("streamed", server)])
+    cancel = threading.Event()
+    streamed = []
+
+    def on_recommendation(provider, rec):
+        streamed.append(rec)
+        if len(streamed) == 3:
+            cancel.set()
+
+    [(provider, future)] = router.submit(HISTORY, on_recommendation=on_recommendation, cancel=cancel)
+    result = future.result(timeout=30)
+
+    assert result.error == "cancelled"
+    assert len(streamed) == 3
+    assert server.disconnected.wait(10)
+    assert provider.calls == 0 # A request stopped for its run says nothing about the provider
@@ -0,0 +1,82 @@
+import pytest
+
+import resolution_cache
+from resolution_cache import CACHE_MISS, ResolutionCache
+
+FOUND = {"uri": "spotify:track:1", "track": "Imagine", "artist": "John Lennon", "isrc": "GBAYE0601498"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resolution_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "cache.db")
+
+
+@pytest.fixture
+def cache(db_path, clock):
+    cache = ResolutionCache(db_path, found_ttl=100, not_found_ttl=10)
+    yield cache
+    cache.close()
+
+
+def test_lookup_is_normalized_and_counts_hits(cache):
+    assert cache.lookup("Imagine", "John Lennon") is CACHE_MISS
+    cache.store("Imagine", "John Lennon", FOUND)
+    assert cache.lookup("  imagine ", "JOHN   LENNON") == FOUND
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_negative_cache(cache):
+    cache.store("Not A Song", "Nobody", None)
+    assert cache.lookup("Not A Song", "Nobody") is None
+    assert cache.is_known_miss("Not A Song", "Nobody")
+    cache.store("Imagine", "John Lennon", FOUND)
+    assert not cache.is_known_miss("Imagine", "John Lennon")
+    assert not cache.is_known_miss("Unknown", "Unknown")
+
+
+def test_entries_expire_after_their_ttl(cache, clock):
+    cache.store("Imagine", "John Lennon", FOUND)
+    cache.store("Not A Song", "Nobody", None)
+    clock.now += 11 # "Not found" expires first...
+    assert cache.lookup("Not A Song", "Nobody") is CACHE_MISS
+    assert not cache.is_known_miss("Not A Song", "Nobody")
+    assert cache.lookup("Imagine", "John Lennon") == FOUND
+    clock.now += 90 # ...then found songs
+    assert cache.lookup("Imagine", "John Lennon") is CACHE_MISS
+
+
+def test_results_persist_and_lru_evicts_from_memory_only(db_path, clock):
+    cache = ResolutionCache(db_path, capacity=2)
+    for i in range(3):
+        cache.store(f"Song {i}", "Artist", {**FOUND, "uri": f"spotify:track:{i}"})
+    assert len(cache._memory) == 2
+    assert cache.lookup("Song 0", "Artist")["uri"] == "spotify:track:0" # Read back from SQLite
+    cache.close()
+
+    reopened = ResolutionCache(db_path)
+    assert reopened.lookup("Song 2", "Artist")["uri"] == "spotify:track:2"
+    reopened.close()
+
+
+def test_purge_expired(cache, clock):
+    cache.store("Imagine", "John Lennon", FOUND)
+    cache.store("Not A Song", "Nobody", None)
+    assert cache.purge_expired() == 0
+    clock.now += 11
+    assert cache.purge_expired() == 1
+    assert cache.stored_counts() == (1, 0)
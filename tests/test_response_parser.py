@@ -0,0 +1,85 @@
+import json
+import random
+
+import pytest
+
+from response_parser import IncrementalRecommendationParser, Recommendation, parse_recommendations
+
+SONGS = [{"track": "Imagine", "artist": "John Lennon"}, {"track": "Sheita", "artist": "PNL"},
+         {"track": "Say \"Hello\" {live}", "artist": "Back\\slash"}]
+RECOMMENDATIONS = [Recommendation(song["track"], song["artist"]) for song in SONGS]
+
+
+@pytest.mark.parametrize("content", [
+    json.dumps({"recommendations": SONGS}),
+    json.dumps(SONGS),
+    json.dumps({"songs": SONGS}),
+])
+def test_fast_path_shapes(content):
+    assert parse_recommendations(content) == (RECOMMENDATIONS, "fast", None)
+
+
+@pytest.mark.parametrize("content", [
+    "```json\n" + json.dumps({"recommendations": SONGS}) + "\n```",
+    "Here are some songs you might like:\n" + json.dumps(SONGS) + "\nEnjoy!",
+])
+def test_recovers_json_wrapped_in_text(content):
+    assert parse_recommendations(content) == (RECOMMENDATIONS, "recovered", None)
+
+
+def test_salvages_complete_objects_of_a_truncated_response():
+    content = json.dumps({"recommendations": SONGS})[:-20]
+    recommendations, parse_path, error = parse_recommendations(content)
+    assert recommendations == RECOMMENDATIONS[:2]
+    assert parse_path == "recovered"
+    assert error
+
+
+def test_skips_invalid_items():
+    content = json.dumps([SONGS[0], {"track": "No artist"}, "text", {"track": "", "artist": "A"}, SONGS[1]])
+    recommendations, parse_path, error = parse_recommendations(content)
+    assert recommendations == RECOMMENDATIONS[:2]
+    assert parse_path == "recovered"
+    assert error == "skipped 3 invalid recommendation(s)"
+
+
+@pytest.mark.parametrize("content", [
+    json.dumps([{"track": 1999, "artist": "Prince"}]),
+    json.dumps([{"track": "", "artist": "Prince"}, SONGS[0]]),
+    json.dumps([SONGS[0], ["Sheita", "PNL"]]),
+])
+def test_fast_path_leaves_unexpected_values_to_recovery(content):
+    assert parse_recommendations(content)[1] != "fast"
+
+
+@pytest.mark.parametrize("content", ["", "I can't help with that.", json.dumps({"a": 1, "b": 2})])
+def test_no_recommendations(content):
+    recommendations, parse_path, error = parse_recommendations(content)
+    assert recommendations == [] and parse_path is None and error
+
+
+def test_incremental_parser_emits_each_object_when_it_closes():
+    content = json.dumps({"recommendations": SONGS})
+    first_close = content.index("}") + 1
+    parser = IncrementalRecommendationParser()
+
+    assert parser.feed(content[:first_close - 1]) == []
+    assert parser.feed(content[first_close - 1:first_close]) == RECOMMENDATIONS[:1]
+    assert parser.feed(content[first_close:]) == RECOMMENDATIONS[1:]
+    assert parser.text == content
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_parser_matches_whole_parse_for_any_chunking(seed):
+    rng = random.Random(seed)
+    content = "```json\n" + json.dumps({"recommendations": SONGS * 3}) + "\n```"
+    parser = IncrementalRecommendationParser()
+    streamed = []
+    position = 0
+    while position < len(content):
+        size = rng.randint(1, 12)
+        streamed.extend(parser.feed(content[position:position + size]))
+        position += size
+
+    assert streamed == RECOMMENDATIONS * 3
+    assert parse_recommendations(parser.text)[0] == streamed
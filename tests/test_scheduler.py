@@ -0,0 +1,102 @@
+import time
+
+import httpx
+import pytest
+from spotipy import SpotifyException
+
+import scheduler
+from helper_functions import get_or_create_playlist_ids
+from scheduler import RequestScheduler
+
+
+class FlakyCall:
+    """Raises the given errors in turn, then returns "ok"; `started` holds the time of every attempt."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.started = []
+
+    def __call__(self):
+        self.started.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def rate_limited(retry_after):
+    return SpotifyException(429, -1, "rate limited", headers={"Retry-After": str(retry_after)})
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(scheduler, "jittered_backoff", lambda attempt: 0)
+
+
+def test_transient_errors_are_retried():
+    call = FlakyCall(ConnectionError("reset"), SpotifyException(502, -1, "bad gateway"))
+    throttle = RequestScheduler("test", max_retries=3)
+
+    assert throttle.call(call) == "ok"
+    assert len(call.started) == 3
+    assert throttle.retried_count == 2
+
+
+def test_httpx_transport_errors_are_transient():
+    # scheduler.py doesn't import httpx itself: the model clients load it
+    assert scheduler.is_transient_error(httpx.ConnectTimeout("timed out"))
+    assert scheduler.is_transient_error(httpx.ReadError("connection reset"))
+    assert not scheduler.is_transient_error(httpx.DecodingError("bad gzip"))
+
+
+def test_other_errors_are_raised_at_once():
+    call = FlakyCall(SpotifyException(404, -1, "not found"))
+    with pytest.raises(SpotifyException):
+        RequestScheduler("test", max_retries=3).call(call)
+    assert len(call.started) == 1
+
+
+def test_gives_up_after_max_retries():
+    call = FlakyCall(*[ConnectionError("reset")] * 3)
+    with pytest.raises(ConnectionError):
+        RequestScheduler("test", max_retries=2).call(call)
+    assert len(call.started) == 3
+
+
+def test_rate_limit_waits_for_retry_after_and_halves_concurrency():
+    call = FlakyCall(rate_limited(0.2))
+    throttle = RequestScheduler("test", max_concurrency=8, max_retries=3)
+
+    assert throttle.call(call) == "ok"
+    assert call.started[1] - call.started[0] >= 0.2
+    assert throttle.rate_limited_count == 1
+    assert throttle.current_limit == 4
+
+
+def test_unsafe_writes_only_retry_rate_limits():
+    throttle = RequestScheduler("test", max_retries=3)
+    call = FlakyCall(ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        throttle.call(call, retry_transient=False)
+    assert len(call.started) == 1
+
+    call = FlakyCall(rate_limited(0))
+    assert throttle.call(call, retry_transient=False) == "ok"
+    assert len(call.started) == 2
+
+
+def test_playlist_creation_is_not_retried_on_a_timeout(monkeypatch):
+    class FakeSpotify:
+        created = 0
+
+        def current_user_playlists(self, limit=50):
+            return {"items": [], "next": None}
+
+        def user_playlist_create(self, user, name, public=True):
+            self.created += 1
+            raise TimeoutError("read timed out") # After Spotify created the playlist, maybe
+
+    monkeypatch.setattr(scheduler, "_schedulers", {"spotify": RequestScheduler("spotify", max_retries=3)})
+    sp = FakeSpotify()
+
+    assert get_or_create_playlist_ids(sp, "user", ["New Playlist"]) == {}
+    assert sp.created == 1
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from response_parser import Recommendation
+from taste_profile import NUMPY_AVAILABLE, TasteProfile, embed_songs
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARTISTS = ["Daft Punk", "Justice", "PNL", "Jul", "Queen", "Nirvana", "Miles Davis", "John Coltrane"]
+LIBRARY = [{"uri": f"spotify:track:{i}", "track": f"{word} {i}", "artist": ARTISTS[i % len(ARTISTS)]}
+           for i, word in enumerate(["Night", "Love", "Blue", "Fire", "Rain", "Gold"] * 20)]
+
+needs_numpy = pytest.mark.skipif(not NUMPY_AVAILABLE, reason="NumPy is not installed")
+
+
+def test_default_profile_is_a_random_sample():
+    profile = TasteProfile(LIBRARY, seed=0)
+    reply = [Recommendation("Unknown", "Nobody"), Recommendation("Night 0", "Daft Punk")]
+
+    assert not profile.clustered
+    sample = profile.sample(30)
+    assert len(sample) == 30 and all(song in LIBRARY for song in sample)
+    assert profile.score(reply) is None # Nothing is held back
+    assert profile.rank(reply) == reply
+
+
+@needs_numpy
+def test_clustering_is_opt_in():
+    profile = TasteProfile(LIBRARY, clustering=True, n_clusters=4, seed=0)
+    reply = [Recommendation("Unknown Words", "Nobody"), Recommendation("Night 0", "Daft Punk")]
+
+    assert profile.clustered
+    assert len(profile.sample(30)) == 30
+    assert profile.rank(reply) == reply[::-1] # A library song is closer to the library than an unrelated one
+
+
+@needs_numpy
+def test_embedding_is_the_same_in_every_process():
+    script = ("import sys, zlib; sys.path.insert(0, sys.argv[1]); from taste_profile import embed_songs; "
+              "print(zlib.crc32(embed_songs([{'track': 'Night 1', 'artist': 'Daft Punk', 'isrc': 'FRZ039800212'}]).tobytes()))")
+    checksums = {
+        subprocess.run([sys.executable, "-c", script, REPO_DIR], env={**os.environ, "PYTHONHASHSEED": str(seed)},
+                       capture_output=True, text=True, check=True).stdout
+        for seed in (1, 2)
+    }
+    assert len(checksums) == 1
@@ -0,0 +1,33 @@
+import pytest
+
+from track_index import TrackIndex, canonical_key
+
+
+@pytest.mark.parametrize("track, artist, expected", [
+    ("Song - Remastered 2011", "Queen", ("song", "queen")),
+    ("Song - Live at Wembley", "Queen", ("song", "queen")),
+    ("Song (feat. X)", "The Beatles", ("song", "beatles")),
+    ("Song [with Y]", "A feat. B", ("song", "a")),
+    ("Song ft. Z", "Artist", ("song", "artist")),
+    ("Beyoncé Été", "Beyoncé", ("beyonce ete", "beyonce")),
+    ("Don’t Stop Me Now", "Queen, David Bowie", ("dont stop me now", "queen")),
+    ("Hey, Jude!", "  The  Beatles ", ("hey jude", "beatles")),
+    ("Song", "Artist A & Artist B", ("song", "artist a")),
+])
+def test_canonical_key(track, artist, expected):
+    assert canonical_key(track, artist) == expected
+
+
+def test_canonical_key_keeps_distinct_songs_apart():
+    assert canonical_key("Love Me Do", "The Beatles") != canonical_key("Love Me Tender", "Elvis Presley")
+    assert canonical_key("Song", "Artist") != canonical_key("Song", "Other Artist")
+
+
+def test_index_matches_versions_of_a_known_song():
+    index = TrackIndex()
+    index.add("Bohemian Rhapsody", "Queen", uri="spotify:track:1", isrc="GBUM71029604")
+
+    assert index.match("Bohemian Rhapsody - Remastered 2011", "Queen") == "canonical"
+    assert index.match("Other title", "Other artist", uri="spotify:track:1") == "uri"
+    assert index.match("Other title", "Other artist", isrc="gbum71029604") == "isrc"
+    assert index.match("Bohemian Like You", "The Dandy Warhols") is None
@@ -0,0 +1,102 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from clients import get_requests_session
+from helper_functions import get_spotify_client
+from library_cache import LibraryStore
+from replay import StandInServer
+from resolution_cache import ResolutionCache
+from service import PlaylistService
+from synthetic_backend import SyntheticBackend
+from track_index import TrackIndex
+from warm_state import WarmState
+
+
+class CountingStore:
+    """Stands in for a LibraryStore: counts how often the liked songs and their index are read."""
+
+    def __init__(self, songs):
+        self.songs = songs
+        self.reads = 0
+        self.index_builds = 0
+
+    def get_liked_songs_details(self):
+        self.reads += 1
+        return list(self.songs)
+
+    def get_liked_songs_index(self, approximate=False):
+        self.index_builds += 1
+        return TrackIndex(approximate).add_many(self.songs)
+
+
+SONGS = [{"uri": f"spotify:track:{i}", "track": f"Song {i}", "artist": "Artist", "isrc": None} for i in range(10)]
+
+
+def test_library_parts_are_built_once_until_invalidated():
+    store = CountingStore(SONGS)
+    warm_state = WarmState()
+    index, profile = warm_state.liked_index(store), warm_state.taste_profile(store)
+
+    assert warm_state.liked_index(store) is index and warm_state.taste_profile(store) is profile
+    assert (store.reads, store.index_builds) == (1, 1)
+
+    store.songs = SONGS + [{"uri": "spotify:track:new", "track": "New Song", "artist": "Artist", "isrc": None}]
+    warm_state.invalidate_library()
+    assert warm_state.liked_index(store).match("New Song", "Artist")
+    assert len(warm_state.liked_songs(store)) == 11 and warm_state.taste_profile(store) is not profile
+    assert (store.reads, store.index_builds) == (2, 2)
+
+
+def test_history_index_follows_the_playlist_snapshot():
+    warm_state = WarmState()
+    index = warm_state.history_index("playlist", "snapshot1", SONGS[:5])
+
+    assert warm_state.history_index("playlist", "snapshot1", SONGS[:5]) is index
+    changed = warm_state.history_index("playlist", "snapshot2", SONGS[:6])
+    assert changed is not index and changed.match("Song 5", "Artist")
+    assert warm_state.history_index("playlist", None, SONGS[:6]) is not changed # Unknown snapshot: rebuilt
+
+
+def test_extended_history_is_reused_at_its_new_snapshot():
+    warm_state = WarmState()
+    index = warm_state.history_index("playlist", "snapshot1", SONGS[:5])
+    warm_state.extend_history("playlist", "snapshot2", SONGS[5:7])
+
+    assert warm_state.history_index("playlist", "snapshot2", SONGS[:7]) is index
+    assert index.match("Song 6", "Artist")
+
+    warm_state.extend_history("playlist", None, SONGS[7:8]) # Written, but the new snapshot is unknown
+    assert warm_state.history_index("playlist", "snapshot3", SONGS[:8]) is not index
+
+
+@pytest.fixture
+def playlist_service(tmp_path):
+    server = StandInServer(SyntheticBackend(300, history_size=50)).start()
+    db_path = str(tmp_path / "cache.db")
+    library_store, resolution_cache = LibraryStore(db_path), ResolutionCache(db_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sp = get_spotify_client(requests_session=get_requests_session(), api_prefix=server.spotify_prefix)
+    yield PlaylistService(sp, None, library_store, resolution_cache) # Refreshes don't ask the models
+    library_store.close()
+    resolution_cache.close()
+    server.close()
+
+
+def test_service_refresh_only_rebuilds_what_changed(playlist_service):
+    warm_state = playlist_service.warm_state
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert playlist_service.refresh()["liked_songs"] == 300
+        liked_index, history = warm_state._liked_index, dict(warm_state._history)
+
+        playlist_service.refresh() # Nothing new on Spotify
+        assert warm_state._liked_index is liked_index and warm_state._history == history
+
+        playlist_service.refresh(full_sync=True)
+    assert warm_state._liked_index is not liked_index
+    assert warm_state._history == history # Same snapshot of the history playlist
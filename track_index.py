@@ -0,0 +1,125 @@
+import re
+import unicodedata
+
+APPROXIMATE_MATCH_THRESHOLD = 0.8 # Minimum trigram Jaccard similarity between titles of the same artist
+
+# "Song - Remastered 2011", "Song - Live at Wembley", "Song - Radio Edit", "Song - 2009 Remaster", ...
+_VERSION_SUFFIX = re.compile(
+    r"\s+-\s+(?:[^-]*\b(?:remaster(?:ed)?|live|version|edit|mix|remix|mono|stereo|acoustic|demo|"
+    r"deluxe|bonus|single|instrumental|anniversary|from|recorded)\b.*)$"
+)
+# "(feat. X)", "[with X]", "(Remastered)", "(Live)", "(Radio Edit)", "(2011 Remaster)", ...
+_BRACKETED_EXTRA = re.compile(
+    r"\s*[(\[](?:feat\.?|ft\.?|featuring|with|prod\.?|[^)\]]*\b(?:remaster(?:ed)?|live|version|edit|mix|"
+    r"remix|mono|stereo|acoustic|demo|deluxe|bonus|instrumental|anniversary)\b)[^)\]]*[)\]]"
+)
+_TRAILING_FEATURE = re.compile(r"\s+(?:feat\.?|ft\.?|featuring)\s+.*$")
+# Only the lead artist is kept: Spotify search results carry the first artist, models often list all.
+_ARTIST_SEPARATOR = re.compile(r"\s*(?:,|&|\+|;|/|\bfeat\.?|\bft\.?|\bfeaturing\b|\bwith\b|\bx\b|\bvs\.?)\s+")
+_APOSTROPHES = re.compile(r"['\u2019`]")
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+def _fold(text):
+    # Lower-case, strip accents ("Beyoncé" -> "beyonce") and punctuation.
+    text = unicodedata.normalize("NFKD", str(text or "")).casefold()
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _APOSTROPHES.sub("", text)
+
+
+def canonical_title(title):
+    text = _fold(title)
+    text = _VERSION_SUFFIX.sub("", text)
+    text = _BRACKETED_EXTRA.sub("", text)
+    text = _TRAILING_FEATURE.sub("", text)
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def canonical_artist(artist):
+    text = _fold(artist)
+    text = _ARTIST_SEPARATOR.split(text, maxsplit=1)[0]
+    text = _NON_WORD.sub(" ", text)
+    text = _SPACES.sub(" ", text).strip()
+    if text.startswith("the "):
+        text = text[4:]
+    return text
+
+
+def canonical_key(track_name, artist_name):
+    return canonical_title(track_name), canonical_artist(artist_name)
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrackIndex:
+    """
+    Set of songs for de-duplication with three match tiers:
+    exact (Spotify URI or ISRC), canonical (normalized title + lead artist, see canonical_key) and an
+    optional approximate tier (title trigram similarity among the songs of the same canonical artist).
+    Every lookup is a few dict/set probes; the approximate tier only compares against the artist's own
+    songs, so it stays near O(1) for libraries of any size.
+    """
+
+    def __init__(self, approximate=False, threshold=APPROXIMATE_MATCH_THRESHOLD):
+        self.approximate = approximate
+        self.threshold = threshold
+        self.uris = set()
+        self.isrcs = set()
+        self.canonical_keys = set()
+        self._titles_by_artist = {} # canonical artist -> [(canonical title, trigrams, digits)]
+
+    def __len__(self):
+        return len(self.canonical_keys)
+
+    def add(self, track_name, artist_name, uri=None, isrc=None):
+        if uri:
+            self.uris.add(uri)
+        if isrc:
+            self.isrcs.add(isrc.upper())
+        key = canonical_key(track_name, artist_name)
+        if not key[0] or not key[1] or key in self.canonical_keys:
+            return
+        self.canonical_keys.add(key)
+        if self.approximate:
+            self._titles_by_artist.setdefault(key[1], []).append(
+                (key[0], _trigrams(key[0]), tuple(_DIGITS.findall(key[0])))
+            )
+
+    def add_many(self, songs):
+        """Adds dicts with "track", "artist" and optionally "uri" and "isrc" keys."""
+        for song in songs:
+            self.add(song.get('track'), song.get('artist'), song.get('uri'), song.get('isrc'))
+        return self
+
+    def match(self, track_name, artist_name, uri=None, isrc=None):
+        """Returns the tier that matched ("uri", "isrc", "canonical" or "approximate"), or None."""
+        if uri and uri in self.uris:
+            return "uri"
+        if isrc and isrc.upper() in self.isrcs:
+            return "isrc"
+        key = canonical_key(track_name, artist_name)
+        if key in self.canonical_keys:
+            return "canonical"
+        if self.approximate and key[0]:
+            candidates = self._titles_by_artist.get(key[1])
+            if candidates:
+                trigrams = _trigrams(key[0])
+                digits = tuple(_DIGITS.findall(key[0]))
+                for _, other_trigrams, other_digits in candidates:
+                    # "Part 2" vs "Part 3" look alike but are different songs
+                    if digits != other_digits:
+                        continue
+                    overlap = len(trigrams & other_trigrams)
+                    if overlap / (len(trigrams) + len(other_trigrams) - overlap) >= self.threshold:
+                        return "approximate"
+        return None
+
+    def __contains__(self, song):
+        track_name, artist_name = song
+        return self.match(track_name, artist_name) is not None
@@ -0,0 +1,57 @@
+from settings import APPROXIMATE_DEDUP
+from taste_profile import TasteProfile
+from track_index import TrackIndex
+
+
+class WarmState:
+    """
+    What a run builds from the local store, kept for the next run of the same account in the same
+    process (see service.py): the liked songs with their de-duplication index and taste profile, and the
+    index of each history playlist. Each part is only rebuilt when its source changed: the liked songs
+    after a sync fetched something, a history playlist when its snapshot_id moved.
+    A fresh WarmState (the default of update_recommendation_playlists) simply builds everything once.
+    """
+
+    def __init__(self):
+        self.user_info = None
+        self._liked_songs = None
+        self._liked_index = None
+        self._taste_profile = None
+        self._history = {} # playlist_id -> (snapshot_id, TrackIndex)
+
+    def invalidate_library(self):
+        self._liked_songs = self._liked_index = self._taste_profile = None
+
+    def liked_songs(self, library_store):
+        if self._liked_songs is None:
+            self._liked_songs = library_store.get_liked_songs_details()
+        return self._liked_songs
+
+    def liked_index(self, library_store):
+        if self._liked_index is None:
+            self._liked_index = library_store.get_liked_songs_index(approximate=APPROXIMATE_DEDUP)
+        return self._liked_index
+
+    def taste_profile(self, library_store):
+        if self._taste_profile is None:
+            self._taste_profile = TasteProfile(self.liked_songs(library_store))
+        return self._taste_profile
+
+    def history_index(self, playlist_id, snapshot_id, tracks):
+        """TrackIndex of a history playlist in the state (snapshot_id, tracks) just read from Spotify."""
+        cached_snapshot_id, index = self._history.get(playlist_id, (None, None))
+        if index is None or snapshot_id is None or cached_snapshot_id != snapshot_id:
+            index = TrackIndex(approximate=APPROXIMATE_DEDUP).add_many(tracks or [])
+            self._history[playlist_id] = (snapshot_id, index)
+        return index
+
+    def extend_history(self, playlist_id, snapshot_id, new_tracks):
+        """Songs appended to a history playlist by this run; `snapshot_id` is its new one, if known."""
+        cached_snapshot_id, index = self._history.get(playlist_id, (None, None))
+        if index is None:
+            return
+        if snapshot_id is None:
+            del self._history[playlist_id] # Can't tell the next read matches: rebuild then
+            return
+        index.add_many(new_tracks)
+        self._history[playlist_id] = (snapshot_id, index)